@@ -0,0 +1,84 @@
+"""
+Anchor targets: on-the-fly matching of padded batches (AnchorLabeler.label_batch)
+versus reading precomputed sparse targets from an AnchorTargetStore and collating
+them, on synthetic ground truth. Also reports the store size per image.
+
+    python -m benchmarks.anchor_targets --model_name efficientdet-d0 --batch_size 16
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+import config as cfg
+from benchmarks.common import measure, save_results, throughput_report
+from utils.targets import AnchorLabeler, AnchorTargetStore, collate_anchor_targets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Anchor targets benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--boxes', type=int, default=8, help='ground truth boxes per image')
+    parser.add_argument('--n_images', type=int, default=256)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--output', type=str, default='bench_anchor_targets.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def synthetic_boxes(n_images, n_boxes, image_size, seed=cfg.SEED):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, image_size, (n_images, n_boxes, 2))
+    sizes = rng.uniform(8, image_size / 2, (n_images, n_boxes, 2))
+    boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], -1).clip(0, image_size)
+    classes = rng.randint(1, cfg.NUM_CLASSES + 1, (n_images, n_boxes))
+    return torch.from_numpy(boxes).float(), torch.from_numpy(classes)
+
+
+def main(args):
+    image_size = cfg.get_model_info(args.model_name).IMAGE_SIZE
+    labeler = AnchorLabeler(image_size)
+    boxes, classes = synthetic_boxes(args.n_images, args.boxes, image_size)
+    img_ids = list(range(args.n_images))
+
+    targets = [labeler.label_anchors(b, c) for b, c in zip(boxes, classes)]
+    directory = tempfile.mkdtemp()
+    store = AnchorTargetStore.write(directory, img_ids, targets,
+                                    {'image_size': image_size, 'bucket_stride': None})
+    store_bytes = sum(os.path.getsize(os.path.join(directory, f))
+                      for f in os.listdir(directory))
+
+    batch_boxes = boxes[:args.batch_size].to(args.device)
+    batch_classes = classes[:args.batch_size].to(args.device)
+    batch_ids = img_ids[:args.batch_size]
+    modes = {
+        'on_the_fly': lambda: labeler.label_batch(batch_boxes, batch_classes),
+        'offline': lambda: {k: v.to(args.device) for k, v in collate_anchor_targets(
+            [store[img_id] for img_id in batch_ids]).items()},
+    }
+
+    results = []
+    for mode, step in modes.items():
+        timings = measure(step, args.device, args.warmup, args.iters)
+        entry = {'mode': mode, 'model': args.model_name, 'batch_size': args.batch_size,
+                 'boxes': args.boxes, 'store_bytes_per_image': store_bytes / args.n_images}
+        entry.update(throughput_report(timings, args.batch_size))
+        if mode == 'offline':
+            entry['speedup'] = results[0]['mean'] / entry['mean']
+            print('{} bs={}: offline targets {:.1f}x faster, {:.1f} KB per image'.format(
+                args.model_name, args.batch_size, entry['speedup'],
+                entry['store_bytes_per_image'] / 1024))
+        results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
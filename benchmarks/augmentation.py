@@ -0,0 +1,96 @@
+"""
+Training augmentation: random flip, scale jitter and crop applied per sample
+with PIL in the loader versus BatchAugmenter on whole collated uint8 batches.
+Reports images per second of the augmentation alone.
+
+    python -m benchmarks.augmentation --image_size 512 --batch_sizes 8 32 --threads 1 4
+"""
+import argparse
+
+import numpy as np
+import torch
+from PIL import Image
+
+import config as cfg
+from benchmarks.common import measure, save_results, throughput_report
+from utils.augmentation import BatchAugmenter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Batched augmentation benchmark')
+
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[8, 32])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--output', type=str, default='bench_augmentation.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def pil_augment(img, bbox, rng, flip_prob=cfg.FLIP_PROB, scale_range=cfg.SCALE_JITTER):
+    """ Per-sample reference: the same flip, jitter and crop with PIL and NumPy """
+    width, height = img.size
+    bbox = bbox.copy()
+    if rng.rand() < flip_prob:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+        bbox[:, 1], bbox[:, 3] = width - bbox[:, 3], width - bbox[:, 1]
+    scale = rng.uniform(*scale_range)
+    scaled_width, scaled_height = int(width * scale), int(height * scale)
+    img = img.resize((scaled_width, scaled_height), Image.BILINEAR)
+    offset_y = int(rng.rand() * max(scaled_height - height, 0))
+    offset_x = int(rng.rand() * max(scaled_width - width, 0))
+    img = img.crop((offset_x, offset_y, offset_x + width, offset_y + height))
+    bbox = bbox * scale - np.array([offset_y, offset_x, offset_y, offset_x])
+    bbox = np.minimum(np.maximum(bbox, 0), [height, width, height, width])
+    keep = (bbox[:, 2] > bbox[:, 0]) & (bbox[:, 3] > bbox[:, 1])
+    return np.asarray(img), bbox[keep]
+
+
+def synthetic_batch(batch_size, image_size, n_boxes=20, seed=cfg.SEED):
+    rng = np.random.RandomState(seed)
+    images = rng.randint(0, 256, (batch_size, image_size, image_size, 3), dtype=np.uint8)
+    corners = rng.uniform(0, image_size, (batch_size, n_boxes, 2, 2))
+    bbox = np.concatenate([corners.min(2), corners.max(2)], -1).astype(np.float32)
+    cls = rng.randint(1, cfg.NUM_CLASSES + 1, (batch_size, n_boxes))
+    return images, bbox, cls
+
+
+def main(args):
+    results = []
+    for batch_size in args.batch_sizes:
+        images, bbox, cls = synthetic_batch(batch_size, args.image_size)
+        pil_images = [Image.fromarray(img) for img in images]
+
+        x = torch.from_numpy(images).permute(0, 3, 1, 2).contiguous().to(args.device)
+        boxes = torch.from_numpy(bbox).to(args.device)
+        classes = torch.from_numpy(cls).to(args.device)
+        augmenter = BatchAugmenter()
+
+        for n_threads in args.threads:
+            torch.set_num_threads(n_threads)
+            rng = np.random.RandomState(cfg.SEED)
+            modes = {
+                'pil': ('cpu', lambda: [pil_augment(img, bbox[i], rng)
+                                        for i, img in enumerate(pil_images)]),
+                'batched': (args.device, lambda: augmenter(x, boxes, classes)),
+            }
+            for mode, (device, step) in modes.items():
+                timings = measure(step, device, args.warmup, args.iters)
+                entry = {'mode': mode, 'device': device, 'batch_size': batch_size,
+                         'image_size': args.image_size, 'threads': n_threads}
+                entry.update(throughput_report(timings, batch_size))
+                if mode == 'batched':
+                    entry['speedup'] = results[-1]['mean'] / entry['mean']
+                    print('bs={} threads={} {}: {:.2f}x'.format(
+                        batch_size, n_threads, device, entry['speedup']))
+                results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,79 @@
+"""
+Batch arena: preprocessing latency and per-batch allocations of preprocess
+building a fresh batch (per-image canvases, collate, normalize) versus
+resizing straight into reused BatchArena buffers, on synthetic JPEG images.
+Allocations are measured with the torch profiler (tensor memory) and
+tracemalloc (NumPy arrays), PIL's internal decode/resize buffers are not counted.
+
+    python -m benchmarks.batch_arena --batch_sizes 1 8 16 --image_size 512
+"""
+import argparse
+import tempfile
+import tracemalloc
+
+from torch.profiler import ProfilerActivity, profile
+
+from benchmarks.common import measure, save_results, synthetic_images, throughput_report
+from utils.processing import BatchArena, preprocess
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Batch arena benchmark')
+
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 16])
+    parser.add_argument('--source_size', type=int, nargs=2, default=[480, 640],
+                        help='(height, width) of the synthetic images')
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--output', type=str, default='bench_batch_arena.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def allocations(fn):
+    """ Bytes allocated by one call: tensors (torch profiler) and the
+    peak of NumPy arrays alive at once (tracemalloc) """
+    tracemalloc.start()
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    _, numpy_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tensor_bytes = sum(event.self_cpu_memory_usage for event in prof.key_averages()
+                       if event.key != '[memory]' and event.self_cpu_memory_usage > 0)
+    return tensor_bytes, numpy_peak
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    paths = synthetic_images(directory, max(args.batch_sizes), tuple(args.source_size))
+
+    results = []
+    for batch_size in args.batch_sizes:
+        images = paths[:batch_size]
+        arena = BatchArena()
+        modes = {'fresh': lambda: preprocess(images, image_size=args.image_size),
+                 'arena': lambda: preprocess(images, image_size=args.image_size, arena=arena)}
+        for mode, fn in modes.items():
+            timings = measure(fn, 'cpu', args.warmup, args.iters)
+            tensor_bytes, numpy_bytes = allocations(fn)
+            entry = {'mode': mode, 'batch_size': batch_size, 'image_size': args.image_size,
+                     'tensor_alloc_bytes': tensor_bytes, 'numpy_peak_bytes': numpy_bytes}
+            entry.update(throughput_report(timings, batch_size))
+            if mode == 'arena':
+                entry.update({'speedup': results[-1]['mean'] / entry['mean'],
+                              'arena_bytes': arena.nbytes})
+                print('bs={}: {:.2f}x faster, allocations per batch {:.1f} MB -> {:.1f} MB '
+                      '(tensors) and {:.1f} MB -> {:.1f} MB (NumPy peak), arena {:.1f} MB'.format(
+                          batch_size, entry['speedup'],
+                          results[-1]['tensor_alloc_bytes'] / 2 ** 20, tensor_bytes / 2 ** 20,
+                          results[-1]['numpy_peak_bytes'] / 2 ** 20, numpy_bytes / 2 ** 20,
+                          arena.nbytes / 2 ** 20))
+            results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,115 @@
+"""
+Square letterbox vs aspect ratio bucketed inputs.
+Runs val2017 images (or synthetic 16:9 frames if the set is not available)
+through DetectionWrapper and reports throughput and the fraction of padded pixels.
+
+    python -m benchmarks.bucketing --model_name efficientdet-d0 --limit 500
+"""
+import argparse
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+import config as cfg
+from benchmarks.common import build_model, save_results, synthetic_images
+from utils import DetectionWrapper
+from utils.transforms import get_bucket
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Aspect ratio bucketing benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--images', default=str(cfg.VAL_SET), type=str)
+    parser.add_argument('--limit', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_bucketing.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def make_batches(image_paths, batch_size, image_size, bucketing):
+    if not bucketing:
+        return [image_paths[i:i + batch_size]
+                for i in range(0, len(image_paths), batch_size)]
+
+    groups = defaultdict(list)
+    for path in image_paths:
+        width, height = Image.open(path).size
+        groups[get_bucket(width, height, image_size,
+                          cfg.BUCKET_STRIDE)].append(path)
+    batches = []
+    for bucket in sorted(groups):
+        paths = groups[bucket]
+        batches += [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    return batches
+
+
+def padding_fraction(image_paths, batches, image_size, bucketing):
+    """ Share of the input pixels that are letterbox padding """
+    content, canvas = 0, 0
+    for batch in batches:
+        sizes = [Image.open(path).size for path in batch]
+        if bucketing:
+            buckets = [get_bucket(w, h, image_size, cfg.BUCKET_STRIDE)
+                       for w, h in sizes]
+            canvas_h, canvas_w = max(b[0] for b in buckets), max(b[1] for b in buckets)
+        else:
+            canvas_h, canvas_w = image_size, image_size
+        for w, h in sizes:
+            scale = min(canvas_h / h, canvas_w / w)
+            content += int(w * scale) * int(h * scale)
+            canvas += canvas_h * canvas_w
+    return 1. - content / canvas
+
+
+def run(wrapper, batches):
+    n_images = 0
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            wrapper(batch)
+            n_images += len(batch)
+    return n_images / (time.perf_counter() - start)
+
+
+def main(args):
+    model = build_model(args.model_name, args.device)
+    wrapper = DetectionWrapper(model, args.device)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images_dir = Path(args.images)
+        if images_dir.exists():
+            image_paths = sorted(images_dir.glob('*.jpg'))[:args.limit]
+        else:
+            print('{} not found, using synthetic 16:9 frames'.format(images_dir))
+            image_paths = synthetic_images(tmp_dir, args.limit, (1080, 1920))
+
+        # warm up
+        with torch.no_grad():
+            wrapper(image_paths[:1])
+
+        results = []
+        for bucketing in [False, True]:
+            cfg.ASPECT_BUCKETING = bucketing
+            batches = make_batches(image_paths, args.batch_size, model.image_size, bucketing)
+            entry = {'model': args.model_name, 'bucketing': bucketing,
+                     'n_images': len(image_paths), 'n_batches': len(batches),
+                     'padding_fraction': padding_fraction(image_paths, batches,
+                                                 model.image_size, bucketing),
+                     'images_per_sec': run(wrapper, batches)}
+            print(entry)
+            results.append(entry)
+
+    results[1]['speedup'] = results[1]['images_per_sec'] / results[0]['images_per_sec']
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
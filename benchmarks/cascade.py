@@ -0,0 +1,70 @@
+"""
+Average cost per image versus mAP on val2017 for the small and large variants
+alone and for the confidence-gated cascade at several escalation thresholds.
+Uses the released (or local) pre-trained weights and needs COCO val2017.
+
+    python -m benchmarks.cascade --small efficientdet-d0 --large efficientdet-d3 \
+        --max_uncertain 0 1 2 4 8 --limit 500
+"""
+import argparse
+
+import config as cfg
+from benchmarks.common import save_results
+from model import EfficientDet
+from utils import DetectionWrapper
+from utils.cascade import CascadeDetectionWrapper
+from validation import evaluate
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Cascade benchmark')
+
+    parser.add_argument('--small', default='efficientdet-d0', type=str)
+    parser.add_argument('--large', default='efficientdet-d3', type=str)
+    parser.add_argument('--max_uncertain', nargs='+', type=int,
+                        default=[0, 1, 2, 4, 8])
+    parser.add_argument('--low_score', default=cfg.CASCADE_LOW_SCORE, type=float)
+    parser.add_argument('--high_score', default=cfg.CASCADE_HIGH_SCORE, type=float)
+    parser.add_argument('--limit', default=None, type=int,
+                        help='evaluate on the first N val2017 images')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_cascade.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def run(name, wrapper, image_ids):
+    stats, images_per_sec = evaluate(wrapper, image_ids)
+    entry = {'mode': name, 'mAP': float(stats[0]), 'AP50': float(stats[1]),
+             'seconds_per_image': 1. / images_per_sec}
+    if isinstance(wrapper, CascadeDetectionWrapper):
+        entry['escalation_rate'] = wrapper.stats()['escalation_rate']
+    print(entry)
+    return entry
+
+
+def main(args):
+    from pycocotools.coco import COCO
+
+    image_ids = sorted(COCO(cfg.VAL_ANNOTATIONS).getImgIds())[:args.limit]
+    small = DetectionWrapper(
+        EfficientDet.from_pretrained(args.small).to(args.device).eval(), args.device)
+    large = DetectionWrapper(
+        EfficientDet.from_pretrained(args.large).to(args.device).eval(), args.device)
+
+    results = [run(args.small, small, image_ids), run(args.large, large, image_ids)]
+    for max_uncertain in args.max_uncertain:
+        cascade = CascadeDetectionWrapper(small, large, args.low_score,
+                                          args.high_score, max_uncertain)
+        entry = run('cascade', cascade, image_ids)
+        entry['max_uncertain'] = max_uncertain
+        results.append(entry)
+
+    for entry in results:
+        entry['relative_cost'] = entry['seconds_per_image'] / results[1]['seconds_per_image']
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,83 @@
+"""
+Class-subset inference: latency and memory of the full 90-class model
+versus a derived model whose classifier head only predicts a whitelist.
+
+    python -m benchmarks.class_subset --model_name efficientdet-d0 \
+        --category_ids 1 2 3 4 6 8 --batch_size 4
+"""
+import argparse
+import tempfile
+
+import torch
+
+from benchmarks.common import (build_model, measure, save_results,
+                               synthetic_images, throughput_report)
+from utils import DetectionWrapper
+from utils.processing import postprocess, preprocess
+
+
+PATHS = ['model', 'postprocess', 'end2end']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Class-subset benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--category_ids', nargs='+', type=int, default=[1, 2, 3, 4, 6, 8],
+                        help='COCO category ids to keep (default: person and vehicles)')
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_class_subset.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def classifier_memory(cls_outs):
+    """ Size of the classifier head outputs of a batch in MB """
+    return sum(out.numel() * out.element_size() for out in cls_outs) / 2 ** 20
+
+
+def main(args):
+    model = build_model(args.model_name, args.device)
+    models = {'full': model, 'subset': model.class_subset(args.category_ids)}
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = synthetic_images(tmp_dir, args.batch_size, (480, 640))
+        x, _, _ = preprocess(image_paths, image_size=model.image_size)
+        x = x.to(args.device)
+
+        for mode, mode_model in models.items():
+            wrapper = DetectionWrapper(mode_model, args.device)
+            with torch.no_grad():
+                cls_outs, box_outs = mode_model(x)
+
+            steps = {
+                'model': lambda: mode_model(x),
+                'postprocess': lambda: postprocess(cls_outs, box_outs, mode_model.num_classes),
+                'end2end': lambda: wrapper(image_paths),
+            }
+            for path in PATHS:
+                with torch.no_grad():
+                    timings = measure(steps[path], args.device, args.warmup, args.iters)
+                entry = {'model': args.model_name, 'mode': mode, 'path': path,
+                         'num_classes': mode_model.num_classes,
+                         'batch_size': args.batch_size,
+                         'head_out_channels': mode_model.classifier.head.conv_pw.out_channels,
+                         'classifier_output_mb': classifier_memory(cls_outs)}
+                entry.update(throughput_report(timings, args.batch_size))
+                print(entry)
+                results.append(entry)
+
+    for entry in results[len(PATHS):]:
+        full = next(e for e in results if e['mode'] == 'full' and e['path'] == entry['path'])
+        entry['speedup'] = full['mean'] / entry['mean']
+        print('{}: {:.2f}x faster'.format(entry['path'], entry['speedup']))
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,78 @@
+"""
+Cold start: time from a fresh interpreter to the first detection with
+EfficientDet.from_pretrained, each run in a new process.
+A random-weight local checkpoint is used, so no downloads are needed.
+
+    python -m benchmarks.cold_start --model_name efficientdet-d0 --runs 3
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--runs', default=3, type=int)
+    parser.add_argument('--output', type=str, default='bench_cold_start.json')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--weights', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--image', type=str, help=argparse.SUPPRESS)
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def child(args):
+    """ Runs inside a fresh process, prints phase timings as JSON """
+    start = time.perf_counter()
+    import torch
+    from model import EfficientDet
+    from utils import DetectionWrapper
+    timings = {'import': time.perf_counter() - start}
+
+    model = EfficientDet.from_pretrained(args.model_name, args.weights).eval()
+    timings['build'] = time.perf_counter() - start - timings['import']
+
+    with torch.no_grad():
+        DetectionWrapper(model, 'cpu')([args.image])
+    timings['first_detection'] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def main(args):
+    from benchmarks.common import build_model, save_results, synthetic_images
+    import torch
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        weights = Path(tmp_dir) / '{}.pth'.format(args.model_name)
+        torch.save(build_model(args.model_name).state_dict(), weights)
+        image = synthetic_images(tmp_dir, 1, (480, 640))[0]
+
+        for run in range(args.runs):
+            start = time.perf_counter()
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.cold_start', '--child',
+                 '--model_name', args.model_name,
+                 '--weights', str(weights), '--image', str(image)])
+            entry = {'model': args.model_name, 'run': run,
+                     'process_wall_time': time.perf_counter() - start}
+            entry.update(json.loads(output.decode().strip().splitlines()[-1]))
+            print(entry)
+            results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        child(arguments)
+    else:
+        main(arguments)
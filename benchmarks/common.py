@@ -0,0 +1,100 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+import config as cfg
+from model import EfficientDet
+from utils.profiler import latency_summary, peak_rss
+
+
+BENCHMARK_MODELS = ['efficientdet-d' + str(i) for i in range(6)]
+
+
+def build_model(model_name, device='cpu'):
+    """ EfficientDet with randomly initialized weights, no downloads """
+    model = EfficientDet(model_name)
+    model._initialize_weights()
+    return model.to(device).eval()
+
+
+def synthetic_images(directory, n_images, image_size, seed=cfg.SEED):
+    """ Writes random JPEG images to a directory,
+    image_size is either an integer or a (height, width) tuple """
+    height, width = (image_size, image_size) \
+        if isinstance(image_size, int) else image_size
+    rng = np.random.RandomState(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for idx in range(n_images):
+        path = directory / 'synthetic_{}x{}_{}.jpg'.format(height, width, idx)
+        if not path.exists():
+            pixels = rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def measure(fn, device, n_warmup, n_iters):
+    """ Runs fn n_iters times after n_warmup runs, returns latencies in seconds """
+    for _ in range(n_warmup):
+        fn()
+    synchronize(device)
+
+    timings = []
+    for _ in range(n_iters):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def throughput_report(timings, batch_size):
+    report = latency_summary(timings)
+    report['images_per_sec'] = batch_size * len(timings) / sum(timings) \
+        if timings else 0.
+    report['peak_rss_mb'] = peak_rss() / 2 ** 20
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'cuda': torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save_results(path, args, results):
+    report = {'environment': environment(),
+              'args': {k: v for k, v in vars(args).items()},
+              'results': results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4, default=str)
+    print('Saved results to {}'.format(path))
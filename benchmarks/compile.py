@@ -0,0 +1,93 @@
+"""
+Eager versus torch.compile throughput of the static-shape model
+(EfficientDet.specialize) for inference and training steps.
+Reports compilation time and the number of graph breaks.
+
+    python -m benchmarks.compile --model_name efficientdet-d0 --batch_size 2
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.common import (build_model, measure, save_results,
+                               synchronize, throughput_report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='torch.compile benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--batch_size', default=2, type=int)
+    parser.add_argument('--modes', nargs='+', default=['eval', 'train'],
+                        choices=['eval', 'train'])
+    parser.add_argument('--backend', default='inductor', type=str)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_compile.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def make_step(model, x, mode):
+    if mode == 'eval':
+        def step():
+            with torch.no_grad():
+                return model(x)
+        return step
+
+    def step():
+        model.zero_grad(set_to_none=True)
+        cls_outputs, box_outputs = model(x)
+        loss = sum(out.float().mean() for out in cls_outputs + box_outputs)
+        loss.backward()
+        return loss
+    return step
+
+
+def graph_breaks(model, x):
+    import torch._dynamo as dynamo
+
+    dynamo.reset()
+    explanation = dynamo.explain(model)(x)
+    dynamo.reset()
+    return explanation.graph_break_count
+
+
+def main(args):
+    results = []
+    for mode in args.modes:
+        model = build_model(args.model_name, args.device).specialize()
+        model.train(mode == 'train')
+        x = torch.randn(args.batch_size, 3, model.image_size, model.image_size,
+                        device=args.device)
+
+        entry = {'model': args.model_name, 'mode': mode, 'backend': 'eager',
+                 'batch_size': args.batch_size}
+        entry.update(throughput_report(
+            measure(make_step(model, x, mode), args.device, args.warmup, args.iters),
+            args.batch_size))
+        print(entry)
+        results.append(entry)
+
+        entry = {'model': args.model_name, 'mode': mode, 'backend': args.backend,
+                 'batch_size': args.batch_size, 'graph_breaks': graph_breaks(model, x)}
+        compiled_step = make_step(torch.compile(model, backend=args.backend), x, mode)
+        start = time.perf_counter()
+        compiled_step()
+        synchronize(args.device)
+        entry['compile_time'] = time.perf_counter() - start
+        entry.update(throughput_report(
+            measure(compiled_step, args.device, args.warmup, args.iters),
+            args.batch_size))
+        entry['speedup'] = results[-1]['mean'] / entry['mean']
+        print(entry)
+        results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
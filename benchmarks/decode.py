@@ -0,0 +1,88 @@
+"""
+JPEG decoding: per-image decode and resize time of full-resolution decoding
+versus draft decoding at a reduced DCT scale (DRAFT_DECODING), on synthetic
+JPEG images of several source sizes. Also reports the PSNR of the draft
+decoded inputs against the full-resolution ones, and checks that caller-owned
+PIL images are left untouched (resizing one twice gives the same input).
+
+    python -m benchmarks.decode --source_sizes 480 640 1500 2000 3000 4000 --image_size 512
+"""
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import config as cfg
+from benchmarks.common import measure, save_results, synthetic_images, throughput_report
+from utils.processing import open_image, resize_image
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='JPEG draft decoding benchmark')
+
+    parser.add_argument('--n_images', type=int, default=8)
+    parser.add_argument('--source_sizes', type=int, nargs='+', default=[480, 640, 1500, 2000],
+                        help='(height, width) pairs of the synthetic images')
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--output', type=str, default='bench_decode.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def decode(paths, image_size, draft):
+    cfg.DRAFT_DECODING = draft
+    return [resize_image(open_image(path), image_size)[0] for path in paths]
+
+
+def reused_identical(path, image_size):
+    """ The same PIL image object resized twice gives identical inputs and scales """
+    pil_img = Image.open(path)
+    (first, first_scale), (second, second_scale) = \
+        [resize_image(pil_img, image_size) for _ in range(2)]
+    return np.array_equal(first, second) and first_scale == second_scale
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main(args):
+    directory = Path(tempfile.mkdtemp())
+    draft_decoding = cfg.DRAFT_DECODING
+    sizes = list(zip(args.source_sizes[::2], args.source_sizes[1::2]))
+
+    results = []
+    for source_size in sizes:
+        paths = synthetic_images(directory, args.n_images, source_size)
+        full_imgs = decode(paths, args.image_size, draft=False)
+        draft_imgs = decode(paths, args.image_size, draft=True)
+        quality = min(psnr(a, b) for a, b in zip(full_imgs, draft_imgs))
+        assert reused_identical(paths[0], args.image_size), \
+            'resizing modified a caller-owned PIL image'
+
+        for mode, draft in [('full', False), ('draft', True)]:
+            timings = measure(lambda: decode(paths, args.image_size, draft), 'cpu',
+                              args.warmup, args.iters)
+            entry = {'mode': mode, 'source_size': source_size, 'image_size': args.image_size,
+                     'n_images': args.n_images}
+            entry.update(throughput_report(timings, args.n_images))
+            if mode == 'draft':
+                entry.update({'speedup': results[-1]['mean'] / entry['mean'],
+                              'min_psnr': quality})
+                print('{}x{}: draft decoding {:.2f}x faster, {:.1f} ms per image, '
+                      'PSNR {:.1f} dB'.format(*source_size, entry['speedup'],
+                                              entry['mean'] / args.n_images, quality))
+            results.append(entry)
+    cfg.DRAFT_DECODING = draft_decoding
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,85 @@
+"""
+Frozen-backbone fine-tuning: training step latency (forward and backward)
+of the full detector on images versus the detector on top of backbone
+features read from a BackboneFeatureStore, and the disk footprint per image.
+As in benchmarks.progressive the loss is the sum of the head outputs.
+
+    python -m benchmarks.feature_cache --models efficientdet-d0 efficientdet-d2 --batch_size 4
+"""
+import argparse
+import tempfile
+
+import torch
+
+import config as cfg
+from benchmarks.common import build_model, measure, save_results, throughput_report
+from dataloader import collate_fn
+from utils.features import BackboneFeatureStore
+from utils.processing import normalize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backbone feature cache benchmark')
+
+    parser.add_argument('--models', nargs='+', default=['efficientdet-d0'])
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--output', type=str, default='bench_feature_cache.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def backward(outputs, model):
+    cls_outputs, box_outputs = outputs
+    loss = sum(out.float().mean() for out in cls_outputs + box_outputs)
+    loss.backward()
+    model.zero_grad(set_to_none=True)
+
+
+def main(args):
+    results = []
+    for model_name in args.models:
+        model = build_model(model_name, args.device).freeze_backbone().train()
+        image_size = model.image_size
+        img_ids = list(range(args.batch_size))
+        torch.manual_seed(cfg.SEED)
+        images = torch.randint(0, 256, (args.batch_size, 3, image_size, image_size),
+                               dtype=torch.uint8)
+
+        directory = tempfile.mkdtemp()
+        store = BackboneFeatureStore.write(
+            directory, model.backbone, [(images, img_ids)], img_ids,
+            canvas_sizes=[(image_size, image_size)] * args.batch_size,
+            scales=[1.] * args.batch_size,
+            meta={'image_size': image_size, 'bucket_stride': None}, device=args.device)
+        annotation = {'bbox': torch.zeros(0, 4).numpy(), 'cls': torch.zeros(0).long().numpy(),
+                      'scale': 1.}
+
+        def cached_step():
+            samples = [(store[img_id][0], dict(annotation, img_id=img_id)) for img_id in img_ids]
+            features, _ = collate_fn(samples)
+            features = [feature.to(args.device).float() for feature in features]
+            backward(model.forward_features(features), model)
+
+        x = images.to(args.device)
+        modes = {'images': lambda: backward(model(normalize(x)), model),
+                 'cached_features': cached_step}
+        for mode, step in modes.items():
+            timings = measure(step, args.device, args.warmup, args.iters)
+            entry = {'model': model_name, 'mode': mode, 'batch_size': args.batch_size,
+                     'store_bytes_per_image': store.nbytes / len(store)}
+            entry.update(throughput_report(timings, args.batch_size))
+            if mode == 'cached_features':
+                entry['speedup'] = results[-1]['mean'] / entry['mean']
+                print('{}: {:.2f}x faster steps, {:.2f} MB per image'.format(
+                    model_name, entry['speedup'], entry['store_bytes_per_image'] / 2 ** 20))
+            results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
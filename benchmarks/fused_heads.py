@@ -0,0 +1,80 @@
+"""
+Horizontal fusion of the classifier and box regression heads: CPU latency
+of the separate towers versus the fused grouped stack, for the heads alone
+and the whole model, with an equivalence check of the outputs.
+
+    python -m benchmarks.fused_heads --models efficientdet-d0 efficientdet-d2 --threads 1 4
+"""
+import argparse
+import copy
+
+import torch
+
+from benchmarks.common import (build_model, measure, save_results,
+                               throughput_report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fused heads benchmark')
+
+    parser.add_argument('--models', nargs='+', default=['efficientdet-d0'])
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--output', type=str, default='bench_fused_heads.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def heads(model):
+    if model.heads is not None:
+        return model.heads
+    return lambda features: (model.classifier(features), model.regresser(features))
+
+
+def max_difference(outputs, fused_outputs):
+    return max((a - b).abs().max().item()
+               for tower, fused_tower in zip(outputs, fused_outputs)
+               for a, b in zip(tower, fused_tower))
+
+
+def main(args):
+    results = []
+    for model_name in args.models:
+        models = {'separate': build_model(model_name)}
+        models['fused'] = copy.deepcopy(models['separate']).fuse_heads()
+        image_size = models['separate'].image_size
+
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, 3, image_size, image_size)
+            with torch.no_grad():
+                features = models['separate'].bifpn(
+                    models['separate'].adjuster(models['separate'].backbone(x)))
+                difference = max_difference(models['separate'](x), models['fused'](x))
+
+            for n_threads in args.threads:
+                torch.set_num_threads(n_threads)
+                for mode, model in models.items():
+                    steps = {'heads': lambda: heads(model)(features),
+                             'model': lambda: model(x)}
+                    for path, step in steps.items():
+                        with torch.no_grad():
+                            timings = measure(step, 'cpu', args.warmup, args.iters)
+                        entry = {'model': model_name, 'mode': mode, 'path': path,
+                                 'batch_size': batch_size, 'threads': n_threads,
+                                 'max_abs_difference': difference}
+                        entry.update(throughput_report(timings, batch_size))
+                        if mode == 'fused':
+                            separate = results[-2]
+                            entry['speedup'] = separate['mean'] / entry['mean']
+                            print('{} bs={} threads={} {}: {:.2f}x'.format(
+                                model_name, batch_size, n_threads, path, entry['speedup']))
+                        results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
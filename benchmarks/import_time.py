@@ -0,0 +1,79 @@
+"""
+Import time: wall time to import each entry point in a fresh interpreter,
+which heavyweight optional dependencies get pulled in and whether the
+import touches the log file. Pass --root to measure another checkout,
+e.g. the previous commit via `git worktree add /tmp/base HEAD~1`.
+
+    python -m benchmarks.import_time --runs 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+HEAVY_MODULES = ['tensorboardX', 'pycocotools', 'tqdm', 'matplotlib']
+ENTRY_POINTS = ['config', 'model', 'utils', 'server', 'validation', 'main']
+
+CHILD = """
+import json, os, sys, time
+log_file = os.path.join('log', 'output')
+mtime = os.path.getmtime(log_file) if os.path.exists(log_file) else None
+start = time.perf_counter()
+try:
+    import {module}
+    error = None
+except ImportError as e:
+    error = str(e)
+elapsed = time.perf_counter() - start
+new_mtime = os.path.getmtime(log_file) if os.path.exists(log_file) else None
+print(json.dumps({{
+    'import_time': elapsed, 'error': error,
+    'heavy_modules': [m for m in {heavy!r} if m in sys.modules],
+    'n_modules': len(sys.modules),
+    'touches_log': new_mtime != mtime}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+
+    parser.add_argument('--modules', nargs='+', default=ENTRY_POINTS)
+    parser.add_argument('--runs', default=5, type=int)
+    parser.add_argument('--root', type=str, default=str(Path(__file__).parents[1]),
+                        help='repository checkout to import from')
+    parser.add_argument('--output', type=str, default='bench_import_time.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def main(args):
+    from benchmarks.common import save_results
+
+    results = []
+    for module in args.modules:
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', CHILD.format(module=module, heavy=HEAVY_MODULES)],
+                cwd=args.root)
+            runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+        timings = sorted(run['import_time'] for run in runs)
+        entry = {'module': module, 'root': args.root,
+                 'median_ms': timings[len(timings) // 2] * 1000.,
+                 'min_ms': timings[0] * 1000.,
+                 'error': runs[-1]['error'],
+                 'heavy_modules': runs[-1]['heavy_modules'],
+                 'n_modules': runs[-1]['n_modules'],
+                 'touches_log': any(run['touches_log'] for run in runs)}
+        print(entry)
+        results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,118 @@
+"""
+Inference throughput and latency benchmark for EfficientDet D0-D5.
+Models are built with random weights (no downloads) and fed synthetic images at R_input.
+Results are written to JSON so that runs on different commits can be diffed.
+
+    python -m benchmarks.inference --models efficientdet-d0 efficientdet-d1 \
+        --batch_sizes 1 8 --threads 1 4 --precisions fp32 bf16
+"""
+import argparse
+import os
+import tempfile
+from contextlib import nullcontext
+
+import torch
+
+import config as cfg
+from benchmarks.common import (BENCHMARK_MODELS, build_model, measure,
+                               save_results, synthetic_images, throughput_report)
+from utils import DetectionWrapper
+from utils.utils import init_seed
+
+
+PRECISIONS = {'fp32': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+PATHS = ['model', 'end2end']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inference benchmark')
+
+    parser.add_argument('--models', nargs='+', default=BENCHMARK_MODELS,
+                        choices=BENCHMARK_MODELS)
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--threads', nargs='+', type=int,
+                        default=sorted({1, os.cpu_count()}))
+    parser.add_argument('--precisions', nargs='+', default=['fp32'],
+                        choices=list(PRECISIONS))
+    parser.add_argument('--paths', nargs='+', default=PATHS, choices=PATHS)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_inference.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def autocast(device, precision):
+    if PRECISIONS[precision] is None:
+        return nullcontext()
+    return torch.autocast(device_type=torch.device(device).type,
+                          dtype=PRECISIONS[precision])
+
+
+def run_model(model, device, batch_size, precision, args):
+    """ Model-only forward pass on a random batch """
+    x = torch.randn(batch_size, 3, model.image_size, model.image_size,
+                    device=device)
+
+    def step():
+        with torch.no_grad(), autocast(device, precision):
+            return model(x)
+
+    return measure(step, device, args.warmup, args.iters)
+
+
+def run_end2end(wrapper, device, image_paths, precision, args):
+    """ Decoding, pre-processing, forward pass and detections generation """
+    def step():
+        with torch.no_grad(), autocast(device, precision):
+            return wrapper(image_paths)
+
+    return measure(step, device, args.warmup, args.iters)
+
+
+def main(args):
+    init_seed(cfg.SEED)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model_name in args.models:
+            model = build_model(model_name, args.device)
+            wrapper = DetectionWrapper(model, args.device)
+            image_paths = synthetic_images(
+                tmp_dir, max(args.batch_sizes), model.image_size)
+
+            for n_threads in args.threads:
+                torch.set_num_threads(n_threads)
+                for precision in args.precisions:
+                    for batch_size in args.batch_sizes:
+                        for path in args.paths:
+                            entry = {'model': model_name, 'path': path,
+                                     'image_size': model.image_size,
+                                     'batch_size': batch_size,
+                                     'threads': n_threads,
+                                     'precision': precision}
+                            try:
+                                if path == 'model':
+                                    timings = run_model(
+                                        model, args.device, batch_size,
+                                        precision, args)
+                                else:
+                                    timings = run_end2end(
+                                        wrapper, args.device,
+                                        image_paths[:batch_size], precision, args)
+                                entry.update(throughput_report(timings, batch_size))
+                            except RuntimeError as e:
+                                entry['error'] = str(e)
+
+                            print(entry)
+                            results.append(entry)
+
+            del model, wrapper
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
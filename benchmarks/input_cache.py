@@ -0,0 +1,85 @@
+"""
+Validation input cache: batches preprocessed from image files (decode, resize,
+normalize) versus batches streamed from the memory-mapped InputCache, on
+synthetic JPEG images. Reports the one-off build time and the cache size.
+
+    python -m benchmarks.input_cache --n_images 64 --image_size 512 --batch_size 8
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import config as cfg
+from benchmarks.common import measure, save_results, synthetic_images, throughput_report
+from utils.input_cache import InputCache
+from utils.processing import normalize, preprocess
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Validation input cache benchmark')
+
+    parser.add_argument('--n_images', type=int, default=64)
+    parser.add_argument('--source_size', type=int, nargs=2, default=[480, 640],
+                        help='(height, width) of the synthetic images')
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--output', type=str, default='bench_input_cache.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def main(args):
+    directory = Path(tempfile.mkdtemp())
+    paths = synthetic_images(directory / 'images', args.n_images, tuple(args.source_size))
+    image_infos = {}
+    for img_id, path in enumerate(paths):
+        width, height = Image.open(path).size
+        image_infos[img_id] = {'file_name': path.name, 'width': width, 'height': height}
+    annotations = directory / 'annotations.json'
+    with open(annotations, 'w') as f:
+        json.dump({'images': list(image_infos.values())}, f)
+
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+    start = time.perf_counter()
+    cache = InputCache(directory / 'cache', directory / 'images', annotations,
+                       image_infos, args.image_size, bucket_stride)
+    build_time = time.perf_counter() - start
+
+    img_ids = sorted(image_infos)
+    batches = [img_ids[i:i + args.batch_size] for i in range(0, len(img_ids), args.batch_size)]
+
+    def from_files():
+        for batch_ids in batches:
+            preprocess([paths[img_id] for img_id in batch_ids], batch_ids, args.image_size)
+
+    def from_cache():
+        for batch_ids in batches:
+            x, _ = cache.batch(batch_ids)
+            normalize(x)
+
+    results = []
+    for mode, fn in [('files', from_files), ('cache', from_cache)]:
+        timings = measure(fn, 'cpu', args.warmup, args.iters)
+        entry = {'mode': mode, 'n_images': args.n_images, 'image_size': args.image_size,
+                 'batch_size': args.batch_size}
+        entry.update(throughput_report(timings, args.n_images))
+        if mode == 'cache':
+            entry.update({'speedup': results[0]['mean'] / entry['mean'],
+                          'build_time': build_time,
+                          'cache_bytes_per_image': cache.nbytes / len(cache)})
+            print('cache: {:.1f}x faster per pass, built in {:.2f}s, {:.0f} KB per image'.format(
+                entry['speedup'], build_time, entry['cache_bytes_per_image'] / 1024))
+        results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
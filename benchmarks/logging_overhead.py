@@ -0,0 +1,111 @@
+"""
+Logging overhead on the training step: step latency with the six scalars
+written synchronously every step versus sampled through the background
+AsyncScalarWriter, against a writer that stalls like a slow or network
+filesystem, plus the size of the in-memory message history.
+
+    python -m benchmarks.logging_overhead --write_latency_ms 0 1 5 --intervals 1 10
+"""
+import argparse
+import sys
+import time
+
+import torch
+
+from benchmarks.common import measure, save_results, throughput_report
+from log.logger import AsyncScalarWriter, get_logger
+
+
+TAGS = ['Train/overall_loss', 'Train/class_loss', 'Train/box_loss',
+        'Train/gradnorm', 'Train/lr', 'Train/gpu memory']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Logging overhead benchmark')
+
+    parser.add_argument('--write_latency_ms', nargs='+', type=float, default=[0., 1., 5.])
+    parser.add_argument('--intervals', nargs='+', type=int, default=[1, 10])
+    parser.add_argument('--size', type=int, default=256,
+                        help='side of the matmul standing in for the training step')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--output', type=str, default='bench_logging.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+class SlowWriter:
+    """ Stands in for a SummaryWriter whose event file sits on a slow disk """
+    def __init__(self, latency):
+        self.latency = latency
+        self.n_scalars = 0
+
+    def add_scalar(self, tag, value, step):
+        if self.latency:
+            time.sleep(self.latency)
+        self.n_scalars += 1
+
+    def flush(self):
+        pass
+
+
+def history_size(n_messages):
+    history = get_logger().history
+    for i in range(n_messages):
+        history.append('message {}'.format(i))
+    return len(history), sum(sys.getsizeof(m) for m in history)
+
+
+def main(args):
+    a = torch.randn(args.size, args.size)
+    results = []
+    for latency_ms in args.write_latency_ms:
+        writer = SlowWriter(latency_ms / 1000.)
+        state = {'step': 0}
+
+        def sync_step():
+            loss = (a @ a).mean().item()
+            for tag in TAGS:
+                writer.add_scalar(tag, loss, state['step'])
+            state['step'] += 1
+
+        timings = measure(sync_step, 'cpu', args.warmup, args.iters)
+        entry = {'mode': 'sync', 'interval': 1, 'write_latency_ms': latency_ms}
+        entry.update(throughput_report(timings, 1))
+        results.append(entry)
+        baseline = entry['mean']
+
+        for interval in args.intervals:
+            scalars = AsyncScalarWriter(SlowWriter(latency_ms / 1000.), interval)
+            state['step'] = 0
+
+            def async_step():
+                loss = (a @ a).mean().item()
+                if scalars.should_log(state['step']):
+                    scalars.add_scalars({tag: loss for tag in TAGS}, state['step'])
+                state['step'] += 1
+
+            timings = measure(async_step, 'cpu', args.warmup, args.iters)
+            scalars.close()
+            entry = {'mode': 'async', 'interval': interval,
+                     'write_latency_ms': latency_ms,
+                     'written': scalars.writer.n_scalars, 'dropped': scalars.dropped}
+            entry.update(throughput_report(timings, 1))
+            entry['speedup'] = baseline / entry['mean']
+            print('write latency {}ms interval {}: {:.2f}x'.format(
+                latency_ms, interval, entry['speedup']))
+            results.append(entry)
+
+    kept, n_bytes = history_size(args.messages)
+    results.append({'mode': 'history', 'messages': args.messages,
+                    'kept': kept, 'bytes': n_bytes})
+    print('history: {} of {} messages kept, {:.1f} KB'.format(
+        kept, args.messages, n_bytes / 1024))
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,77 @@
+"""
+Progressive resizing: training step latency (forward and backward) at every
+input size of the ResolutionScheduler, projected to the wall-clock of the
+whole schedule against training at the fixed model image size.
+The detection loss is replaced by the sum of the head outputs, so this
+measures compute only; the final mAP needs a full COCO run of both
+schedules (main.py with and without --progressive logs Train/epoch_time).
+
+    python -m benchmarks.progressive --model_name efficientdet-d0 --batch_size 4
+"""
+import argparse
+
+import torch
+
+import config as cfg
+from benchmarks.common import build_model, measure, save_results, throughput_report
+from utils.tools import ResolutionScheduler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Progressive resizing benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--epochs', type=int, default=cfg.NUM_EPOCHS)
+    parser.add_argument('--min_scale', type=float, default=cfg.RESOLUTION_MIN_SCALE)
+    parser.add_argument('--ramp_epochs', type=int, default=cfg.RESOLUTION_RAMP_EPOCHS)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--output', type=str, default='bench_progressive.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def train_step(model, x):
+    cls_outputs, box_outputs = model(x)
+    loss = sum(out.float().mean() for out in cls_outputs + box_outputs)
+    loss.backward()
+    model.zero_grad(set_to_none=True)
+
+
+def main(args):
+    model = build_model(args.model_name, args.device).train()
+    schedule = ResolutionScheduler(model.image_size, args.min_scale,
+                                   args.ramp_epochs, cfg.BUCKET_STRIDE)
+    sizes = schedule.sizes(args.epochs)
+
+    results, step_time = [], {}
+    for image_size in sorted(set(sizes) | {model.image_size}):
+        x = torch.randn(args.batch_size, 3, image_size, image_size, device=args.device)
+        timings = measure(lambda: train_step(model, x), args.device,
+                          args.warmup, args.iters)
+        entry = {'image_size': image_size, 'batch_size': args.batch_size,
+                 'epochs': sizes.count(image_size)}
+        entry.update(throughput_report(timings, args.batch_size))
+        step_time[image_size] = entry['mean']
+        print('{}px: {:.1f} ms/step, {} epochs'.format(
+            image_size, entry['mean'], entry['epochs']))
+        results.append(entry)
+
+    # relative to steps per epoch, the same for every size
+    progressive = sum(step_time[size] for size in sizes)
+    fixed = step_time[model.image_size] * args.epochs
+    summary = {'fixed': fixed, 'progressive': progressive,
+               'time_saved': 1. - progressive / fixed,
+               'speedup': fixed / progressive}
+    print('projected training time saved: {:.1%} ({:.2f}x)'.format(
+        summary['time_saved'], summary['speedup']))
+    results.append(summary)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
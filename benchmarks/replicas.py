@@ -0,0 +1,104 @@
+"""
+Startup time and memory of N model replicas in separate processes,
+loading private copies of a .pth checkpoint vs a shared memory-mapped flat blob.
+Memory is reported as RSS (counts shared pages in every process) and,
+on Linux, PSS (shared pages split between processes).
+
+    python -m benchmarks.replicas --model_name efficientdet-d3 --replicas 1 4 8
+"""
+import argparse
+import multiprocessing as mp
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from benchmarks.common import build_model, save_results
+from model import EfficientDet
+from utils.weights import export_flat_weights
+
+
+FORMATS = ['pth', 'flat']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Multi-replica memory benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--replicas', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--formats', nargs='+', default=FORMATS, choices=FORMATS)
+    parser.add_argument('--output', type=str, default='bench_replicas.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def memory_usage():
+    """ RSS and PSS of the current process in MB (PSS is Linux only) """
+    usage = {}
+    for path, key, field in [('/proc/self/status', 'rss_mb', 'VmRSS:'),
+                             ('/proc/self/smaps_rollup', 'pss_mb', 'Pss:')]:
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        usage[key] = int(line.split()[1]) / 1024
+                        break
+        except OSError:
+            pass
+    return usage
+
+
+def replica(model_name, weights, queue, done):
+    start = time.perf_counter()
+    torch.set_num_threads(1)
+    model = EfficientDet.from_pretrained(model_name, weights).eval()
+    entry = {'startup': time.perf_counter() - start}
+
+    with torch.no_grad():
+        model(torch.randn(1, 3, model.image_size, model.image_size))
+    entry.update(memory_usage())
+    queue.put(entry)
+    done.wait()
+
+
+def run_replicas(model_name, weights, n_replicas):
+    ctx = mp.get_context('spawn')
+    queue, done = ctx.Queue(), ctx.Event()
+    processes = [ctx.Process(target=replica, args=(model_name, str(weights), queue, done))
+                 for _ in range(n_replicas)]
+    for process in processes:
+        process.start()
+    entries = [queue.get() for _ in processes]
+    done.set()
+    for process in processes:
+        process.join()
+    return entries
+
+
+def main(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_dict = build_model(args.model_name).state_dict()
+        weights = {'pth': Path(tmp_dir) / '{}.pth'.format(args.model_name),
+                   'flat': Path(tmp_dir) / '{}.bin'.format(args.model_name)}
+        torch.save(state_dict, weights['pth'])
+        export_flat_weights(state_dict, weights['flat'])
+
+        for n_replicas in args.replicas:
+            for weights_format in args.formats:
+                entries = run_replicas(args.model_name, weights[weights_format], n_replicas)
+                entry = {'model': args.model_name, 'format': weights_format,
+                         'replicas': n_replicas,
+                         'mean_startup': sum(e['startup'] for e in entries) / n_replicas,
+                         'total_rss_mb': sum(e.get('rss_mb', 0) for e in entries),
+                         'total_pss_mb': sum(e.get('pss_mb', 0) for e in entries)}
+                print(entry)
+                results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,67 @@
+"""
+Tiled inference on large images vs naive single-image inference,
+where the whole image is downscaled to the model input size.
+
+    python -m benchmarks.tiled --model_name efficientdet-d0 --image_size 2160 3840
+"""
+import argparse
+import tempfile
+
+import torch
+
+import config as cfg
+from benchmarks.common import (build_model, measure, save_results,
+                               synthetic_images, throughput_report)
+from utils import DetectionWrapper
+from utils.tiling import TiledDetectionWrapper, tile_windows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Tiled inference benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--image_size', nargs=2, type=int, default=[2160, 3840],
+                        help='height and width of synthetic images')
+    parser.add_argument('--n_images', default=2, type=int)
+    parser.add_argument('--overlap', default=cfg.TILE_OVERLAP, type=int)
+    parser.add_argument('--max_tiles_per_batch', default=cfg.MAX_TILES_PER_BATCH, type=int)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_tiled.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def main(args):
+    model = build_model(args.model_name, args.device)
+    wrappers = {
+        'naive': DetectionWrapper(model, args.device),
+        'tiled': TiledDetectionWrapper(model, args.device, overlap=args.overlap,
+                                       max_tiles_per_batch=args.max_tiles_per_batch),
+    }
+    height, width = args.image_size
+    n_tiles = len(tile_windows(width, height, model.image_size, args.overlap))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = synthetic_images(tmp_dir, args.n_images, (height, width))
+        for mode, wrapper in wrappers.items():
+            def step():
+                with torch.no_grad():
+                    return wrapper(image_paths)
+
+            timings = measure(step, args.device, args.warmup, args.iters)
+            entry = {'model': args.model_name, 'mode': mode,
+                     'image_size': [height, width],
+                     'tiles_per_image': n_tiles if mode == 'tiled' else 1}
+            entry.update(throughput_report(timings, args.n_images))
+            print(entry)
+            results.append(entry)
+
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
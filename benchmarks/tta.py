@@ -0,0 +1,62 @@
+"""
+Cost of batched test-time augmentation relative to plain inference.
+
+    python -m benchmarks.tta --model_name efficientdet-d0 --batch_size 4
+"""
+import argparse
+import tempfile
+
+import torch
+
+import config as cfg
+from benchmarks.common import (build_model, measure, save_results,
+                               synthetic_images, throughput_report)
+from utils import DetectionWrapper
+from utils.tta import TTADetectionWrapper
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='TTA benchmark')
+
+    parser.add_argument('--model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--scales', nargs='*', type=float, default=cfg.TTA_SCALES)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--output', type=str, default='bench_tta.json')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def main(args):
+    model = build_model(args.model_name, args.device)
+    wrappers = {
+        'plain': DetectionWrapper(model, args.device),
+        'tta': TTADetectionWrapper(model, args.device, flip=True, scales=args.scales),
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = synthetic_images(tmp_dir, args.batch_size, (480, 640))
+        for mode, wrapper in wrappers.items():
+            def step():
+                with torch.no_grad():
+                    return wrapper(image_paths)
+
+            timings = measure(step, args.device, args.warmup, args.iters)
+            entry = {'model': args.model_name, 'mode': mode,
+                     'views': len(getattr(wrapper, 'views', [None])),
+                     'batch_size': args.batch_size}
+            entry.update(throughput_report(timings, args.batch_size))
+            print(entry)
+            results.append(entry)
+
+    results[1]['relative_cost'] = results[1]['mean'] / results[0]['mean']
+    print('TTA relative cost: {:.2f}x'.format(results[1]['relative_cost']))
+    save_results(args.output, args, results)
+
+
+if __name__ == '__main__':
+    main(parse_args())
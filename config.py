@@ -9,11 +9,20 @@ DATA_PATH = BASE_PATH / 'data'
 WEIGHTS_PATH = BASE_PATH / 'weights'
 LOG_PATH = BASE_PATH / 'log'
 LOG_FILE = LOG_PATH / 'output'
+PROFILE_REPORT = LOG_PATH / 'profile.json'
+CHECKPOINT_PATH = WEIGHTS_PATH / 'checkpoints'
 
 COCO_PATH = DATA_PATH / 'coco'
 TRAIN_SET = COCO_PATH / 'train2017'
 VAL_SET = COCO_PATH / 'val2017'
 COCO_RESULTS = COCO_PATH / 'results.json'
+# resized validation inputs, memory-mapped and rebuilt when annotations or input size change
+VAL_CACHE = True
+VAL_CACHE_PATH = COCO_PATH / 'val_cache'
+# offline anchor targets (precompute_targets.py), one directory per model
+ANCHOR_TARGETS_PATH = COCO_PATH / 'anchor_targets'
+# backbone features for frozen-backbone fine-tuning (main.py --feature_cache)
+FEATURE_CACHE_PATH = COCO_PATH / 'backbone_features'
 
 ANNOTATIONS_PATH = COCO_PATH / 'annotations'
 TRAIN_ANNOTATIONS = ANNOTATIONS_PATH / 'instances_train2017.json'
@@ -28,6 +37,13 @@ STEPS_PER_EPOCH = math.ceil(NUM_EXAMPLES_PER_EPOCH / BATCH_SIZE)
 TOTAL_STEPS = STEPS_PER_EPOCH * NUM_EPOCHS
 VAL_DELAY = 50
 VAL_INTERVAL = 10
+# evaluation in a background process (main.py --async_eval)
+EVAL_WORKER_DEVICE = 'cpu'
+EVAL_WORKER_THREADS = 4
+# snapshots waiting for the worker, older ones are dropped
+EVAL_WORKER_MAX_QUEUED = 1
+# seconds between worker liveness checks while waiting for results
+EVAL_WORKER_POLL_TIMEOUT = 5
 
 OPT = 'SGD'
 MOMENTUM = 0.9
@@ -37,6 +53,25 @@ WEIGHT_DECAY = 4e-5
 MOVING_AVERAGE_DECAY = 0.9998
 CLIP_GRADIENTS_NORM = 10.0
 
+# full training state checkpoints, every CHECKPOINT_INTERVAL optimizer steps
+CHECKPOINT_INTERVAL = 1000
+CHECKPOINT_KEEP = 3
+
+# progressive resizing (main.py --progressive): inputs start at RESOLUTION_MIN_SCALE
+# of the model image size and ramp up to it over RESOLUTION_RAMP_EPOCHS
+RESOLUTION_MIN_SCALE = 0.5
+RESOLUTION_RAMP_EPOCHS = 150
+
+# training scalars are sampled every LOG_INTERVAL optimizer steps
+LOG_INTERVAL = 10
+
+# on-device augmentation of whole training batches, scale jitter as in the TF implementation
+AUGMENT = True
+FLIP_PROB = 0.5
+SCALE_JITTER = (0.1, 2.0)
+# ground truth boxes per image are padded (or truncated) to a fixed number
+MAX_INSTANCES_PER_IMAGE = 100
+
 # classification loss
 ALPHA = 0.25
 GAMMA = 1.5
@@ -49,15 +84,58 @@ NUM_SCALES = 3
 ANCHOR_SCALE = 4.0
 
 NUM_ANCHORS = len(ASPECT_RATIOS) * NUM_SCALES
+# anchor assignment: positive from MATCH_THRESHOLD IoU, ignored from UNMATCHED_THRESHOLD
+MATCH_THRESHOLD = 0.5
+UNMATCHED_THRESHOLD = 0.4
 NUM_CLASSES = 90
 
 MIN_LEVEL = 3
 MAX_LEVEL = 7
 NUM_LEVELS = MAX_LEVEL - MIN_LEVEL + 1
 
+# decode JPEGs at the smallest DCT scale (1/2, 1/4, 1/8) still covering the input size
+DRAFT_DECODING = True
+
+# inference batches are written into reused (pinned on CUDA) buffers,
+# one per (shape, dtype), at most BATCH_ARENA_SIZE buffers are kept
+BATCH_ARENA = True
+BATCH_ARENA_SIZE = 8
+
+# rectangular inputs: images are grouped by aspect ratio and padded
+# to the tightest canvas with sides being multiples of the largest stride,
+# off by default until its val2017 mAP is compared (benchmarks.bucketing)
+ASPECT_BUCKETING = False
+BUCKET_STRIDE = 2 ** MAX_LEVEL
+# number of (image size, device, dtype) anchor sets kept per Anchors instance
+ANCHOR_CACHE_SIZE = 8
+
 MAX_DETECTION_POINTS = 5000
 MAX_DETECTIONS_PER_IMAGE = 100
 
+# dynamic batching inference server
+SERVER_MAX_BATCH_SIZE = 16
+SERVER_MAX_DELAY_MS = 10
+SERVER_PREPROCESS_WORKERS = 4
+SERVER_LATENCY_WINDOW = 10000
+
+# tiled inference on large images at native resolution,
+# tile size defaults to the model input size
+TILE_OVERLAP = 128
+MAX_TILES_PER_BATCH = 8
+TILE_NMS_THRESHOLD = 0.5
+TILE_MAX_DETECTIONS = 1000
+
+# test-time augmentation: horizontal flip and extra downscaled views
+# folded into the batch of a single forward pass
+TTA_FLIP = True
+TTA_SCALES = []
+
+# cascade inference: a small variant runs on every image, images with more than
+# CASCADE_MAX_UNCERTAIN detections scored in [LOW, HIGH) are re-run on a larger one
+CASCADE_LOW_SCORE = 0.2
+CASCADE_HIGH_SCORE = 0.5
+CASCADE_MAX_UNCERTAIN = 2
+
 
 class ModelInfo:
 
@@ -90,4 +168,13 @@ class ModelInfo:
         self.BACKBONE_WEIGHTS = WEIGHTS_PATH / '{}.pth'.format(self.BACKBONE)
 
 
+def get_model_info(model_name):
+    """ Per-instance configuration, unlike MODEL it is not shared
+    so several variants can live in one process """
+    info = ModelInfo()
+    info.choose_model(model_name)
+    return info
+
+
+# configuration of the model being trained (set by EfficientDet.from_name)
 MODEL = ModelInfo()
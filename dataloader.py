@@ -1,9 +1,12 @@
+from collections import defaultdict
+
 import numpy as np
-from PIL import Image
-from pycocotools.coco import COCO
-from torch.utils.data import DataLoader, Dataset
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
 
 import config as cfg
+from utils.processing import collate_images
+from utils.targets import collate_anchor_targets
 from utils.transforms import *
 
 
@@ -11,10 +14,12 @@ class COCODataset(Dataset):
     """ MSCOCO Dataset. Following TF Implementation,
     annotation bbox format is yxyx """
 
-    def __init__(self, path, annotations, transforms):
+    def __init__(self, path, annotations, transforms, anchor_targets=None):
         super(COCODataset, self).__init__()
         self.path = path
         self.transforms = transforms
+        self.anchor_targets = anchor_targets
+        from pycocotools.coco import COCO
         self.coco = COCO(annotations)
         self.cat_ids = self.coco.getCatIds()
         self.img_ids = []
@@ -67,20 +72,156 @@ class COCODataset(Dataset):
         img_id = self.img_ids[idx]
         img_info = self.img_infos[idx]
 
-        image = Image.open(self.path / img_info['file_name']).convert('RGB')
+        # decoded by Resizer, at a reduced DCT scale for large JPEGs
+        image = open_draftable(self.path / img_info['file_name'])
         annotation = self._get_img_ann(img_id)
 
         if self.transforms is not None:
             image, annotation = self.transforms(image, annotation)
+        if self.anchor_targets is not None:
+            annotation['anchor_targets'] = self.anchor_targets[img_id]
 
         return image, annotation
 
 
-def get_loader(path, annotations):
+class CachedFeatureDataset(COCODataset):
+    """ Returns the backbone features of a BackboneFeatureStore in place of
+    the images, for fine-tuning with a frozen backbone. Boxes are scaled
+    to the canvas the features were computed on """
+
+    def __init__(self, path, annotations, feature_store, anchor_targets=None):
+        super(CachedFeatureDataset, self).__init__(
+            path, annotations, transforms=None, anchor_targets=anchor_targets)
+        self.feature_store = feature_store
+
+    def __getitem__(self, idx):
+        img_id = self.img_ids[idx]
+        features, scale = self.feature_store[img_id]
+        annotation = self._get_img_ann(img_id)
+        annotation['bbox'] *= scale
+        annotation['scale'] = 1. / scale
+        if self.anchor_targets is not None:
+            annotation['anchor_targets'] = self.anchor_targets[img_id]
+        return features, annotation
+
+
+class AspectRatioBatchSampler(Sampler):
+    """ Groups images of the same aspect ratio bucket into batches,
+    so that every batch shares the tightest (height, width) canvas.
+    Order is shuffled deterministically per epoch, so a resumed run can
+    skip the batches already consumed. Without a stride all images
+    form a single group """
+
+    def __init__(self, dataset, batch_size, image_size, stride,
+                 shuffle=True, drop_last=False, seed=cfg.SEED):
+        self.batch_size = batch_size
+        self.stride = stride
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        self.img_sizes = [(img_info['width'], img_info['height'])
+                          for img_info in dataset.img_infos]
+        self.set_image_size(image_size)
+
+    def set_image_size(self, image_size):
+        """ Regroups the images into the buckets of a new input size """
+        self.image_size = image_size
+        self.groups = defaultdict(list)
+        for idx, (width, height) in enumerate(self.img_sizes):
+            bucket = get_bucket(width, height, image_size, self.stride) \
+                if self.stride else image_size
+            self.groups[bucket].append(idx)
+
+    def set_epoch(self, epoch, start=0):
+        """ start: number of batches of the epoch to skip """
+        self.epoch = epoch
+        self.start = start
+
+    def _batches(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        batches = []
+        for bucket in sorted(self.groups):
+            indices = list(self.groups[bucket])
+            if self.shuffle:
+                rng.shuffle(indices)
+            for i in range(0, len(indices), self.batch_size):
+                batch = indices[i:i + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches()[self.start:])
+
+    def __len__(self):
+        return max(len(self._batches()) - self.start, 0)
+
+
+def collate_fn(samples, max_instances=cfg.MAX_INSTANCES_PER_IMAGE):
+    """ (uint8 HWC image, annotation) samples to a uint8 NCHW batch and
+    targets padded to max_instances: bbox [batch_size, max_instances, 4]
+    and cls [batch_size, max_instances] with -1 marking padding.
+    Normalization and augmentation run on the training device (train.py).
+    Cached backbone features are stacked to one float16 tensor per level """
+    images, annotations = zip(*samples)
+    bbox = torch.zeros(len(samples), max_instances, 4, dtype=torch.float32)
+    cls = torch.full((len(samples), max_instances), -1, dtype=torch.int64)
+    for idx, annotation in enumerate(annotations):
+        n = min(len(annotation['cls']), max_instances)
+        bbox[idx, :n] = torch.from_numpy(annotation['bbox'][:n])
+        cls[idx, :n] = torch.from_numpy(annotation['cls'][:n])
+    labels = dict(bbox=bbox, cls=cls,
+                  img_id=[annotation['img_id'] for annotation in annotations],
+                  scale=torch.tensor([annotation['scale'] for annotation in annotations]))
+    if 'anchor_targets' in annotations[0]:
+        labels['anchor_targets'] = collate_anchor_targets(
+            [annotation['anchor_targets'] for annotation in annotations])
+    if isinstance(images[0], list):
+        return [torch.from_numpy(np.stack(level)) for level in zip(*images)], labels
+    return collate_images(list(images)), labels
+
+
+def set_image_size(loader, image_size):
+    """ Switches the training resolution of a loader made by get_loader,
+    takes effect from the next epoch on """
+    for transform in loader.dataset.transforms.transforms:
+        if isinstance(transform, Resizer):
+            transform.target_size = image_size
+    loader.batch_sampler.set_image_size(image_size)
+
+
+def get_feature_loader(path, annotations, feature_store, anchor_targets=None, train=True):
+    """ Loader of cached backbone features (see CachedFeatureDataset),
+    batches are shuffled for training """
+    dataset = CachedFeatureDataset(path=path, annotations=annotations,
+                                   feature_store=feature_store,
+                                   anchor_targets=anchor_targets)
+    batch_sampler = AspectRatioBatchSampler(
+        dataset, cfg.BATCH_SIZE, feature_store.image_size, feature_store.bucket_stride,
+        shuffle=train)
+    loader = DataLoader(dataset=dataset, batch_sampler=batch_sampler,
+                        collate_fn=collate_fn)
+    return loader
+
+
+def get_loader(path, annotations, anchor_targets=None, train=True):
+    """ anchor_targets: optional AnchorTargetStore read along with the images,
+    batches are shuffled for training, otherwise images keep the dataset order """
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
     dataset = COCODataset(
         path=path, annotations=annotations,
-        transforms=Compose([Resizer(cfg.MODEL.IMAGE_SIZE), ImageToNumpy(),
-                            Normalizer(), NumpyToTensor()]))
-    # TODO: Add Random Horizontal Flip and random crops augmentations
-    loader = DataLoader(dataset=dataset, batch_size=cfg.BATCH_SIZE)
+        transforms=Compose([Resizer(cfg.MODEL.IMAGE_SIZE, bucket_stride=bucket_stride,
+                                    draft=cfg.DRAFT_DECODING),
+                            ImageToNumpy()]),
+        anchor_targets=anchor_targets)
+    batch_sampler = AspectRatioBatchSampler(
+        dataset, cfg.BATCH_SIZE, cfg.MODEL.IMAGE_SIZE, bucket_stride,
+        shuffle=train)
+    loader = DataLoader(dataset=dataset, batch_sampler=batch_sampler,
+                        collate_fn=collate_fn)
     return loader
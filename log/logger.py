@@ -1,11 +1,21 @@
+import atexit
 import logging
-import config as cfg
+import queue
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+
+# number of messages kept in memory for the TensorBoard text summary
+HISTORY_SIZE = 1000
+# records waiting for the background file writer, newer ones are dropped when full
+QUEUE_SIZE = 10000
 
 
 class CustomLogger:
-    def __init__(self, base_logger):
+    def __init__(self, base_logger, history_size=HISTORY_SIZE):
         self.logger = base_logger
-        self.history = []
+        self.history = deque(maxlen=history_size)
 
     def __call__(self, msg, do_print=True):
         self.history.append(msg)
@@ -18,13 +28,82 @@ class CustomLogger:
         return writer
 
 
-def get_logger(filepath):
+class DroppingQueueHandler(QueueHandler):
+    """ Never blocks the caller, records are dropped when the queue is full """
+    def __init__(self, records):
+        super(DroppingQueueHandler, self).__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncScalarWriter:
+    """ Sampled, non-blocking scalar logging.
+    Scalars of every `interval`-th step are queued and written to the
+    TensorBoard writer by a background thread, so slow disks or network
+    filesystems do not show up in the step time """
+
+    def __init__(self, writer, interval=1, queue_size=QUEUE_SIZE):
+        self.writer = writer
+        self.interval = interval
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def should_log(self, step):
+        return step % self.interval == 0
+
+    def add_scalars(self, scalars, step):
+        """ scalars: a dict of tag to python number """
+        try:
+            self.queue.put_nowait((scalars, step))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            scalars, step = item
+            for tag, value in scalars.items():
+                self.writer.add_scalar(tag, value, step)
+            self.queue.task_done()
+
+    def flush(self):
+        """ Blocks until queued scalars are written """
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.flush()
+
+
+def get_logger():
     logger = logging.getLogger("Customlogger")
     logger.setLevel(logging.INFO)
-    file = logging.FileHandler(filepath, mode='w')
-    file.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    logger.addHandler(file)
     return CustomLogger(logger)
 
 
-logger = get_logger(cfg.LOG_FILE)
+def setup_logger(filepath, mode='w'):
+    """ Attaches the file handler. Called explicitly by entry points so that
+    importing this module never touches the log file. Records go through a
+    bounded queue, the file is written by a background listener thread """
+    file = logging.FileHandler(filepath, mode=mode)
+    file.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    records = queue.Queue(QUEUE_SIZE)
+    listener = QueueListener(records, file)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.logger.addHandler(DroppingQueueHandler(records))
+    return logger
+
+
+logger = get_logger()
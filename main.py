@@ -1,15 +1,25 @@
 import argparse
+import time
+from pathlib import Path
 
 import torch
-from tensorboardX import SummaryWriter
 
 import config as cfg
-from dataloader import get_loader
-from log.logger import logger
+from dataloader import get_feature_loader, get_loader, set_image_size
+from log.logger import AsyncScalarWriter, logger, setup_logger
 from model import EfficientDet
 from train import train
+from utils import DetectionWrapper
+from utils.augmentation import BatchAugmenter
+from utils.cascade import CascadeDetectionWrapper
+from utils.checkpoint import Checkpointer
+from utils.eval_worker import AsyncEvaluator
+from utils.features import BackboneFeatureStore
 from utils.tools import (CosineLRScheduler, DetectionLoss,
-                         ExponentialMovingAverage)
+                         ExponentialMovingAverage, ResolutionScheduler)
+from utils.profiler import StageProfiler
+from utils.targets import AnchorLabeler, AnchorTargetStore
+from utils.tta import TTADetectionWrapper
 from utils.utils import count_parameters, init_seed
 from validation import validate
 
@@ -24,6 +34,26 @@ def parse_args():
     parser.add_argument('--cuda', dest='cuda', action='store_true')
     parser.add_argument('--cpu', dest='cuda', action='store_false')
     parser.add_argument('--device', type=int, default=0)
+    parser.add_argument('--profile', action='store_true',
+                        help='record per-stage latency and memory during validation')
+    parser.add_argument('--weights', type=str, default=None,
+                        help='local checkpoint to evaluate instead of the released weights')
+    parser.add_argument('--tta', action='store_true',
+                        help='evaluate with flip test-time augmentation')
+    parser.add_argument('--async_eval', action='store_true',
+                        help='validate EMA snapshots in a background process')
+    parser.add_argument('--resume', nargs='?', const='latest', default=None,
+                        help='resume training from a checkpoint (default: the latest one)')
+    parser.add_argument('--cascade', type=str, default=None, metavar='SMALL_MODEL',
+                        help='run SMALL_MODEL first and escalate uncertain images to -model_name')
+    parser.add_argument('--anchor_targets', nargs='?', const='default', default=None,
+                        help='read anchor targets written by precompute_targets.py '
+                             '(default: ANCHOR_TARGETS_PATH/<model_name>)')
+    parser.add_argument('--feature_cache', nargs='?', const='default', default=None,
+                        help='fine-tune with a frozen backbone on cached backbone features, '
+                             'computed on first use (default: FEATURE_CACHE_PATH/<model_name>)')
+    parser.add_argument('--progressive', action='store_true',
+                        help='train at lower input sizes first, ramping up to the model image size')
     parser.set_defaults(cuda=True)
 
     arguments = parser.parse_args()
@@ -48,13 +78,68 @@ def build_tools(model):
 
 
 def setup_writer(tb_tag, args):
+    from tensorboardX import SummaryWriter
     writer = SummaryWriter(logdir=cfg.LOG_PATH / tb_tag)
     writer.add_text("Hyperparams", '<br />'.join(
         [f"{k}: {v}" for k, v in args.__dict__.items()]))
     writer.train_step, writer.eval_step = 0, 0
+    writer.scalars = AsyncScalarWriter(writer, cfg.LOG_INTERVAL)
     return writer
 
 
+def load_anchor_targets(args, augment):
+    """ Offline anchor targets only hold for the fixed input size they were
+    computed at and for unaugmented boxes, otherwise they are assigned on the fly """
+    if args.anchor_targets is None:
+        return None
+    if augment or args.progressive:
+        logger('Augmented or progressive training, anchor targets are assigned on the fly')
+        return None
+    path = cfg.ANCHOR_TARGETS_PATH / args.model_name \
+        if args.anchor_targets == 'default' else args.anchor_targets
+    anchor_targets = AnchorTargetStore(path)
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+    if anchor_targets.image_size != cfg.MODEL.IMAGE_SIZE or \
+            anchor_targets.bucket_stride != bucket_stride:
+        raise ValueError('Anchor targets in {} were computed for another input size'.format(path))
+    return anchor_targets
+
+
+def load_feature_cache(args, model, device):
+    """ Backbone features of the training set, computed by one pass of the
+    (frozen) backbone if the cache does not exist yet """
+    path = cfg.FEATURE_CACHE_PATH / args.model_name \
+        if args.feature_cache == 'default' else Path(args.feature_cache)
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+
+    if not (path / BackboneFeatureStore.META).exists():
+        from tqdm import tqdm
+
+        loader = get_loader(path=cfg.TRAIN_SET, annotations=cfg.TRAIN_ANNOTATIONS,
+                            train=False)
+        dataset, resizer = loader.dataset, loader.dataset.transforms.transforms[0]
+        shapes = [resizer.get_shape(img_info['width'], img_info['height'])
+                  for img_info in dataset.img_infos]
+        batches = ((x, labels['img_id']) for x, labels in tqdm(loader))
+        start = time.perf_counter()
+        BackboneFeatureStore.write(
+            path, model.backbone, batches, dataset.img_ids,
+            canvas_sizes=[shape[:2] for shape in shapes],
+            scales=[shape[4] for shape in shapes],
+            meta={'model_name': args.model_name, 'image_size': cfg.MODEL.IMAGE_SIZE,
+                  'bucket_stride': bucket_stride},
+            device=device)
+        logger('Cached backbone features in {:.0f}s'.format(time.perf_counter() - start))
+
+    feature_store = BackboneFeatureStore(path)
+    if feature_store.image_size != cfg.MODEL.IMAGE_SIZE or \
+            feature_store.bucket_stride != bucket_stride:
+        raise ValueError('Features in {} were computed for another input size'.format(path))
+    logger('Backbone features of {} images in {}: {:.2f} GB'.format(
+        len(feature_store), path, feature_store.nbytes / 2 ** 30))
+    return feature_store
+
+
 def main(args):
     device = torch.device('cuda:{}'.format(args.device)) \
         if args.cuda else torch.device('cpu')
@@ -63,30 +148,99 @@ def main(args):
         model = EfficientDet.from_name(args.model_name).to(device)
         logger("Model's trainable parameters: {}".format(count_parameters(model)))
 
-        loader = get_loader(path=cfg.TRAIN_SET, annotations=cfg.TRAIN_ANNOTATIONS)
+        # cached features are fixed, so they are neither augmented nor resized
+        cached = args.feature_cache is not None
+        if cached and args.progressive:
+            logger('Backbone features are cached at a fixed input size, --progressive is ignored')
+            args.progressive = False
+        augment = cfg.AUGMENT and not cached
+
+        anchor_targets = load_anchor_targets(args, augment)
+        if cached:
+            model.freeze_backbone()
+            loader = get_feature_loader(path=cfg.TRAIN_SET, annotations=cfg.TRAIN_ANNOTATIONS,
+                                        feature_store=load_feature_cache(args, model, device),
+                                        anchor_targets=anchor_targets)
+        else:
+            loader = get_loader(path=cfg.TRAIN_SET, annotations=cfg.TRAIN_ANNOTATIONS,
+                                anchor_targets=anchor_targets)
+        labeler = AnchorLabeler(cfg.MODEL.IMAGE_SIZE)
 
         optimizer, scheduler, criterion, ema_decay = build_tools(model)
         writer = setup_writer(args.experiment, args)
-        best_score = -1
 
-        for epoch in range(cfg.NUM_EPOCHS):
+        checkpointer = Checkpointer(model, optimizer, scheduler, ema_decay, writer)
+        checkpointer.install_signal_handlers()
+        start_epoch, start_batch = 0, 0
+        if args.resume is not None:
+            start_epoch, start_batch = checkpointer.resume(
+                None if args.resume == 'latest' else args.resume)
+        augmenter = BatchAugmenter() if augment else None
+        resolution = ResolutionScheduler(
+            cfg.MODEL.IMAGE_SIZE, cfg.RESOLUTION_MIN_SCALE,
+            cfg.RESOLUTION_RAMP_EPOCHS, cfg.BUCKET_STRIDE) if args.progressive else None
+        evaluator = AsyncEvaluator(args.model_name, cfg.MODEL.SAVE_PATH) \
+            if args.async_eval else None
+
+        for epoch in range(start_epoch, cfg.NUM_EPOCHS):
+            start = start_batch if epoch == start_epoch else 0
+            image_size = cfg.MODEL.IMAGE_SIZE
+            if resolution is not None:
+                image_size = resolution.get_image_size(epoch)
+                set_image_size(loader, image_size)
+            loader.batch_sampler.set_epoch(epoch, start)
+            epoch_start = time.perf_counter()
             model, optimizer, scheduler, writer = \
                 train(model, optimizer, loader, scheduler,
-                      criterion, ema_decay, device, writer)
+                      criterion, ema_decay, device, writer,
+                      checkpointer=checkpointer, epoch=epoch, start=start,
+                      augmenter=augmenter, labeler=labeler)
+            epoch_time = time.perf_counter() - epoch_start
+            writer.add_scalar('Train/image_size', image_size, epoch)
+            writer.add_scalar('Train/epoch_time', epoch_time, epoch)
+            logger('Epoch {} at {}px took {:.0f}s'.format(epoch, image_size, epoch_time))
+
+            if evaluator is not None:
+                checkpointer.best_score = evaluator.report(writer, checkpointer.best_score)
 
             if epoch > cfg.VAL_DELAY and \
                     (epoch + 1) % cfg.VAL_INTERVAL == 0:
-                ema_decay.assign(model)
-                model, writer, best_score = \
-                    validate(model, device, writer,
-                             cfg.MODEL.SAVE_PATH, best_score=best_score)
-                ema_decay.resume(model)
+                if evaluator is not None:
+                    evaluator.submit(ema_decay.state_dict(model), writer.eval_step,
+                                     checkpointer.best_score)
+                    writer.eval_step += 1
+                else:
+                    ema_decay.assign(model)
+                    profiler = StageProfiler(device) if args.profile else None
+                    model, writer, checkpointer.best_score = \
+                        validate(model, device, writer,
+                                 cfg.MODEL.SAVE_PATH, best_score=checkpointer.best_score,
+                                 profiler=profiler)
+                    ema_decay.resume(model)
+
+            checkpointer.save(epoch + 1, 0)
+
+        if evaluator is not None:
+            checkpointer.best_score = evaluator.close(writer, checkpointer.best_score)
+        checkpointer.wait()
+        writer.scalars.close()
 
     elif args.mode == 'eval':
-        model = EfficientDet.from_pretrained(args.model_name).to(device)
-        validate(model, device)
+        model = EfficientDet.from_pretrained(args.model_name, args.weights).to(device)
+        profiler = StageProfiler(device) if args.profile else None
+        wrapper = TTADetectionWrapper(model, device, profiler=profiler) \
+            if args.tta else None
+        if args.cascade is not None:
+            small = EfficientDet.from_pretrained(args.cascade).to(device).eval()
+            wrapper = CascadeDetectionWrapper(
+                DetectionWrapper(small, device),
+                wrapper or DetectionWrapper(model, device, profiler=profiler))
+        validate(model, device, profiler=profiler, wrapper=wrapper)
+        if args.cascade is not None:
+            logger('Cascade: {}'.format(wrapper.stats()))
 
 
 if __name__ == '__main__':
+    setup_logger(cfg.LOG_FILE)
     init_seed(cfg.SEED)
     main(parse_args())
@@ -6,46 +6,50 @@ from model.efficientnet import EfficientNet as EffNet
 
 
 class EfficientNet(nn.Module):
-    """ Backbone Wrapper """
+    """ Backbone Wrapper
+    Built from config only, without the classification head,
+    weights are loaded by EfficientDet """
     def __init__(self, model_name):
         super(EfficientNet, self).__init__()
-        model = EffNet.from_pretrained(model_name)
-        del model._bn1, model._conv_head, model._fc
-        del model._avg_pooling, model._dropout
-        self.model = model
+        self.model = EffNet.from_name(model_name, include_top=False)
+        # outputs of these blocks are the features, found once from the block args
+        self.feature_indices = self._feature_indices()
+        self.drop_connect_rates = self._drop_connect_rates()
 
     def forward(self, x):
         x = self.model._swish(self.model._bn0(self.model._conv_stem(x)))
 
         features = []
         for idx, block in enumerate(self.model._blocks):
-            drop_connect_rate = self.model._global_params.drop_connect_rate
-            if drop_connect_rate:
-                drop_connect_rate *= float(idx) / len(self.model._blocks)
-            x = block(x, drop_connect_rate=drop_connect_rate)
-
-            if idx == len(self.model._blocks) - 1:
+            x = block(x, drop_connect_rate=self.drop_connect_rates[idx])
+            if idx in self.feature_indices:
                 features.append(x)
 
-            else:
-                next_block = self.model._blocks[idx + 1]
-                if next_block._depthwise_conv.stride == [2, 2]:
-                    features.append(x)
-
-        return features[2:]
+        return features
 
     def get_channels_list(self):
-        channels = []
+        return [self.model._blocks[idx]._block_args.output_filters
+                for idx in self.feature_indices]
+
+    def _feature_indices(self):
+        """ Blocks followed by a strided block (and the last one), without the first two """
+        indices = []
         for idx, block in enumerate(self.model._blocks):
             if idx == len(self.model._blocks) - 1:
-                channels.append(block._block_args.output_filters)
+                indices.append(idx)
 
             else:
                 next_block = self.model._blocks[idx + 1]
                 if next_block._block_args.stride == [2]:
-                    channels.append(block._block_args.output_filters)
+                    indices.append(idx)
+
+        return indices[2:]
 
-        return channels[2:]
+    def _drop_connect_rates(self):
+        drop_connect_rate = self.model._global_params.drop_connect_rate
+        n_blocks = len(self.model._blocks)
+        return [drop_connect_rate * float(idx) / n_blocks if drop_connect_rate
+                else drop_connect_rate for idx in range(n_blocks)]
 
 
 if __name__ == '__main__':
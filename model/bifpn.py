@@ -41,7 +41,7 @@ class BiFPN(nn.Module):
         self.weights_6_out = nn.Parameter(torch.ones(3))
         self.weights_7_out = nn.Parameter(torch.ones(2))
 
-        self.upsample = lambda x: F.interpolate(x, scale_factor=self.REDUCTION_RATIO)
+        self.upsample = nn.Upsample(scale_factor=self.REDUCTION_RATIO)
         self.downsample = MaxPool2dSamePad(self.REDUCTION_RATIO + 1, self.REDUCTION_RATIO)
 
         self.act = Swish()
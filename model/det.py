@@ -1,4 +1,6 @@
+import copy
 from itertools import chain
+from pathlib import Path
 
 import numpy as np
 import torch
@@ -8,43 +10,156 @@ import config as cfg
 from log.logger import logger
 from model.backbone import EfficientNet
 from model.bifpn import BiFPN
+from model.efficientnet.utils import MemoryEfficientSwish, Swish
+from model.fusion import FusedHeadNet
 from model.head import HeadNet
-from model.module import ChannelAdjuster
+from model.module import ChannelAdjuster, MaxPool2dSamePad
 from utils.utils import check_model_name, download_model_weights
 from utils.tools import variance_scaling_
+from utils.weights import assign_state_dict, is_flat_weights, load_flat_weights
 
 
 class EfficientDet(nn.Module):
     def __init__(self, name):
         super(EfficientDet, self).__init__()
         check_model_name(name)
+        # per-instance configuration, building a model never mutates cfg.MODEL
+        self.info = cfg.get_model_info(name)
 
-        self.backbone = EfficientNet(cfg.MODEL.BACKBONE)
+        self.backbone = EfficientNet(self.info.BACKBONE)
 
         self.adjuster = ChannelAdjuster(self.backbone.get_channels_list(),
-                                        cfg.MODEL.W_BIFPN)
-        self.bifpn = nn.Sequential(*[BiFPN(cfg.MODEL.W_BIFPN)
-                                     for _ in range(cfg.MODEL.D_BIFPN)])
+                                        self.info.W_BIFPN)
+        self.bifpn = nn.Sequential(*[BiFPN(self.info.W_BIFPN)
+                                     for _ in range(self.info.D_BIFPN)])
 
-        self.regresser = HeadNet(n_features=cfg.MODEL.W_BIFPN,
+        self.regresser = HeadNet(n_features=self.info.W_BIFPN,
                                  out_channels=cfg.NUM_ANCHORS * 4,
-                                 n_repeats=cfg.MODEL.D_CLASS)
+                                 n_repeats=self.info.D_CLASS,
+                                 n_levels=cfg.NUM_LEVELS)
 
-        self.classifier = HeadNet(n_features=cfg.MODEL.W_BIFPN,
+        self.classifier = HeadNet(n_features=self.info.W_BIFPN,
                                   out_channels=cfg.NUM_ANCHORS * cfg.NUM_CLASSES,
-                                  n_repeats=cfg.MODEL.D_CLASS)
+                                  n_repeats=self.info.D_CLASS,
+                                  n_levels=cfg.NUM_LEVELS)
+        # classes predicted by the classifier head and their COCO category ids
+        self.num_classes = cfg.NUM_CLASSES
+        self.category_ids = list(range(1, cfg.NUM_CLASSES + 1))
+        # classifier and regresser merged by fuse_heads
+        self.heads = None
+        self.frozen_backbone = False
+
+    @property
+    def image_size(self):
+        return self.info.IMAGE_SIZE
 
     def forward(self, x):
-        features = self.backbone(x)
+        return self.forward_features(self.backbone(x))
 
+    def forward_features(self, features):
+        """ Detector on top of backbone features, e.g. from a BackboneFeatureStore """
         features = self.adjuster(features)
         features = self.bifpn(features)
 
-        cls_outputs = self.classifier(features)
-        box_outputs = self.regresser(features)
+        if self.heads is not None:
+            cls_outputs, box_outputs = self.heads(features)
+        else:
+            cls_outputs = self.classifier(features)
+            box_outputs = self.regresser(features)
 
         return cls_outputs, box_outputs
 
+    def train(self, mode=True):
+        super(EfficientDet, self).train(mode)
+        if self.frozen_backbone:
+            self.backbone.eval()
+        return self
+
+    def freeze_backbone(self):
+        """ Fine-tuning mode: backbone weights and batch norm statistics stay fixed,
+        only the adjuster, BiFPN and heads are trained """
+        self.backbone.requires_grad_(False)
+        self.frozen_backbone = True
+        return self.train(self.training)
+
+    def fuse_heads(self):
+        """ Inference-time transformation, in place: runs the classifier and
+        box regression towers as one grouped stack (see FusedHeadNet).
+        Apply class_subset before fusing """
+        if self.heads is None:
+            self.heads = FusedHeadNet(self.classifier, self.regresser).train(self.training)
+            self.classifier, self.regresser = None, None
+        return self
+
+    def set_swish(self, memory_efficient=True):
+        """ Swaps every Swish activation of the model, the memory efficient one
+        is a custom autograd Function that graph compilers cannot trace through """
+        for module in list(self.modules()):
+            for name, child in module.named_children():
+                if isinstance(child, (MemoryEfficientSwish, Swish)):
+                    setattr(module, name, MemoryEfficientSwish() if memory_efficient else Swish())
+        return self
+
+    def specialize(self, image_size=None):
+        """ Static-shape mode for torch.compile and tracing, in place.
+        Max pooling padding is precomputed for (height, width) inputs (default:
+        the square model input), per pooled level, and Swish is traced as plain ops """
+        if image_size is None:
+            image_size = self.image_size
+        height, width = (image_size, image_size) \
+            if isinstance(image_size, int) else image_size
+        stride = 2 ** cfg.MAX_LEVEL
+        if height % stride or width % stride:
+            raise ValueError('Input size {}x{} is not a multiple of the largest stride {}'.format(
+                height, width, stride))
+
+        # input sizes of the pooling layers, recorded in one dry run
+        self.unspecialize()
+        pools = [m for m in self.modules() if isinstance(m, MaxPool2dSamePad)]
+        handles = [pool.register_forward_pre_hook(
+            lambda m, inputs: m.set_static_padding(tuple(inputs[0].shape[-2:])))
+            for pool in pools]
+        training, parameter = self.training, next(self.parameters())
+        with torch.no_grad():
+            self.eval()(torch.zeros(1, 3, height, width,
+                                    device=parameter.device, dtype=parameter.dtype))
+        self.train(training)
+        for handle in handles:
+            handle.remove()
+        return self.set_swish(False)
+
+    def unspecialize(self):
+        """ Back to dynamic input shapes """
+        for module in self.modules():
+            if isinstance(module, MaxPool2dSamePad):
+                module.set_static_padding(None)
+        return self.set_swish(True)
+
+    def class_subset(self, category_ids):
+        """ Derived model predicting only the given COCO category ids.
+        Output channel a * num_classes + c of the classifier head is the logit
+        of class c for anchor a, only the channels of kept classes are sliced
+        out of its pointwise conv. Detections keep the original category ids """
+        missing = set(category_ids) - set(self.category_ids)
+        if missing:
+            raise ValueError('Category ids {} are not predicted by the model'.format(
+                sorted(missing)))
+        classes = [self.category_ids.index(c) for c in category_ids]
+        channels = torch.tensor([a * self.num_classes + c
+                                 for a in range(cfg.NUM_ANCHORS) for c in classes])
+
+        model = copy.deepcopy(self)
+        conv_pw = self.classifier.head.conv_pw
+        pruned = nn.Conv2d(conv_pw.in_channels, len(channels), kernel_size=1, bias=True)
+        pruned.to(conv_pw.weight.device, conv_pw.weight.dtype)
+        with torch.no_grad():
+            pruned.weight.copy_(conv_pw.weight[channels])
+            pruned.bias.copy_(conv_pw.bias[channels])
+        model.classifier.head.conv_pw = pruned
+        model.num_classes = len(classes)
+        model.category_ids = list(category_ids)
+        return model
+
     @staticmethod
     def from_name(name):
         """ Interface for model prepared to train on COCO """
@@ -61,17 +176,21 @@ class EfficientDet(nn.Module):
         return model_to_return
 
     @staticmethod
-    def from_pretrained(name):
-        """ Interface for pre-trained model """
-        cfg.MODEL.choose_model(name)
+    def from_pretrained(name, weights_path=None):
+        """ Interface for pre-trained model
+        The architecture is built from config only and the detector
+        checkpoint is loaded once, nothing is downloaded if weights_path
+        (or the default weights file) exists. Unlike from_name the global
+        cfg.MODEL is left untouched, so several variants can be loaded """
+        info = cfg.get_model_info(name)
+
+        weights_path = info.WEIGHTS if weights_path is None else Path(weights_path)
+        if not weights_path.exists():
+            logger('Downloading pre-trained {}...'.format(info.NAME))
+            download_model_weights(name, weights_path)
 
         model_to_return = EfficientDet(name)
-
-        if not cfg.MODEL.WEIGHTS.exists():
-            logger('Downloading pre-trained {}...'.format(cfg.MODEL.NAME))
-            download_model_weights(name, cfg.MODEL.WEIGHTS)
-
-        model_to_return._load_weights(cfg.MODEL.WEIGHTS)
+        model_to_return._load_weights(weights_path)
         return model_to_return
 
     def _initialize_weights(self):
@@ -96,11 +215,19 @@ class EfficientDet(nn.Module):
         nn.init.constant_(self.classifier.head.conv_pw.bias, -np.log((1 - 0.01) / 0.01))
 
     def _load_backbone(self, path):
-        self.backbone.model.load_state_dict(torch.load(path), strict=False)
+        if is_flat_weights(path):
+            assign_state_dict(self.backbone.model, load_flat_weights(path), strict=False)
+        else:
+            self.backbone.model.load_state_dict(
+                torch.load(path, map_location='cpu'), strict=False)
         logger('Loaded backbone checkpoint {}'.format(path))
 
     def _load_weights(self, path):
-        self.load_state_dict(torch.load(path))
+        """ Flat (.bin) weights are memory-mapped and shared between processes """
+        if is_flat_weights(path):
+            assign_state_dict(self, load_flat_weights(path))
+        else:
+            self.load_state_dict(torch.load(path, map_location='cpu'))
         logger('Loaded checkpoint {}'.format(path))
 
 
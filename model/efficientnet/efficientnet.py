@@ -115,11 +115,12 @@ class EfficientNet(nn.Module):
     Args:
         blocks_args (list): A list of BlockArgs to construct blocks
         global_params (namedtuple): A set of GlobalParams shared between blocks
+        include_top (bool): Whether to build the classification head (final conv, pooling and fc)
     Example:
         model = EfficientNet.from_pretrained('efficientnet-b0')
     """
 
-    def __init__(self, blocks_args=None, global_params=None):
+    def __init__(self, blocks_args=None, global_params=None, include_top=True):
         super().__init__()
         assert isinstance(blocks_args, list), 'blocks_args should be a list'
         assert len(blocks_args) > 0, 'block args must be greater than 0'
@@ -165,6 +166,10 @@ class EfficientNet(nn.Module):
                 self._blocks.append(
                     MBConvBlock(block_args, self._global_params))
 
+        self._swish = MemoryEfficientSwish()
+        if not include_top:
+            return
+
         # Head
         in_channels = block_args.output_filters  # output of final block
         out_channels = round_filters(1280, self._global_params)
@@ -177,7 +182,6 @@ class EfficientNet(nn.Module):
         self._avg_pooling = nn.AdaptiveAvgPool2d(1)
         self._dropout = nn.Dropout(self._global_params.dropout_rate)
         self._fc = nn.Linear(out_channels, self._global_params.num_classes)
-        self._swish = MemoryEfficientSwish()
 
     def set_swish(self, memory_efficient=True):
         """Sets swish function as memory efficient (for training) or standard (for export)"""
@@ -217,11 +221,11 @@ class EfficientNet(nn.Module):
         return x
 
     @classmethod
-    def from_name(cls, model_name, override_params=None):
+    def from_name(cls, model_name, override_params=None, include_top=True):
         cls._check_model_name_is_valid(model_name)
         blocks_args, global_params = get_model_params(model_name,
                                                       override_params)
-        return cls(blocks_args, global_params)
+        return cls(blocks_args, global_params, include_top=include_top)
 
     @classmethod
     def from_pretrained(cls, model_name, advprop=False, num_classes=1000,
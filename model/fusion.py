@@ -0,0 +1,77 @@
+import torch
+import torch.nn as nn
+
+from model.efficientnet.utils import MemoryEfficientSwish as Swish
+
+
+def _fuse_depthwise(convs):
+    """ Depthwise convs of the towers as one depthwise conv over concatenated channels """
+    in_channels = sum(conv.in_channels for conv in convs)
+    fused = nn.Conv2d(in_channels, in_channels, kernel_size=convs[0].kernel_size,
+                      padding=convs[0].padding, groups=in_channels, bias=False)
+    fused.weight.data = torch.cat([conv.weight.data for conv in convs])
+    return fused
+
+
+def _fuse_pointwise(convs):
+    """ Pointwise convs of the towers as one grouped conv, a group per tower """
+    in_channels = sum(conv.in_channels for conv in convs)
+    out_channels = sum(conv.out_channels for conv in convs)
+    fused = nn.Conv2d(in_channels, out_channels, kernel_size=1,
+                      groups=len(convs), bias=False)
+    fused.weight.data = torch.cat([conv.weight.data for conv in convs])
+    return fused
+
+
+def _fuse_batch_norm(bns):
+    """ Per-tower BatchNorms as one over concatenated channels """
+    fused = nn.BatchNorm2d(sum(bn.num_features for bn in bns),
+                           eps=bns[0].eps, momentum=bns[0].momentum)
+    for name in ['weight', 'bias']:
+        getattr(fused, name).data = torch.cat([getattr(bn, name).data for bn in bns])
+    for name in ['running_mean', 'running_var']:
+        setattr(fused, name, torch.cat([getattr(bn, name) for bn in bns]))
+    return fused
+
+
+class FusedHeadNet(nn.Module):
+    """ Classification and box regression HeadNets merged into one stack.
+    Each level runs once over the concatenated channels of both towers:
+    depthwise convs over 2F channels, pointwise convs grouped by tower and
+    per-tower BatchNorms concatenated, so the result equals the separate
+    towers. The output pointwise convs differ in width and stay separate """
+
+    def __init__(self, classifier, regresser):
+        super(FusedHeadNet, self).__init__()
+        towers = [classifier, regresser]
+        self.n_features = classifier.head.conv_dw.in_channels
+
+        self.convs_dw = nn.ModuleList()
+        self.convs_pw = nn.ModuleList()
+        self.bns = nn.ModuleList()
+        for repeat in range(len(classifier.convs)):
+            self.convs_dw.append(_fuse_depthwise([t.convs[repeat].conv_dw for t in towers]))
+            self.convs_pw.append(_fuse_pointwise([t.convs[repeat].conv_pw for t in towers]))
+            self.bns.append(nn.ModuleList([
+                _fuse_batch_norm([t.bns[repeat][level] for t in towers])
+                for level in range(len(classifier.bns[repeat]))]))
+
+        self.act = Swish()
+        self.head_dw = _fuse_depthwise([t.head.conv_dw for t in towers])
+        self.cls_pw = classifier.head.conv_pw
+        self.box_pw = regresser.head.conv_pw
+
+    def forward(self, inputs):
+        cls_outs, box_outs = [], []
+
+        for f_idx, f_map in enumerate(inputs):
+            f_map = torch.cat([f_map, f_map], 1)
+            for conv_dw, conv_pw, bn in zip(self.convs_dw, self.convs_pw, self.bns):
+                f_map = conv_pw(conv_dw(f_map))
+                f_map = bn[f_idx](f_map)
+                f_map = self.act(f_map)
+            cls_map, box_map = self.head_dw(f_map).split(self.n_features, 1)
+            cls_outs.append(self.cls_pw(cls_map))
+            box_outs.append(self.box_pw(box_map))
+
+        return cls_outs, box_outs
@@ -10,7 +10,7 @@ from model.module import DepthWiseSeparableConvModule as DWSConv
 
 class HeadNet(nn.Module):
     """ Box Regression and Classification Nets """
-    def __init__(self, n_features, out_channels, n_repeats):
+    def __init__(self, n_features, out_channels, n_repeats, n_levels=cfg.NUM_LEVELS):
         super(HeadNet, self).__init__()
         self.convs = nn.ModuleList()
         self.bns = nn.ModuleList()
@@ -19,7 +19,7 @@ class HeadNet(nn.Module):
             self.convs.append(DWSConv(n_features, n_features,
                                       bath_norm=False, relu=False))
             bn_levels = nn.ModuleList()
-            for _ in range(cfg.NUM_LEVELS):
+            for _ in range(n_levels):
                 bn = nn.BatchNorm2d(n_features, eps=1e-3, momentum=0.01)
                 bn_levels.append(bn)
             self.bns.append(bn_levels)
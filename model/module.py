@@ -61,18 +61,31 @@ class MaxPool2dSamePad(nn.MaxPool2d):
 
         super(MaxPool2dSamePad, self).__init__(kernel_size, stride, padding,
                                                dilation, ceil_mode, count_include_pad)
-
-    def forward(self, x):
-        h, w = x.size()[-2:]
-
+        # precomputed by set_static_padding per (height, width) input size,
+        # one instance can pool several pyramid levels
+        self.static_padding = {}
+
+    def set_static_padding(self, input_size):
+        """ Fixes the padding for (height, width) inputs, None restores dynamic padding """
+        if input_size is None:
+            self.static_padding = {}
+        else:
+            self.static_padding[tuple(input_size)] = self._padding(*input_size)
+
+    def _padding(self, h, w):
         pad_h = (math.ceil(h / self.stride[0]) - 1) * self.stride[0] + \
                 (self.kernel_size[0] - 1) * self.dilation[0] + 1 - h
         pad_w = (math.ceil(w / self.stride[1]) - 1) * self.stride[1] + \
                 (self.kernel_size[1] - 1) * self.dilation[1] + 1 - w
+        return [pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2]
+
+    def forward(self, x):
+        padding = self.static_padding.get(tuple(x.shape[-2:]))
+        if padding is None:
+            padding = self._padding(*x.size()[-2:])
 
-        if pad_h > 0 or pad_w > 0:
-            x = F.pad(x, [pad_w // 2, pad_w - pad_w // 2, pad_h // 2,
-                          pad_h - pad_h // 2], value=self.PAD_VALUE)
+        if any(p > 0 for p in padding):
+            x = F.pad(x, padding, value=self.PAD_VALUE)
 
         x = F.max_pool2d(x, self.kernel_size, self.stride,
                          self.padding, self.dilation, self.ceil_mode)
@@ -0,0 +1,81 @@
+"""
+Offline anchor targets. Without augmentation the anchor labels and box
+regression targets of an image are the same every epoch, so they are
+computed once per model input size and read by the training loader
+(main.py --anchor_targets) instead of matching anchors on the fly.
+
+    python precompute_targets.py -model_name efficientdet-d0
+"""
+import argparse
+import time
+
+import torch
+
+import config as cfg
+from dataloader import COCODataset
+from log.logger import logger, setup_logger
+from utils.targets import AnchorLabeler, AnchorTargetStore
+from utils.transforms import Resizer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline anchor targets')
+
+    parser.add_argument('-model_name', default='efficientdet-d0', type=str)
+    parser.add_argument('--images', default=str(cfg.TRAIN_SET), type=str)
+    parser.add_argument('--annotations', default=str(cfg.TRAIN_ANNOTATIONS), type=str)
+    parser.add_argument('--output', default=None, type=str,
+                        help='target directory (default: ANCHOR_TARGETS_PATH/<model_name>)')
+    parser.add_argument('--device', type=str, default='cpu')
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+def compute_targets(dataset, image_size, bucket_stride, device='cpu'):
+    """ Sparse anchor targets of every dataset image, in dataset order.
+    Only annotations and image sizes are read, images are not decoded """
+    from tqdm import tqdm
+
+    resizer = Resizer(image_size, bucket_stride=bucket_stride)
+    labeler = AnchorLabeler(image_size)
+    targets = []
+    for img_id, img_info in tqdm(zip(dataset.img_ids, dataset.img_infos),
+                                 total=len(dataset)):
+        canvas_height, canvas_width, _, _, scale = \
+            resizer.get_shape(img_info['width'], img_info['height'])
+        annotation = dataset._get_img_ann(img_id)
+        # the same boxes as the loader sees after Resizer and collate_fn
+        boxes = torch.from_numpy(annotation['bbox'][:cfg.MAX_INSTANCES_PER_IMAGE] * scale)
+        classes = torch.from_numpy(annotation['cls'][:cfg.MAX_INSTANCES_PER_IMAGE])
+        image_targets = labeler.label_anchors(
+            boxes.to(device), classes.to(device), (canvas_height, canvas_width))
+        targets.append({k: v.cpu() for k, v in image_targets.items()})
+    return targets
+
+
+def main(args):
+    model_info = cfg.get_model_info(args.model_name)
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+    output = args.output or cfg.ANCHOR_TARGETS_PATH / args.model_name
+
+    dataset = COCODataset(path=args.images, annotations=args.annotations, transforms=None)
+    start = time.perf_counter()
+    targets = compute_targets(dataset, model_info.IMAGE_SIZE, bucket_stride, args.device)
+    store = AnchorTargetStore.write(output, dataset.img_ids, targets, meta={
+        'model_name': args.model_name,
+        'image_size': model_info.IMAGE_SIZE,
+        'bucket_stride': bucket_stride,
+        'match_threshold': cfg.MATCH_THRESHOLD,
+        'unmatched_threshold': cfg.UNMATCHED_THRESHOLD,
+        'max_instances': cfg.MAX_INSTANCES_PER_IMAGE})
+
+    n_positives = len(store.arrays['indices'])
+    logger('Anchor targets of {} images ({} positives, {:.1f} per image) written to {} in {:.0f}s'.format(
+        len(store), n_positives, n_positives / max(len(store), 1), output,
+        time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    setup_logger(cfg.LOG_FILE, mode='a')
+    main(parse_args())
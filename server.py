@@ -0,0 +1,265 @@
+"""
+Local HTTP inference server with dynamic batching on top of DetectionWrapper.
+Concurrent requests are coalesced into batches bounded by the maximum batch size
+and the maximum queueing delay. Images are decoded and resized in a worker pool.
+Several variants can be served from one process, each with its own batching queue.
+
+    python server.py -model_name efficientdet-d0 efficientdet-d3 --port 8080
+    curl --data-binary @image.jpg http://localhost:8080/detect
+    curl --data-binary @image.jpg http://localhost:8080/detect/efficientdet-d3
+    curl http://localhost:8080/metrics
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlparse
+
+import torch
+
+import config as cfg
+from log.logger import logger, setup_logger
+from utils.registry import ModelRegistry
+from utils.processing import (BatchArena, collate_images, normalize, open_image,
+                              resize_image)
+from utils.profiler import latency_summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inference server')
+
+    parser.add_argument('-model_name', nargs='+', default=['efficientdet-d0'], type=str,
+                        help='one or more variants served from this process')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=8080, type=int)
+    parser.add_argument('--max_batch_size', default=cfg.SERVER_MAX_BATCH_SIZE, type=int)
+    parser.add_argument('--max_delay_ms', default=cfg.SERVER_MAX_DELAY_MS, type=float)
+    parser.add_argument('--workers', default=cfg.SERVER_PREPROCESS_WORKERS, type=int)
+    parser.add_argument('--cuda', dest='cuda', action='store_true')
+    parser.add_argument('--cpu', dest='cuda', action='store_false')
+    parser.add_argument('--device', type=int, default=0)
+    parser.set_defaults(cuda=False)
+
+    arguments = parser.parse_args()
+    return arguments
+
+
+class InferenceError(Exception):
+    """ A batch failed inside the model, reported as a server error """
+
+
+def prepare_image(image_bytes, image_size):
+    """ Decodes and resizes a single request image into its own canvas """
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+    return resize_image(open_image(image_bytes), image_size, bucket_stride)
+
+
+class DynamicBatcher:
+    """ Coalesces concurrent requests into batches.
+    A batch is dispatched once it holds max_batch_size images or its
+    first request has been waiting for max_delay seconds """
+
+    def __init__(self, wrapper, max_batch_size, max_delay, pool):
+        self.wrapper = wrapper
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.pool = pool
+        # batches are collated into reused buffers, only the model thread uses them
+        self.arena = BatchArena() if cfg.BATCH_ARENA else None
+        # a single thread owns the model, so batches run one at a time
+        self.model_executor = ThreadPoolExecutor(max_workers=1)
+        # created by start on the serving loop
+        self.queue = None
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=cfg.SERVER_LATENCY_WINDOW)
+        self.queue_delays = deque(maxlen=cfg.SERVER_LATENCY_WINDOW)
+        self.n_requests = 0
+        self.n_errors = 0
+
+    async def submit(self, image_bytes):
+        """ Returns detections for one encoded image """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        np_img, scale = await loop.run_in_executor(
+            self.pool, prepare_image, image_bytes, self.wrapper.image_size)
+
+        future = loop.create_future()
+        await self.queue.put((np_img, scale, future, time.perf_counter()))
+        detections = await future
+
+        self.latencies.append(time.perf_counter() - start)
+        self.n_requests += 1
+        return detections
+
+    def start(self):
+        """ Creates the request queue and the batching task on the running loop """
+        self.queue = asyncio.Queue()
+        return asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][-1] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            dispatch_time = time.perf_counter()
+            for item in batch:
+                self.queue_delays.append(dispatch_time - item[-1])
+            self.batch_sizes[len(batch)] += 1
+
+            futures = [item[2] for item in batch]
+            try:
+                outputs = await loop.run_in_executor(
+                    self.model_executor, self._infer, batch)
+            except Exception as e:
+                self.n_errors += len(batch)
+                logger('Inference of a batch of {} failed: {!r}'.format(len(batch), e))
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(InferenceError(repr(e)))
+                continue
+
+            for future, detections in zip(futures, outputs):
+                if not future.done():
+                    future.set_result(detections)
+
+    def _infer(self, batch):
+        x = collate_images([item[0] for item in batch], arena=self.arena)
+        x = normalize(x) if self.arena is None else self.arena.normalize(x)
+        scales = [item[1] for item in batch]
+        with torch.no_grad():
+            return self.wrapper.detect(x, [0] * len(batch), scales)
+
+    def metrics(self):
+        n_batches = sum(self.batch_sizes.values())
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'requests': self.n_requests,
+            'errors': self.n_errors,
+            'batches': n_batches,
+            'mean_batch_size': sum(k * v for k, v in self.batch_sizes.items()) / n_batches
+            if n_batches else 0.,
+            'batch_sizes': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            'latency_ms': latency_summary(self.latencies),
+            'queue_delay_ms': latency_summary(self.queue_delays),
+        }
+
+
+class DetectionServer:
+    """ Minimal asyncio HTTP/1.1 server
+    POST /detect[/<model>]  body: encoded image, query: ?threshold=<min score>,
+                            without a model name the first registered one is used
+    GET  /models            served variants and their input sizes
+    GET  /metrics           per model queue depth, batch sizes and latency percentiles
+    GET  /health
+    Malformed requests and undecodable images get 400, failed inference 500
+
+    wrappers: a ModelRegistry (or a dict) mapping model names to wrappers,
+    the pre-processing pool is shared, batching queues are per model """
+
+    def __init__(self, wrappers, max_batch_size=cfg.SERVER_MAX_BATCH_SIZE,
+                 max_delay_ms=cfg.SERVER_MAX_DELAY_MS,
+                 workers=cfg.SERVER_PREPROCESS_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.batchers = {name: DynamicBatcher(wrapper, max_batch_size,
+                                              max_delay_ms / 1000., self.pool)
+                         for name, wrapper in wrappers.items()}
+        self.default = next(iter(self.batchers))
+        self._server = None
+        self._batcher_tasks = []
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self._batcher_tasks = [batcher.start() for batcher in self.batchers.values()]
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for task in self._batcher_tasks:
+            task.cancel()
+        self.pool.shutdown(wait=False)
+
+    async def serve_forever(self, host='127.0.0.1', port=8080):
+        server = await self.start(host, port)
+        logger('Serving on http://{}:{}'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            status, payload = await self._route(method, target, body)
+        except InferenceError as e:
+            status, payload = 500, {'error': str(e)}
+        except Exception as e:
+            # malformed requests and images that cannot be decoded
+            status, payload = 400, {'error': str(e)}
+
+        data = json.dumps(payload).encode()
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                     'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                         status, HTTPStatus(status).phrase, len(data)).encode())
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+
+    async def _route(self, method, target, body):
+        url = urlparse(target)
+        if method == 'GET' and url.path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and url.path == '/models':
+            return 200, {name: {'image_size': batcher.wrapper.image_size}
+                         for name, batcher in self.batchers.items()}
+        if method == 'GET' and url.path == '/metrics':
+            return 200, {name: batcher.metrics()
+                         for name, batcher in self.batchers.items()}
+        if method == 'POST' and (url.path == '/detect' or url.path.startswith('/detect/')):
+            name = url.path[len('/detect/'):] or self.default
+            if name not in self.batchers:
+                return 404, {'error': 'model {} is not served'.format(name)}
+            threshold = float(parse_qs(url.query).get('threshold', [0.])[0])
+            detections = await self.batchers[name].submit(body)
+            return 200, {'detections': [
+                {'bbox': det[1:5].tolist(), 'score': float(det[5]),
+                 'category_id': int(det[6])}
+                for det in detections if det[5] >= threshold]}
+        return 404, {'error': 'not found'}
+
+
+def main(args):
+    device = torch.device('cuda:{}'.format(args.device)) \
+        if args.cuda else torch.device('cpu')
+
+    registry = ModelRegistry(device)
+    for model_name in args.model_name:
+        registry.load(model_name)
+    server = DetectionServer(registry, args.max_batch_size,
+                             args.max_delay_ms, args.workers)
+    asyncio.run(server.serve_forever(args.host, args.port))
+
+
+if __name__ == '__main__':
+    setup_logger(cfg.LOG_FILE, mode='a')
+    main(parse_args())
@@ -1,38 +1,74 @@
 import torch
 from torch.nn.utils import clip_grad_norm_
-from tqdm import tqdm
 
 import config as cfg
+from utils.processing import normalize
 from utils.utils import get_gradnorm, get_lr, is_valid_number
 
 
-def train(model, optimizer, loader, scheduler, criterion, ema, device, writer):
+def train(model, optimizer, loader, scheduler, criterion, ema, device, writer,
+          checkpointer=None, epoch=0, start=0, augmenter=None, labeler=None):
+    """ start: number of batches of the epoch consumed before a resume
+    augmenter: optional BatchAugmenter applied to uint8 batches on the device
+    labeler: AnchorLabeler assigning anchor targets on the fly, for batches
+        without offline targets or whose boxes were augmented
+    Batches of cached backbone features skip the backbone and augmentation """
+    from tqdm import tqdm
+
     model.train()
 
-    pbar = tqdm(enumerate(loader), total=len(loader), leave=False)
+    pbar = tqdm(enumerate(loader, start), total=start + len(loader),
+                initial=start, leave=False)
     for step, batch in pbar:
 
-        batch_size = batch.shape[0]
         x, labels = batch
-        cls_output, box_output = model(x)
+        # a list of cached backbone features (CachedFeatureDataset) or images
+        cached = isinstance(x, list)
+        if cached:
+            x = [feature.to(device, non_blocking=True).float() for feature in x]
+            image_size = tuple(s * 2 ** cfg.MIN_LEVEL for s in x[0].shape[-2:])
+        else:
+            x = x.to(device, non_blocking=True)
+            image_size = tuple(x.shape[-2:])
+        batch_size = labels['cls'].shape[0]
+        labels['bbox'] = labels['bbox'].to(device, non_blocking=True)
+        labels['cls'] = labels['cls'].to(device, non_blocking=True)
+        if augmenter is not None and not cached:
+            x, labels['bbox'], labels['cls'] = augmenter(
+                x, labels['bbox'], labels['cls'], writer.train_step)
+            labels.pop('anchor_targets', None)
+        if 'anchor_targets' in labels:
+            labels['anchor_targets'] = {k: v.to(device, non_blocking=True)
+                                        for k, v in labels['anchor_targets'].items()}
+        elif labeler is not None:
+            labels['anchor_targets'] = labeler.label_batch(
+                labels['bbox'], labels['cls'], image_size)
+        if cached:
+            cls_output, box_output = model.forward_features(x)
+        else:
+            cls_output, box_output = model(normalize(x))
 
         loss, cls_loss, box_loss = criterion(cls_output, box_output, labels)
         values = [v.data.item() for v in [loss, cls_loss, box_loss]]
 
         pbar.set_description(
-            "all:{.2f} | cls:{.2f} | box:{.2f}".format(
+            "all:{:.2f} | cls:{:.2f} | box:{:.2f}".format(
                 values[0], values[1], values[2])
         )
 
-        if is_valid_number(loss.data.item()):
+        if is_valid_number(values[0]):
             loss.backward()
 
-            writer.add_scalar('Train/overall_loss', values[0], writer.train_step)
-            writer.add_scalar('Train/class_loss', values[1], writer.train_step)
-            writer.add_scalar('Train/box_loss', values[2], writer.train_step)
-            writer.add_scalar('Train/gradnorm', get_gradnorm(optimizer), writer.train_step)
-            writer.add_scalar('Train/lr', get_lr(optimizer), writer.train_step)
-            writer.add_scalar(f"Train/gpu memory", torch.cuda.memory_allocated(device), writer.train_step)
+            # sampled, the scalars are written by a background thread
+            if writer.scalars.should_log(writer.train_step):
+                writer.scalars.add_scalars({
+                    'Train/overall_loss': values[0],
+                    'Train/class_loss': values[1],
+                    'Train/box_loss': values[2],
+                    'Train/gradnorm': get_gradnorm(optimizer),
+                    'Train/lr': get_lr(optimizer),
+                    'Train/gpu memory': torch.cuda.memory_allocated(device),
+                }, writer.train_step)
 
             writer.train_step += 1
 
@@ -44,4 +80,7 @@ def train(model, optimizer, loader, scheduler, criterion, ema, device, writer):
 
             scheduler.step()
 
+        if checkpointer is not None:
+            checkpointer.step(epoch, step + 1)
+
     return model, optimizer, scheduler, writer
@@ -23,6 +23,7 @@ from __future__ import print_function
 import collections
 import numpy as np
 import torch
+import torch.nn as nn
 
 # from effdet.object_detection import argmax_matcher
 # from effdet.object_detection import box_list
@@ -105,6 +106,24 @@ def nms(dets, thresh):
     return keep
 
 
+def batched_nms(dets, classes, thresh):
+    """Class-wise non-maximum suppression in a single pass.
+    Boxes of different classes are shifted apart so that they never overlap.
+    Args:
+        dets: a numpy array with shape [N, 5] of (x1, y1, x2, y2, score).
+        classes: a numpy array with shape [N] of class ids.
+        thresh: IoU threshold.
+    Returns:
+        keep: indices of the kept detections ordered by decreasing score.
+    """
+    if dets.shape[0] == 0:
+        return []
+    offsets = classes.astype(dets.dtype) * (dets[:, :4].max() + 1)
+    shifted = dets.copy()
+    shifted[:, :4] += offsets[:, None]
+    return nms(shifted, thresh)
+
+
 def _generate_anchor_configs(min_level, max_level, num_scales, aspect_ratios):
     """Generates mapping from output level to a list of anchor configurations.
     A configuration is a tuple of (num_anchors, scale, aspect_ratio).
@@ -128,47 +147,114 @@ def _generate_anchor_configs(min_level, max_level, num_scales, aspect_ratios):
     return anchor_configs
 
 
-def _generate_anchor_boxes(image_size, anchor_scale, anchor_configs):
+def _generate_anchor_boxes(image_size, anchor_scale, anchor_configs,
+                           device=None, dtype=torch.float32):
     """Generates multiscale anchor boxes.
+    Half sizes of all levels and configurations are computed at once, centers
+    are broadcast against them level by level on the target device.
     Args:
-        image_size: integer number of input image size. The input image has the same dimension for
-            width and height. The image_size should be divided by the largest feature stride 2^max_level.
+        image_size: integer number of input image size for a square input or
+            a (height, width) tuple for a rectangular one. Both sides should be
+            divided by the largest feature stride 2^max_level.
         anchor_scale: float number representing the scale of size of the base
             anchor to the feature stride 2^level.
         anchor_configs: a dictionary with keys as the levels of anchors and
             values as a list of anchor configuration.
+        device: torch device to generate the anchors on.
+        dtype: torch dtype of the returned anchors.
     Returns:
-        anchor_boxes: a numpy array with shape [N, 4], which stacks anchors on all feature levels.
+        anchor_boxes: a tensor with shape [N, 4], which stacks anchors on all feature levels.
     Raises:
         ValueError: input size must be the multiple of largest feature stride.
     """
+    image_height, image_width = (image_size, image_size) \
+        if isinstance(image_size, int) else image_size
+
+    configs = list(anchor_configs.values())
+    strides = torch.tensor([[config[0] for config in level_configs]
+                            for level_configs in configs],
+                           dtype=torch.float64, device=device)
+    octave_scales = torch.tensor([[config[1] for config in level_configs]
+                                  for level_configs in configs],
+                                 dtype=torch.float64, device=device)
+    aspects = torch.tensor([[config[2] for config in level_configs]
+                            for level_configs in configs],
+                           dtype=torch.float64, device=device)
+
+    # [num_levels, num_configs, 2] half sizes in (y, x) order
+    base_anchor_size = anchor_scale * strides * 2 ** octave_scales
+    half_sizes = torch.stack([base_anchor_size * aspects[..., 1] / 2.0,
+                              base_anchor_size * aspects[..., 0] / 2.0], dim=-1)
+
     boxes_all = []
-    for _, configs in anchor_configs.items():
-        boxes_level = []
-        for config in configs:
-            stride, octave_scale, aspect = config
-            if image_size % stride != 0:
-                raise ValueError("input size must be divided by the stride.")
-            base_anchor_size = anchor_scale * stride * 2 ** octave_scale
-            anchor_size_x_2 = base_anchor_size * aspect[0] / 2.0
-            anchor_size_y_2 = base_anchor_size * aspect[1] / 2.0
-
-            x = np.arange(stride / 2, image_size, stride)
-            y = np.arange(stride / 2, image_size, stride)
-            xv, yv = np.meshgrid(x, y)
-            xv = xv.reshape(-1)
-            yv = yv.reshape(-1)
-
-            boxes = np.vstack((yv - anchor_size_y_2, xv - anchor_size_x_2,
-                               yv + anchor_size_y_2, xv + anchor_size_x_2))
-            boxes = np.swapaxes(boxes, 0, 1)
-            boxes_level.append(np.expand_dims(boxes, axis=1))
-        # concat anchors on the same level to the reshape NxAx4
-        boxes_level = np.concatenate(boxes_level, axis=1)
+    for level_idx, level_configs in enumerate(configs):
+        stride = level_configs[0][0]
+        if image_height % stride != 0 or image_width % stride != 0:
+            raise ValueError("input size must be divided by the stride.")
+
+        x = torch.arange(stride / 2, image_width, stride, dtype=torch.float64, device=device)
+        y = torch.arange(stride / 2, image_height, stride, dtype=torch.float64, device=device)
+        yv, xv = torch.meshgrid(y, x, indexing='ij')
+        centers = torch.stack([yv.reshape(-1), xv.reshape(-1)], dim=-1)
+
+        # [num_locations, num_configs, 4] reshaped to NAx4
+        centers = centers[:, None, :]
+        half_size = half_sizes[level_idx][None, :, :]
+        boxes_level = torch.cat([centers - half_size, centers + half_size], dim=-1)
         boxes_all.append(boxes_level.reshape([-1, 4]))
 
-    anchor_boxes = np.vstack(boxes_all)
-    return anchor_boxes
+    anchor_boxes = torch.cat(boxes_all, dim=0)
+    return anchor_boxes.to(dtype)
+
+
+def boxes_to_centers(boxes):
+    """Converts [..., 4] (ymin, xmin, ymax, xmax) boxes to (ycenter, xcenter, height, width)."""
+    ymin, xmin, ymax, xmax = boxes.unbind(-1)
+    return torch.stack([(ymin + ymax) / 2, (xmin + xmax) / 2,
+                        ymax - ymin, xmax - xmin], dim=-1)
+
+
+def decode_boxes(rel_codes, anchor_centers):
+    """Batched PyTorch version of decode_box_outputs.
+    Args:
+        rel_codes: a tensor with shape [..., 4] of (ty, tx, th, tw) box regression outputs.
+        anchor_centers: a tensor with shape [..., 4] of (ycenter, xcenter, height, width) anchors.
+    Returns:
+        boxes: a tensor with shape [..., 4] of (ymin, xmin, ymax, xmax) boxes.
+    """
+    ycenter_a, xcenter_a, ha, wa = anchor_centers.unbind(-1)
+    ty, tx, th, tw = rel_codes.unbind(-1)
+
+    w = torch.exp(tw) * wa
+    h = torch.exp(th) * ha
+    ycenter = ty * ha + ycenter_a
+    xcenter = tx * wa + xcenter_a
+    return torch.stack([ycenter - h / 2., xcenter - w / 2.,
+                        ycenter + h / 2., xcenter + w / 2.], dim=-1)
+
+
+def encode_boxes(boxes, anchor_centers):
+    """Inverse of decode_boxes, box regression targets of boxes against anchors.
+    Args:
+        boxes: a tensor with shape [..., 4] of (ymin, xmin, ymax, xmax) boxes.
+        anchor_centers: a tensor with shape [..., 4] of (ycenter, xcenter, height, width) anchors.
+    Returns:
+        rel_codes: a tensor with shape [..., 4] of (ty, tx, th, tw) targets.
+    """
+    ycenter_a, xcenter_a, ha, wa = anchor_centers.unbind(-1)
+    ycenter, xcenter, h, w = boxes_to_centers(boxes).unbind(-1)
+    return torch.stack([(ycenter - ycenter_a) / ha, (xcenter - xcenter_a) / wa,
+                        torch.log(h / ha), torch.log(w / wa)], dim=-1)
+
+
+def box_iou(boxes1, boxes2):
+    """Pairwise IoU of [N, 4] and [M, 4] (ymin, xmin, ymax, xmax) boxes, shaped [N, M]."""
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    top_left = torch.max(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = torch.min(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = (bottom_right - top_left).clamp(min=0).prod(-1)
+    return intersection / (area1[:, None] + area2[None, :] - intersection)
 
 
 def generate_detections(
@@ -196,10 +282,35 @@ def generate_detections(
             [image_id, x, y, width, height, score, class]
     """
     anchor_boxes = anchor_boxes[indices, :]
-    scores = sigmoid(cls_outputs)
 
     # apply bounding box regression to anchors
     boxes = decode_box_outputs(box_outputs.swapaxes(0, 1), anchor_boxes.swapaxes(0, 1))
+
+    return generate_detections_from_boxes(
+        cls_outputs, boxes, classes, image_id, image_scale, num_classes)
+
+
+def generate_detections_from_boxes(
+        cls_outputs, boxes, classes, image_id, image_scale, num_classes,
+        category_ids=None):
+    """Generates detections from already decoded boxes.
+    Args:
+        cls_outputs: a numpy array with shape [N, 1], which has the highest class
+            scores of the selected top-K anchors.
+        boxes: a numpy array with shape [N, 4] of decoded (ymin, xmin, ymax, xmax) boxes.
+        classes: a numpy array with shape [N], which represents the class
+            prediction on all selected anchors from top-k selection.
+        image_id: an integer number to specify the image id.
+        image_scale: a float representing the scale between original image
+            and input image for the detector.
+        num_classes: a integer that indicates the number of classes.
+        category_ids: optional list mapping class indices to category ids,
+            by default class c is reported as category c + 1.
+    Returns:
+        detections: detection results in a tensor with each row representing
+            [image_id, x, y, width, height, score, class]
+    """
+    scores = sigmoid(cls_outputs)
     boxes = boxes[:, [1, 0, 3, 2]]
 
     # run class-wise nms
@@ -222,7 +333,8 @@ def generate_detections(
         top_detections_cls = np.column_stack(
             (np.repeat(image_id, len(top_detection_idx)),
              top_detections_cls,
-             np.repeat(c + 1, len(top_detection_idx)))
+             np.repeat(c + 1 if category_ids is None else category_ids[c],
+                       len(top_detection_idx)))
         )
         detections.append(top_detections_cls)
 
@@ -251,10 +363,14 @@ def generate_detections(
     return detections
 
 
-class Anchors(object):
-    """RetinaNet Anchors class."""
+class Anchors(nn.Module):
+    """RetinaNet Anchors class.
+    Boxes of the default image size are registered as (non-persistent) buffers
+    and move together with the parent module. Boxes for other input sizes,
+    devices or dtypes are kept in an LRU cache."""
 
-    def __init__(self, min_level, max_level, num_scales, aspect_ratios, anchor_scale, image_size):
+    def __init__(self, min_level, max_level, num_scales, aspect_ratios, anchor_scale, image_size,
+                 cache_size=8):
         """Constructs multiscale RetinaNet anchors.
         Args:
             min_level: integer number of minimum level of the output feature pyramid.
@@ -267,28 +383,80 @@ class Anchors(object):
                 [(1, 1), (1.4, 0.7), (0.7, 1.4)] adds three anchors on each level.
             anchor_scale: float number representing the scale of size of the base
                 anchor to the feature stride 2^level.
-            image_size: integer number of input image size. The input image has the
-                same dimension for width and height. The image_size should be divided by
-                the largest feature stride 2^max_level.
+            image_size: integer number of input image size for a square input or
+                a (height, width) tuple for a rectangular one. Both sides should be
+                divided by the largest feature stride 2^max_level.
+            cache_size: maximum number of (image_size, device, dtype) entries kept
+                in the cache besides the registered buffers.
         """
+        super(Anchors, self).__init__()
         self.min_level = min_level
         self.max_level = max_level
         self.num_scales = num_scales
         self.aspect_ratios = aspect_ratios
         self.anchor_scale = anchor_scale
         self.image_size = image_size
+        self.cache_size = cache_size
         self.config = self._generate_configs()
-        self.boxes = self._generate_boxes()
+        self._cache = collections.OrderedDict()
+
+        boxes = self._generate_boxes()
+        self.register_buffer('boxes', boxes, persistent=False)
+        self.register_buffer('centers', boxes_to_centers(boxes), persistent=False)
 
     def _generate_configs(self):
         """Generate configurations of anchor boxes."""
         return _generate_anchor_configs(self.min_level, self.max_level, self.num_scales, self.aspect_ratios)
 
-    def _generate_boxes(self):
+    def _generate_boxes(self, image_size=None, device=None, dtype=torch.float32):
         """Generates multiscale anchor boxes."""
-        boxes = _generate_anchor_boxes(self.image_size, self.anchor_scale, self.config)
-        boxes = torch.from_numpy(boxes).float()
-        return boxes
+        image_size = self.image_size if image_size is None else image_size
+        return _generate_anchor_boxes(image_size, self.anchor_scale, self.config, device, dtype)
+
+    def get(self, image_size=None, device=None, dtype=None):
+        """Returns (boxes, centers) anchors for an input size on a device.
+        Args:
+            image_size: integer or (height, width) input size, defaults to the constructor's.
+            device: torch device, defaults to the device of the registered buffers.
+            dtype: torch dtype, defaults to the dtype of the registered buffers.
+        Returns:
+            boxes: a tensor with shape [N, 4] of (ymin, xmin, ymax, xmax) anchors.
+            centers: a tensor with shape [N, 4] of (ycenter, xcenter, height, width) anchors.
+        """
+        image_size = _to_pair(self.image_size if image_size is None else image_size)
+        device = self.boxes.device if device is None else torch.device(device)
+        dtype = self.boxes.dtype if dtype is None else dtype
+
+        if image_size == _to_pair(self.image_size) and \
+                device == self.boxes.device and dtype == self.boxes.dtype:
+            return self.boxes, self.centers
+
+        key = (image_size, device, dtype)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        boxes = self._generate_boxes(image_size, device).to(dtype)
+        self._cache[key] = (boxes, boxes_to_centers(boxes))
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return self._cache[key]
+
+    def decode(self, box_outputs, indices, image_size=None):
+        """Decodes top-k box regression outputs on their device.
+        Args:
+            box_outputs: a tensor with shape [batch_size, K, 4] of box regression outputs.
+            indices: a tensor with shape [batch_size, K] of anchor indices from top-k selection.
+            image_size: integer or (height, width) input size.
+        Returns:
+            boxes: a tensor with shape [batch_size, K, 4] of (ymin, xmin, ymax, xmax) boxes.
+        """
+        _, centers = self.get(image_size, box_outputs.device, box_outputs.dtype)
+        return decode_boxes(box_outputs, centers[indices])
 
     def get_anchors_per_location(self):
         return self.num_scales * len(self.aspect_ratios)
+
+
+def _to_pair(image_size):
+    return (image_size, image_size) if isinstance(image_size, int) else tuple(image_size)
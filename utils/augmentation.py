@@ -0,0 +1,83 @@
+import torch
+import torch.nn.functional as F
+
+import config as cfg
+
+
+class BatchAugmenter:
+    """ Random horizontal flip, scale jitter and crop on whole uint8 NCHW
+    batches, applied as one bilinear resampling on the training device after
+    collation. Boxes (ymin, xmin, ymax, xmax) padded to [batch_size, N, 4]
+    are transformed in lockstep, boxes leaving the canvas get class -1.
+    Parameters are drawn from a generator seeded with (seed, step), so a
+    batch is augmented identically on every device and after a resume """
+
+    def __init__(self, flip_prob=cfg.FLIP_PROB, scale_range=cfg.SCALE_JITTER,
+                 seed=cfg.SEED):
+        self.flip_prob = flip_prob
+        self.scale_range = scale_range
+        self.seed = seed
+        self.generator = torch.Generator()
+
+    def sample(self, batch_size, height, width, step):
+        """ Per image flip flags, scales and (y, x) crop offsets in pixels """
+        self.generator.manual_seed((self.seed << 32) + step)
+        flips = torch.rand(batch_size, generator=self.generator) < self.flip_prob
+        low, high = self.scale_range
+        scales = low + (high - low) * torch.rand(batch_size, generator=self.generator)
+        # crops are taken from the part of the scaled image exceeding the canvas
+        offsets = torch.rand(batch_size, 2, generator=self.generator) * \
+            ((scales.unsqueeze(1) - 1) * torch.tensor([height, width])).clamp(min=0)
+        return flips, scales, offsets
+
+    def __call__(self, images, boxes, classes, step=0):
+        """ images: uint8 [batch_size, 3, height, width],
+        boxes: [batch_size, N, 4] in pixels, classes: [batch_size, N], -1 is padding.
+        Returns float32 images in [0, 255], ready for `normalize` """
+        batch_size, _, height, width = images.shape
+        flips, scales, offsets = self.sample(batch_size, height, width, step)
+        device = images.device
+
+        # output pixel (y, x) samples input ((y + oy) / s, (x + ox) / s),
+        # mirrored along x for flipped images. The transform is separable,
+        # so the sampling grid is built from per-image rows and columns
+        # (normalized coordinates) instead of a full affine_grid
+        sign = (1. - 2. * flips.float()).unsqueeze(1)
+        scales, offsets = scales.unsqueeze(1), offsets.unsqueeze(2)
+        grid_x = sign * ((self._coords(width) + 1 + 2 * offsets[:, 1] / width) / scales - 1)
+        grid_y = (self._coords(height) + 1 + 2 * offsets[:, 0] / height) / scales - 1
+
+        grid = torch.empty(batch_size, height, width, 2, device=device)
+        grid[..., 0] = grid_x.to(device).unsqueeze(1)
+        grid[..., 1] = grid_y.to(device).unsqueeze(2)
+        images = F.grid_sample(images.float(), grid, mode='bilinear',
+                               padding_mode='zeros', align_corners=False)
+
+        boxes, classes = self.transform_boxes(
+            boxes, classes, flips.to(device), scales.view(-1).to(device),
+            offsets.view(-1, 2).to(device), height, width)
+        return images, boxes, classes
+
+    @staticmethod
+    def _coords(size):
+        """ Normalized pixel centers, as in align_corners=False """
+        return (2 * torch.arange(size, dtype=torch.float32) + 1) / size - 1
+
+    @staticmethod
+    def transform_boxes(boxes, classes, flips, scales, offsets, height, width):
+        boxes = boxes.clone()
+        flips = flips.view(-1, 1)
+        xmin = torch.where(flips, width - boxes[..., 3], boxes[..., 1])
+        xmax = torch.where(flips, width - boxes[..., 1], boxes[..., 3])
+        boxes[..., 1], boxes[..., 3] = xmin, xmax
+
+        boxes = boxes * scales.view(-1, 1, 1) - offsets.repeat(1, 2).unsqueeze(1)
+        limits = torch.tensor([height, width, height, width],
+                              dtype=boxes.dtype, device=boxes.device)
+        boxes = torch.min(boxes.clamp(min=0), limits)
+
+        valid = (classes >= 0) & (boxes[..., 2] > boxes[..., 0]) & \
+            (boxes[..., 3] > boxes[..., 1])
+        boxes = boxes * valid.unsqueeze(-1)
+        classes = torch.where(valid, classes, torch.full_like(classes, -1))
+        return boxes, classes
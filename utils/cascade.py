@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import torch.nn as nn
+
+import config as cfg
+
+
+def image_difficulty(detections, low_score=cfg.CASCADE_LOW_SCORE,
+                     high_score=cfg.CASCADE_HIGH_SCORE):
+    """ Number of uncertain detections, scored in [low_score, high_score) """
+    scores = detections[:, 5]
+    return int(np.sum((scores >= low_score) & (scores < high_score)))
+
+
+class CascadeDetectionWrapper(nn.Module):
+    """ Confidence-gated cascade of two DetectionWrappers.
+    The small variant runs on the whole batch, only the images it is unsure
+    about are forwarded to the large one, whose detections replace the small
+    variant's for those images. Keeps per-call statistics for cost reports """
+
+    def __init__(self, small, large, low_score=cfg.CASCADE_LOW_SCORE,
+                 high_score=cfg.CASCADE_HIGH_SCORE,
+                 max_uncertain=cfg.CASCADE_MAX_UNCERTAIN):
+        super(CascadeDetectionWrapper, self).__init__()
+        self.small = small
+        self.large = large
+        self.low_score = low_score
+        self.high_score = high_score
+        self.max_uncertain = max_uncertain
+        # batches are formed for the first stage
+        self.image_size = small.image_size
+        self.reset_stats()
+
+    def forward(self, images, image_ids=None):
+        """ images: a list of image paths, encoded image bytes or PIL images.
+        Preprocessing leaves PIL images untouched, so escalated images reach the
+        large variant at full resolution and are scaled against their original size """
+        if image_ids is None:
+            image_ids = [0 for _ in range(len(images))]
+
+        start = time.perf_counter()
+        batch_detections = self.small(images, image_ids)
+        self.small_time += time.perf_counter() - start
+
+        hard = [i for i, detections in enumerate(batch_detections)
+                if image_difficulty(detections, self.low_score,
+                                    self.high_score) > self.max_uncertain]
+        if hard:
+            start = time.perf_counter()
+            escalated = self.large([images[i] for i in hard],
+                                   [image_ids[i] for i in hard])
+            self.large_time += time.perf_counter() - start
+            for i, detections in zip(hard, escalated):
+                batch_detections[i] = detections
+
+        self.n_images += len(images)
+        self.n_escalated += len(hard)
+        return batch_detections
+
+    def reset_stats(self):
+        self.n_images, self.n_escalated = 0, 0
+        self.small_time, self.large_time = 0., 0.
+
+    def stats(self):
+        """ Escalation rate and average wall time per image in seconds """
+        n_images = max(self.n_images, 1)
+        return {
+            'images': self.n_images,
+            'escalated': self.n_escalated,
+            'escalation_rate': self.n_escalated / n_images,
+            'seconds_per_image': (self.small_time + self.large_time) / n_images,
+            'small_seconds_per_image': self.small_time / n_images,
+            'large_seconds_per_image': self.large_time / n_images,
+        }
@@ -0,0 +1,153 @@
+import os
+import random
+import signal
+import threading
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import config as cfg
+from log.logger import logger
+
+
+def snapshot(obj):
+    """ Copies all tensors of a (nested) state to CPU, so that training can
+    continue updating the originals while the copy is being serialized """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def rng_state():
+    state = {'python': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class Checkpointer:
+    """ Full training state checkpoints: model, optimizer, scheduler, EMA
+    shadows, RNG states, writer steps and the position in the data order.
+    Tensors are snapshotted on the training thread, serialization runs in a
+    background thread and files are replaced atomically. Checkpoints are
+    written every `interval` optimizer steps, after every epoch and, if
+    signal handlers are installed, on SIGTERM before the process exits """
+
+    PREFIX = 'checkpoint-'
+
+    def __init__(self, model, optimizer, scheduler, ema, writer,
+                 directory=cfg.CHECKPOINT_PATH, interval=cfg.CHECKPOINT_INTERVAL,
+                 keep=cfg.CHECKPOINT_KEEP):
+        self.model = model
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.ema = ema
+        self.writer = writer
+        self.directory = Path(directory)
+        self.interval = interval
+        self.keep = keep
+        self.best_score = -1
+        self.preempted = False
+        self._saved_step = None
+        self._thread = None
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM,)):
+        for sig in signals:
+            signal.signal(sig, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        # only flag here, the state is saved between two optimizer steps
+        logger('Received signal {}, checkpointing after the current step'.format(signum))
+        self.preempted = True
+
+    def state_dict(self, epoch, batch):
+        """ batch: number of batches of the epoch already consumed """
+        return snapshot({
+            'epoch': epoch,
+            'batch': batch,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.scheduler.state_dict(),
+            'ema': self.ema.shadow,
+            'rng': rng_state(),
+            'train_step': self.writer.train_step,
+            'eval_step': self.writer.eval_step,
+            'best_score': self.best_score,
+        })
+
+    def step(self, epoch, batch):
+        """ Called after every optimizer step """
+        if self.preempted:
+            self.save(epoch, batch, blocking=True)
+            raise SystemExit('Preempted, training state saved')
+        if self.interval and self.writer.train_step % self.interval == 0 \
+                and self.writer.train_step != self._saved_step:
+            self.save(epoch, batch)
+
+    def save(self, epoch, batch, blocking=False):
+        state = self.state_dict(epoch, batch)
+        self._saved_step = state['train_step']
+        path = self.directory / '{}{:09d}.pth'.format(self.PREFIX, state['train_step'])
+        # one write at a time, a new snapshot waits for the previous one
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(state, path))
+        self._thread.start()
+        if blocking:
+            self.wait()
+        return path
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, state, path):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+        for old in self.checkpoints()[:-self.keep]:
+            old.unlink()
+        logger('Saved training state to {}'.format(path), do_print=False)
+
+    def checkpoints(self):
+        return sorted(self.directory.glob('{}*.pth'.format(self.PREFIX)))
+
+    def resume(self, path=None):
+        """ Restores the state from path (default: the latest checkpoint),
+        returns the (epoch, batch) position to continue from """
+        if path is None:
+            checkpoints = self.checkpoints()
+            if not checkpoints:
+                raise FileNotFoundError('No checkpoints in {}'.format(self.directory))
+            path = checkpoints[-1]
+        state = torch.load(path, map_location='cpu')
+
+        self.model.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.scheduler.load_state_dict(state['scheduler'])
+        device = next(self.model.parameters()).device
+        self.ema.shadow = {k: v.to(device) for k, v in state['ema'].items()}
+        set_rng_state(state['rng'])
+        self.writer.train_step = state['train_step']
+        self.writer.eval_step = state['eval_step']
+        self.best_score = state['best_score']
+
+        logger('Resumed from {} (epoch {}, batch {})'.format(
+            path, state['epoch'], state['batch']))
+        return state['epoch'], state['batch']
@@ -0,0 +1,134 @@
+import queue
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+
+import config as cfg
+
+
+def _worker(model_name, device, num_threads, save_path, evaluate_fn, requests, results):
+    """ Evaluation process: builds the model once, then scores every weights
+    snapshot it receives and keeps the best one on disk. A failing evaluation
+    is reported as a result with an error instead of stopping the process """
+    from model import EfficientDet
+    from utils import DetectionWrapper
+
+    torch.set_num_threads(num_threads)
+    model = EfficientDet(model_name).to(device).eval()
+    wrapper = DetectionWrapper(model, device)
+    best_score = -1
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        step, state_dict, best_score = request[0], request[1], max(best_score, request[2])
+        try:
+            model.load_state_dict(state_dict)
+            stats, images_per_sec = evaluate_fn(wrapper)
+
+            saved = save_path is not None and stats[0] > best_score
+            if saved:
+                torch.save(model.state_dict(), save_path)
+                best_score = stats[0]
+            results.put((step, [float(s) for s in stats], images_per_sec, saved, None))
+        except Exception:
+            results.put((step, None, 0., False, traceback.format_exc()))
+
+
+class AsyncEvaluator:
+    """ Evaluates EMA snapshots in a separate process on spare cores,
+    so the training loop never blocks on validation. Weights are copied into
+    shared memory on submit, results are collected with `poll` and reported
+    to TensorBoard, improved weights are saved by the worker.
+    At most max_queued snapshots wait for the worker, submitting more drops
+    the oldest waiting one so that shared memory does not pile up """
+
+    def __init__(self, model_name, save_path=None, device=cfg.EVAL_WORKER_DEVICE,
+                 num_threads=cfg.EVAL_WORKER_THREADS, evaluate_fn=None,
+                 max_queued=cfg.EVAL_WORKER_MAX_QUEUED):
+        """ save_path: file name or path of the best weights, see validation.weights_path """
+        from validation import weights_path
+        if evaluate_fn is None:
+            from validation import evaluate as evaluate_fn
+        if save_path is not None:
+            save_path = weights_path(save_path)
+
+        context = mp.get_context('spawn')
+        self.requests = context.Queue(maxsize=max_queued)
+        self.results = context.Queue()
+        self.process = context.Process(
+            target=_worker, daemon=True,
+            args=(model_name, device, num_threads, save_path, evaluate_fn,
+                  self.requests, self.results))
+        self.process.start()
+        self.pending = 0
+
+    def submit(self, state_dict, step, best_score=-1):
+        """ step: the TensorBoard step the results are reported at """
+        from log.logger import logger
+
+        shared = {k: v.detach().to('cpu', copy=True).share_memory_()
+                  for k, v in state_dict.items()}
+        while True:
+            try:
+                self.requests.put_nowait((step, shared, best_score))
+                break
+            except queue.Full:
+                pass
+            try:
+                dropped = self.requests.get(timeout=cfg.EVAL_WORKER_POLL_TIMEOUT)
+            except queue.Empty:
+                # the worker took it in the meantime
+                continue
+            self.pending -= 1
+            logger('Evaluation is behind, dropped the snapshot of step {}'.format(dropped[0]))
+        self.pending += 1
+
+    def poll(self, block=False):
+        """ Returns finished (step, stats, images_per_sec, saved, error) results,
+        stats is None and error the traceback for a failed evaluation.
+        If the worker died, the evaluations it did not finish are given up """
+        from log.logger import logger
+
+        finished = []
+        while self.pending:
+            try:
+                finished.append(self.results.get(
+                    block=block, timeout=cfg.EVAL_WORKER_POLL_TIMEOUT if block else None))
+            except queue.Empty:
+                if self.process.is_alive():
+                    if block:
+                        continue
+                    break
+                logger('Evaluation worker exited with code {}, {} evaluation(s) lost'.format(
+                    self.process.exitcode, self.pending))
+                self.pending = 0
+                break
+            self.pending -= 1
+        return finished
+
+    def report(self, writer, best_score=-1, block=False):
+        """ Writes finished results to TensorBoard, returns the best score """
+        from log.logger import logger
+
+        for step, stats, images_per_sec, saved, error in self.poll(block):
+            if error is not None:
+                logger('Evaluation of step {} failed:\n{}'.format(step, error))
+                continue
+            writer.add_scalar("Eval/mAP", stats[0], step)
+            writer.add_scalar("Eval/images_per_sec", images_per_sec, step)
+            logger('Evaluation of step {}: mAP {:.4f}{}'.format(
+                step, stats[0], ', saved best weights' if saved else ''))
+            best_score = max(best_score, stats[0])
+        return best_score
+
+    def close(self, writer=None, best_score=-1):
+        """ Waits for pending evaluations and stops the worker """
+        if writer is not None:
+            best_score = self.report(writer, best_score, block=True)
+        if self.process.is_alive():
+            self.requests.put(None)
+        self.process.join()
+        return best_score
@@ -0,0 +1,112 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import config as cfg
+from utils.processing import normalize
+
+
+class BackboneFeatureStore:
+    """ Backbone features (P3 to P5) of a dataset, computed once by a frozen
+    backbone, for fine-tuning the rest of the detector without decoding images.
+    Every level is one memory-mapped float16 .npy file holding the flattened
+    feature maps of all images, located by per-image offsets. Images keep
+    their (aspect ratio bucket) canvas, so feature shapes vary between images """
+
+    META = 'meta.json'
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / self.META) as f:
+            self.meta = json.load(f)
+        self.img_ids = np.load(self.directory / 'img_ids.npy')
+        self.canvas_sizes = np.load(self.directory / 'canvas_sizes.npy')
+        self.scales = np.load(self.directory / 'scales.npy')
+        self.offsets = np.load(self.directory / 'offsets.npy')
+        self.levels = [np.load(self.directory / 'level{}.npy'.format(level), mmap_mode='r')
+                       for level in range(len(self.channels))]
+        self._rows = {int(img_id): row for row, img_id in enumerate(self.img_ids)}
+
+    @property
+    def image_size(self):
+        return self.meta['image_size']
+
+    @property
+    def bucket_stride(self):
+        return self.meta['bucket_stride']
+
+    @property
+    def channels(self):
+        return self.meta['channels']
+
+    @property
+    def nbytes(self):
+        """ Disk footprint of the store """
+        return sum(path.stat().st_size for path in self.directory.iterdir())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, img_id):
+        return img_id in self._rows
+
+    def __getitem__(self, img_id):
+        """ Returns the [C, H, W] float16 feature maps of an image and the
+        scale from the original image to its canvas """
+        row = self._rows[img_id]
+        height, width = self.canvas_sizes[row]
+        features = []
+        for level, (n_channels, data) in enumerate(zip(self.channels, self.levels)):
+            stride = 2 ** (cfg.MIN_LEVEL + level)
+            start, end = self.offsets[level, row:row + 2]
+            features.append(np.array(data[start:end]).reshape(
+                n_channels, height // stride, width // stride))
+        return features, float(self.scales[row])
+
+    @classmethod
+    def write(cls, directory, backbone, batches, img_ids, canvas_sizes, scales, meta,
+              device='cpu'):
+        """ Runs the backbone once over the dataset.
+        batches: iterable of (uint8 NCHW batch, image ids) covering img_ids,
+        canvas_sizes: [N, 2] (height, width) canvas of every image,
+        scales: [N] scale of every image to its canvas """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        canvas_sizes = np.asarray(canvas_sizes, dtype=np.int64)
+        channels = backbone.get_channels_list()
+        rows = {img_id: row for row, img_id in enumerate(img_ids)}
+
+        offsets = np.zeros((len(channels), len(img_ids) + 1), dtype=np.int64)
+        for level, n_channels in enumerate(channels):
+            stride = 2 ** (cfg.MIN_LEVEL + level)
+            sizes = n_channels * (canvas_sizes[:, 0] // stride) * (canvas_sizes[:, 1] // stride)
+            offsets[level, 1:] = np.cumsum(sizes)
+        levels = [np.lib.format.open_memmap(
+            directory / 'level{}.npy'.format(level), mode='w+',
+            dtype=np.float16, shape=(offsets[level, -1],))
+            for level in range(len(channels))]
+
+        training = backbone.training
+        backbone.eval()
+        with torch.no_grad():
+            for x, batch_ids in batches:
+                features = backbone(normalize(x.to(device)))
+                for level, feature in enumerate(features):
+                    feature = feature.half().cpu().numpy()
+                    for idx, img_id in enumerate(batch_ids):
+                        row = rows[img_id]
+                        start, end = offsets[level, row:row + 2]
+                        levels[level][start:end] = feature[idx].reshape(-1)
+        backbone.train(training)
+
+        for level in levels:
+            level.flush()
+        np.save(directory / 'img_ids.npy', np.asarray(img_ids, dtype=np.int64))
+        np.save(directory / 'canvas_sizes.npy', canvas_sizes)
+        np.save(directory / 'scales.npy', np.asarray(scales, dtype=np.float64))
+        np.save(directory / 'offsets.npy', offsets)
+        with open(directory / cls.META, 'w') as f:
+            json.dump(dict(meta, channels=channels), f, indent=4)
+        return cls(directory)
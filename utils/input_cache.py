@@ -0,0 +1,107 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+import config as cfg
+from utils.processing import collate_images, open_image, resize_image
+from utils.transforms import Resizer
+
+
+def file_digest(path, chunk_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class InputCache:
+    """ Resized uint8 images of a fixed image set (e.g. val2017) and their
+    scales, in one memory-mapped file built on first use. Each image keeps its
+    own (aspect ratio bucket) canvas. The cache directory is keyed by the input
+    size, the bucket stride, the decoding mode, the annotation file contents and the image ids,
+    so a change of any of them builds a new cache and removes the stale ones """
+
+    META = 'meta.json'
+
+    def __init__(self, root, image_dir, annotations, image_infos, image_size,
+                 bucket_stride=None):
+        """ image_infos: a dict of image id to COCO image info (file_name, width, height) """
+        self.root = Path(root)
+        self.image_dir = Path(image_dir)
+        self.image_infos = image_infos
+        self.image_size = image_size
+        self.bucket_stride = bucket_stride
+        self.img_ids = sorted(image_infos)
+
+        key = hashlib.sha1(json.dumps({
+            'image_size': image_size, 'bucket_stride': bucket_stride,
+            'draft': cfg.DRAFT_DECODING, 'annotations': file_digest(annotations),
+            'img_ids': self.img_ids,
+        }).encode()).hexdigest()[:16]
+        self.prefix = '{}_{}_'.format(image_size, bucket_stride)
+        self.directory = self.root / (self.prefix + key)
+
+        if not (self.directory / self.META).exists():
+            self._build()
+        self.images = np.load(self.directory / 'images.npy', mmap_mode='r')
+        self.offsets = np.load(self.directory / 'offsets.npy')
+        self.shapes = np.load(self.directory / 'shapes.npy')
+        self.scales = np.load(self.directory / 'scales.npy')
+        self._rows = {img_id: row for row, img_id in enumerate(self.img_ids)}
+
+    def _build(self):
+        from tqdm import tqdm
+
+        for stale in self.root.glob(self.prefix + '*'):
+            shutil.rmtree(stale)
+        self.directory.mkdir(parents=True)
+
+        resizer = Resizer(self.image_size, bucket_stride=self.bucket_stride)
+        shapes = np.array([resizer.get_shape(self.image_infos[img_id]['width'],
+                                             self.image_infos[img_id]['height'])[:2]
+                           for img_id in self.img_ids], dtype=np.int64).reshape(-1, 2)
+        offsets = np.zeros(len(self.img_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(shapes[:, 0] * shapes[:, 1] * 3)
+        images = np.lib.format.open_memmap(self.directory / 'images.npy', mode='w+',
+                                           dtype=np.uint8, shape=(offsets[-1],))
+        scales = np.zeros(len(self.img_ids), dtype=np.float64)
+
+        for row, img_id in enumerate(tqdm(self.img_ids, desc='Caching inputs')):
+            pil_img = open_image(self.image_dir / self.image_infos[img_id]['file_name'])
+            np_img, scales[row] = resize_image(pil_img, self.image_size, self.bucket_stride)
+            images[offsets[row]:offsets[row + 1]] = np_img.reshape(-1)
+        images.flush()
+
+        np.save(self.directory / 'offsets.npy', offsets)
+        np.save(self.directory / 'shapes.npy', shapes)
+        np.save(self.directory / 'scales.npy', scales)
+        # written last, marks the cache as complete
+        with open(self.directory / self.META, 'w') as f:
+            json.dump({'image_size': self.image_size, 'bucket_stride': self.bucket_stride,
+                       'n_images': len(self.img_ids)}, f, indent=4)
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    def __contains__(self, img_id):
+        return img_id in self._rows
+
+    def image(self, img_id):
+        """ Resized uint8 HWC image and its scale back to the original image """
+        row = self._rows[img_id]
+        height, width = self.shapes[row]
+        np_img = self.images[self.offsets[row]:self.offsets[row + 1]].reshape(height, width, 3)
+        return np_img, float(self.scales[row])
+
+    def batch(self, img_ids):
+        """ uint8 NCHW batch, zero-padded to the biggest canvas, and the scales """
+        np_imgs, scales = zip(*[self.image(img_id) for img_id in img_ids])
+        return collate_images(list(np_imgs)), list(scales)
+
+    @property
+    def nbytes(self):
+        return sum(path.stat().st_size for path in self.directory.iterdir())
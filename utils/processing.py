@@ -1,12 +1,17 @@
+import io
+from collections import OrderedDict
+from functools import lru_cache
+
 import torch
 import config as cfg
 
 from PIL import Image
-from utils.transforms import Normalizer, NumpyToTensor, Resizer, ImageToNumpy
+from utils.transforms import (IMAGENET_MEAN, IMAGENET_STD, ImageToNumpy,
+                              Resizer, get_bucket, open_draftable)
 import numpy as np
 
 
-def postprocess(cls_outputs, box_outputs):
+def postprocess(cls_outputs, box_outputs, num_classes=None):
     """Selects top-k predictions.
     Post-proc code adapted from Tensorflow version at: https://github.com/google/automl/tree/master/efficientdet
     and optimized for PyTorch.
@@ -15,54 +20,177 @@ def postprocess(cls_outputs, box_outputs):
             representing logits in [batch_size, height, width, num_anchors].
         box_outputs: an OrderDict with keys representing levels and values
             representing box regression targets in [batch_size, height, width, num_anchors * 4].
+        num_classes: number of classes predicted by the classifier head,
+            smaller than NUM_CLASSES for class-subset models.
     """
+    num_classes = num_classes or cfg.NUM_CLASSES
     batch_size = cls_outputs[0].shape[0]
     cls_outputs_all = torch.cat([
-        cls_outputs[level].permute(0, 2, 3, 1).reshape([batch_size, -1, cfg.NUM_CLASSES])
+        cls_outputs[level].permute(0, 2, 3, 1).reshape([batch_size, -1, num_classes])
         for level in range(cfg.NUM_LEVELS)], 1)
 
     box_outputs_all = torch.cat([
         box_outputs[level].permute(0, 2, 3, 1).reshape([batch_size, -1, 4])
         for level in range(cfg.NUM_LEVELS)], 1)
 
-    _, cls_topk_indices_all = torch.topk(cls_outputs_all.reshape(batch_size, -1), dim=1, k=cfg.MAX_DETECTION_POINTS)
-    indices_all = cls_topk_indices_all / cfg.NUM_CLASSES
-    classes_all = cls_topk_indices_all % cfg.NUM_CLASSES
+    k = min(cfg.MAX_DETECTION_POINTS, cls_outputs_all.shape[1] * num_classes)
+    cls_topk_all, cls_topk_indices_all = torch.topk(
+        cls_outputs_all.reshape(batch_size, -1), dim=1, k=k)
+    indices_all = cls_topk_indices_all // num_classes
+    classes_all = cls_topk_indices_all % num_classes
 
     box_outputs_all_after_topk = torch.gather(
         box_outputs_all, 1, indices_all.unsqueeze(2).expand(-1, -1, 4))
 
-    cls_outputs_all_after_topk = torch.gather(
-        cls_outputs_all, 1, indices_all.unsqueeze(2).expand(-1, -1, cfg.NUM_CLASSES))
-    cls_outputs_all_after_topk = torch.gather(
-        cls_outputs_all_after_topk, 2, classes_all.unsqueeze(2))
+    # top-k values are the selected logits already
+    cls_outputs_all_after_topk = cls_topk_all.unsqueeze(2)
 
     return cls_outputs_all_after_topk, box_outputs_all_after_topk, indices_all, classes_all
 
 
-def preprocess(img_paths: list, img_ids: list = None):
-    """ Preprocess: image paths to input batch """
-    images, scales = [], []
-    resizer = Resizer(cfg.MODEL.IMAGE_SIZE)
-    to_numpy = ImageToNumpy()
-    normalizer = Normalizer()
-    to_tensor = NumpyToTensor()
-
+def open_image(src):
+    """ Opens an image from a path or encoded image bytes without decoding it,
+    so that Resizer can decode JPEGs at a reduced scale. PIL images belong to
+    the caller, they are returned as is and Resizer leaves them untouched """
+    if isinstance(src, Image.Image):
+        return src
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    return open_draftable(src)
+
+
+def load_image(src):
+    """ Opens an RGB image from a path, encoded image bytes or a PIL image,
+    decoded at full resolution """
+    return open_image(src).convert('RGB')
+
+
+@lru_cache(maxsize=64)
+def get_resizer(target_size, bucket_stride=None, draft=True):
+    """ Resizers are immutable, one is shared per (target size, stride, draft) """
+    return Resizer(target_size, bucket_stride=bucket_stride, draft=draft)
+
+
+def resize_image(pil_img, target_size, bucket_stride=None):
+    """ Scales image (decoded or fresh from open_image) into the target (or its
+    bucket) canvas, returns uint8 HWC array and the scale back to the original image """
+    pil_img, annos = get_resizer(target_size, bucket_stride, cfg.DRAFT_DECODING)(pil_img, {})
+    np_img, _ = ImageToNumpy()(pil_img)
+    return np_img, annos['scale']
+
+
+class BatchArena:
+    """ Reused batch buffers, one per (shape, dtype), allocated on first use
+    and pinned if pin_memory, so that consecutive batches of the same shape
+    cost no allocations. A buffer is overwritten by the next batch of its
+    shape, its contents have to be consumed (or copied) before that.
+    At most size buffers are kept, the least recently used one is dropped.
+    pin_memory defaults to whether CUDA is available """
+
+    def __init__(self, size=None, pin_memory=None):
+        self.size = size or cfg.BATCH_ARENA_SIZE
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.buffers = OrderedDict()
+
+    def get(self, shape, dtype=torch.uint8):
+        key = (tuple(shape), dtype)
+        buffer = self.buffers.pop(key, None)
+        if buffer is None:
+            buffer = torch.empty(key[0], dtype=dtype, pin_memory=self.pin_memory)
+        self.buffers[key] = buffer
+        if len(self.buffers) > self.size:
+            self.buffers.popitem(last=False)
+        return buffer
+
+    def normalize(self, batch):
+        """ normalize() of a uint8 NCHW batch into a float buffer """
+        return normalize(batch, out=self.get(batch.shape, torch.float32))
+
+    @property
+    def nbytes(self):
+        return sum(b.numel() * b.element_size() for b in self.buffers.values())
+
+
+def collate_images(np_imgs: list, image_size=None, arena: BatchArena = None):
+    """ Stacks uint8 HWC images to a uint8 NCHW tensor, zero-padding every image
+    to the (height, width) image_size or to the biggest sides in the batch.
+    With an arena the batch is its buffer and only the padding is zeroed """
+    if image_size is not None:
+        height, width = (image_size, image_size) \
+            if isinstance(image_size, int) else image_size
+    else:
+        height = max(img.shape[0] for img in np_imgs)
+        width = max(img.shape[1] for img in np_imgs)
+    if arena is None:
+        batch = np.zeros((len(np_imgs), height, width, 3), dtype=np.uint8)
+        for idx, img in enumerate(np_imgs):
+            batch[idx, :img.shape[0], :img.shape[1]] = img
+        return torch.from_numpy(batch).permute(0, 3, 1, 2)
+
+    batch = arena.get((len(np_imgs), height, width, 3))
+    np_batch = batch.numpy()
+    for idx, img in enumerate(np_imgs):
+        np_batch[idx, :img.shape[0], :img.shape[1]] = img
+        np_batch[idx, img.shape[0]:] = 0
+        np_batch[idx, :img.shape[0], img.shape[1]:] = 0
+    return batch.permute(0, 3, 1, 2)
+
+
+def normalize(batch, mean=IMAGENET_MEAN, std=IMAGENET_STD, out=None):
+    """ Z-Score on a uint8 NCHW batch, can be applied on the target device.
+    out: optional float tensor of the batch shape the result is written to """
+    mean = torch.tensor(mean, device=batch.device).view(1, -1, 1, 1)
+    std = torch.tensor(std, device=batch.device).view(1, -1, 1, 1)
+    if out is None:
+        return (batch.float() / 255 - mean) / std
+    return out.copy_(batch).div_(255).sub_(mean).div_(std)
+
+
+def resize_images(images: list, image_size: int, arena: BatchArena = None):
+    """ Image paths (or encoded bytes, or PIL images) to a uint8 NCHW batch
+    and the scales back to the original images.
+    With aspect ratio bucketing the batch is padded to the tightest
+    canvas fitting all of its images instead of the square one.
+    With an arena images are resized straight into its buffer """
+    # only headers are read here, images are decoded by the resizer
+    pil_imgs = [open_image(img) for img in images]
+
+    if cfg.ASPECT_BUCKETING:
+        buckets = [get_bucket(img.size[0], img.size[1],
+                              image_size, cfg.BUCKET_STRIDE)
+                   for img in pil_imgs]
+        target_size = (max(h for h, _ in buckets), max(w for _, w in buckets))
+    else:
+        target_size = image_size
+
+    if arena is None:
+        np_imgs, scales = [], []
+        for pil_img in pil_imgs:
+            np_img, scale = resize_image(pil_img, target_size)
+            np_imgs.append(np_img)
+            scales.append(scale)
+        return collate_images(np_imgs), scales
+
+    height, width = (target_size, target_size) \
+        if isinstance(target_size, int) else target_size
+    batch = arena.get((len(pil_imgs), height, width, 3))
+    np_batch = batch.numpy()
+    resizer = get_resizer(target_size, None, cfg.DRAFT_DECODING)
+    scales = [resizer.resize_into(pil_img, np_batch[idx])
+              for idx, pil_img in enumerate(pil_imgs)]
+    return batch.permute(0, 3, 1, 2), scales
+
+
+def preprocess(images: list, img_ids: list = None, image_size: int = None,
+               arena: BatchArena = None):
+    """ Preprocess: image paths (or encoded bytes, or PIL images) to input batch
+    image_size defaults to the one of the model being trained (cfg.MODEL).
+    With an arena the returned batch is one of its buffers """
+    image_size = image_size or cfg.MODEL.IMAGE_SIZE
     if img_ids is None:
-        img_ids = [0 for _ in range(len(img_paths))]
-
-    for img_path, img_id in zip(img_paths, img_ids):
-        pil_img = Image.open(img_path).convert('RGB')
-        pil_img, annos = resizer(pil_img, {})
-        scale = annos['scale']
-
-        np_img, _ = to_numpy(pil_img)
-        normalized_np_img, _ = normalizer(np_img)
-        torch_tensor, _ = to_tensor(normalized_np_img)
-
-        images.append(torch_tensor)
-        scales.append(scale)
+        img_ids = [0 for _ in range(len(images))]
 
-    batch_x = torch.stack(images)
+    x, scales = resize_images(images, image_size, arena)
+    batch_x = normalize(x) if arena is None else arena.normalize(x)
 
     return batch_x, img_ids, scales
@@ -0,0 +1,133 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss():
+    """ Peak resident set size of the current process in bytes """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency_summary(timings, percentiles=PERCENTILES):
+    """ Aggregates a list of latencies (in seconds) to a dict in milliseconds """
+    timings_ms = np.asarray(timings, dtype=np.float64) * 1000.
+    summary = {'count': int(timings_ms.size)}
+    if timings_ms.size == 0:
+        return summary
+    summary['mean'] = float(timings_ms.mean())
+    for p in percentiles:
+        summary['p{}'.format(p)] = float(np.percentile(timings_ms, p))
+    summary['max'] = float(timings_ms.max())
+    return summary
+
+
+class StageProfiler:
+    """ Opt-in per-stage wall-clock latency and peak memory recorder.
+    Model stages are timed via forward hooks on EfficientDet submodules,
+    wrapper stages (pre- and post-processing) via the `stage` context manager.
+    On CUDA devices timings are synchronized and peak memory is the allocator
+    peak inside the stage, on CPU it is the process peak RSS """
+
+    MODEL_STAGES = ('backbone', 'adjuster', 'bifpn', 'classifier', 'regresser', 'heads')
+
+    def __init__(self, device=None, synchronize=True):
+        self.device = torch.device(device) if device is not None \
+            else torch.device('cpu')
+        self.synchronize = synchronize and self.device.type == 'cuda'
+        self.timings = defaultdict(list)
+        self.memory = defaultdict(list)
+        self._starts = {}
+        self._handles = []
+
+    def attach(self, model):
+        """ Registers timing hooks on the model stages """
+        self.detach()
+        for name in self.MODEL_STAGES:
+            module = getattr(model, name, None)
+            if module is None:
+                continue
+            self._handles.append(module.register_forward_pre_hook(
+                lambda m, inputs, name=name: self._start(name)))
+            self._handles.append(module.register_forward_hook(
+                lambda m, inputs, outputs, name=name: self._stop(name)))
+        return self
+
+    def detach(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    @contextmanager
+    def stage(self, name):
+        self._start(name)
+        try:
+            yield
+        finally:
+            self._stop(name)
+
+    def reset(self):
+        self.timings = defaultdict(list)
+        self.memory = defaultdict(list)
+        self._starts = {}
+
+    def summary(self):
+        """ Returns p50/p95/p99 latencies and peak memory per stage """
+        report = {}
+        for name, timings in self.timings.items():
+            report[name] = latency_summary(timings)
+            report[name]['peak_memory_mb'] = \
+                max(self.memory[name]) / 2 ** 20 if self.memory[name] else 0.
+        return report
+
+    def write(self, writer, step=0):
+        """ Exports latency histograms and percentiles to TensorBoard """
+        for name, timings in self.timings.items():
+            writer.add_histogram('Profile/{}'.format(name),
+                                 np.asarray(timings) * 1000., step)
+        for name, stats in self.summary().items():
+            for p in PERCENTILES:
+                key = 'p{}'.format(p)
+                if key in stats:
+                    writer.add_scalar('Profile/{}/{}'.format(name, key),
+                                      stats[key], step)
+            writer.add_scalar('Profile/{}/peak_memory_mb'.format(name),
+                              stats['peak_memory_mb'], step)
+        return writer
+
+    def dump(self, path):
+        """ Writes the JSON report """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def _sync(self):
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+
+    def _start(self, name):
+        self._sync()
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self._starts[name] = time.perf_counter()
+
+    def _stop(self, name):
+        self._sync()
+        start = self._starts.pop(name, None)
+        if start is None:
+            return
+        self.timings[name].append(time.perf_counter() - start)
+        if self.device.type == 'cuda':
+            self.memory[name].append(torch.cuda.max_memory_allocated(self.device))
+        else:
+            self.memory[name].append(peak_rss())
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+from model import EfficientDet
+from utils.wrapper import DetectionWrapper
+
+
+class ModelRegistry:
+    """ Hosts several EfficientDet variants in one process.
+    Every entry keeps its own configuration (model.info), anchor cache and
+    wrapper, so loading a variant never reconfigures the others """
+
+    def __init__(self, device, wrapper_cls=DetectionWrapper):
+        self.device = device
+        self.wrapper_cls = wrapper_cls
+        self.wrappers = OrderedDict()
+
+    def load(self, name, weights_path=None, alias=None, **kwargs):
+        """ Loads a pre-trained variant and registers it under alias (default: name) """
+        model = EfficientDet.from_pretrained(name, weights_path)
+        return self.register(alias or name, model.to(self.device).eval(), **kwargs)
+
+    def register(self, alias, model, **kwargs):
+        if alias in self.wrappers:
+            raise KeyError('Model {} is already registered'.format(alias))
+        wrapper = self.wrapper_cls(model, self.device, **kwargs)
+        self.wrappers[alias] = wrapper
+        return wrapper
+
+    def unregister(self, alias):
+        return self.wrappers.pop(alias)
+
+    @property
+    def default(self):
+        """ The first registered model """
+        return next(iter(self.wrappers))
+
+    def items(self):
+        return self.wrappers.items()
+
+    def __getitem__(self, alias):
+        if alias not in self.wrappers:
+            raise KeyError('Model {} is not registered, available: {}'.format(
+                alias, list(self.wrappers)))
+        return self.wrappers[alias]
+
+    def __contains__(self, alias):
+        return alias in self.wrappers
+
+    def __iter__(self):
+        return iter(self.wrappers)
+
+    def __len__(self):
+        return len(self.wrappers)
@@ -0,0 +1,162 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import config as cfg
+from utils.anchors import Anchors, box_iou, encode_boxes
+
+
+class AnchorLabeler:
+    """ Assigns ground truth boxes to anchors, following TF's ArgMaxMatcher.
+    An anchor is positive for the box it overlaps most if the IoU is at least
+    match_threshold, ignored between unmatched_threshold and match_threshold,
+    background below. Every box is also matched to its best anchor.
+    Targets are sparse: positive anchor indices with their class ids and
+    encoded box targets, and the indices of the ignored anchors """
+
+    def __init__(self, image_size, match_threshold=cfg.MATCH_THRESHOLD,
+                 unmatched_threshold=cfg.UNMATCHED_THRESHOLD):
+        self.anchors = Anchors(
+            cfg.MIN_LEVEL, cfg.MAX_LEVEL,
+            cfg.NUM_SCALES, cfg.ASPECT_RATIOS,
+            cfg.ANCHOR_SCALE, image_size,
+            cache_size=cfg.ANCHOR_CACHE_SIZE)
+        self.match_threshold = match_threshold
+        self.unmatched_threshold = unmatched_threshold
+
+    def label_anchors(self, boxes, classes, image_size=None):
+        """ Targets of one image.
+        boxes: [G, 4] (ymin, xmin, ymax, xmax) in input pixels, classes: [G],
+        image_size: integer or (height, width) canvas, defaults to the constructor's """
+        anchor_boxes, anchor_centers = self.anchors.get(image_size, boxes.device)
+        if boxes.shape[0] == 0:
+            empty = torch.zeros(0, dtype=torch.long, device=boxes.device)
+            return dict(indices=empty, classes=empty,
+                        box_targets=boxes.new_zeros(0, 4), ignore=empty)
+
+        iou = box_iou(anchor_boxes, boxes.float())
+        max_iou, matches = iou.max(1)
+        positive = max_iou >= self.match_threshold
+        ignore = (max_iou >= self.unmatched_threshold) & ~positive
+
+        # force a match for every box, even if it overlaps no anchor enough
+        best_anchors = iou.argmax(0)
+        matches[best_anchors] = torch.arange(boxes.shape[0], device=boxes.device)
+        positive[best_anchors] = True
+        ignore[best_anchors] = False
+
+        indices = positive.nonzero(as_tuple=True)[0]
+        matches = matches[indices]
+        return dict(indices=indices, classes=classes[matches],
+                    box_targets=encode_boxes(boxes[matches].float(), anchor_centers[indices]),
+                    ignore=ignore.nonzero(as_tuple=True)[0])
+
+    def label_batch(self, boxes, classes, image_size=None):
+        """ On-the-fly targets of a padded batch.
+        boxes: [batch_size, N, 4], classes: [batch_size, N] with -1 as padding """
+        targets = []
+        for image_boxes, image_classes in zip(boxes, classes):
+            valid = image_classes >= 0
+            targets.append(self.label_anchors(
+                image_boxes[valid], image_classes[valid], image_size))
+        return collate_anchor_targets(targets)
+
+
+def collate_anchor_targets(targets):
+    """ Concatenates sparse per-image targets (tensors or arrays) of a batch,
+    batch_index and ignore_batch_index give the image of every entry """
+    def _cat(key, dtype):
+        return torch.cat([torch.as_tensor(t[key]).to(dtype) for t in targets])
+
+    def _batch_index(key):
+        return torch.cat([torch.full((len(t[key]),), idx, dtype=torch.long,
+                                     device=torch.as_tensor(t[key]).device)
+                          for idx, t in enumerate(targets)])
+
+    return dict(indices=_cat('indices', torch.long),
+                classes=_cat('classes', torch.long),
+                box_targets=_cat('box_targets', torch.float32),
+                ignore=_cat('ignore', torch.long),
+                batch_index=_batch_index('indices'),
+                ignore_batch_index=_batch_index('ignore'))
+
+
+def dense_anchor_targets(targets, batch_size, num_anchors):
+    """ Expands collated sparse targets to cls_targets [batch_size, num_anchors]
+    (-1 background, -2 ignored) and box_targets [batch_size, num_anchors, 4] """
+    device = targets['indices'].device
+    cls_targets = torch.full((batch_size, num_anchors), -1, dtype=torch.long, device=device)
+    cls_targets[targets['ignore_batch_index'], targets['ignore']] = -2
+    cls_targets[targets['batch_index'], targets['indices']] = targets['classes']
+    box_targets = torch.zeros(batch_size, num_anchors, 4, device=device)
+    box_targets[targets['batch_index'], targets['indices']] = targets['box_targets']
+    return cls_targets, box_targets
+
+
+class AnchorTargetStore:
+    """ Offline anchor targets of a dataset at one input size.
+    Sparse targets of all images are concatenated into a few memory-mapped
+    .npy files (box targets in float16), so loader workers share them
+    through the page cache. Written by precompute_targets.py """
+
+    META = 'meta.json'
+    ARRAYS = {'img_ids': np.int64, 'offsets': np.int64, 'indices': np.int32,
+              'classes': np.uint8, 'box_targets': np.float16,
+              'ignore_offsets': np.int64, 'ignore': np.int32}
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / self.META) as f:
+            self.meta = json.load(f)
+        self.arrays = {name: np.load(self.directory / '{}.npy'.format(name), mmap_mode='r')
+                       for name in self.ARRAYS}
+        self._rows = {int(img_id): row for row, img_id in enumerate(self.arrays['img_ids'])}
+
+    @property
+    def image_size(self):
+        return self.meta['image_size']
+
+    @property
+    def bucket_stride(self):
+        return self.meta['bucket_stride']
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, img_id):
+        return img_id in self._rows
+
+    def __getitem__(self, img_id):
+        row = self._rows[img_id]
+        start, end = self.arrays['offsets'][row:row + 2]
+        ignore_start, ignore_end = self.arrays['ignore_offsets'][row:row + 2]
+        return dict(indices=np.array(self.arrays['indices'][start:end]),
+                    classes=np.array(self.arrays['classes'][start:end]),
+                    box_targets=np.array(self.arrays['box_targets'][start:end]),
+                    ignore=np.array(self.arrays['ignore'][ignore_start:ignore_end]))
+
+    @classmethod
+    def write(cls, directory, img_ids, targets, meta):
+        """ targets: per-image dicts of AnchorLabeler.label_anchors """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        def _offsets(key):
+            return np.cumsum([0] + [len(t[key]) for t in targets])
+
+        def _cat(key, shape):
+            parts = [np.asarray(t[key].cpu() if torch.is_tensor(t[key]) else t[key])
+                     for t in targets]
+            return np.concatenate(parts) if parts else np.zeros(shape)
+
+        arrays = {'img_ids': np.asarray(img_ids), 'offsets': _offsets('indices'),
+                  'indices': _cat('indices', (0,)), 'classes': _cat('classes', (0,)),
+                  'box_targets': _cat('box_targets', (0, 4)),
+                  'ignore_offsets': _offsets('ignore'), 'ignore': _cat('ignore', (0,))}
+        for name, dtype in cls.ARRAYS.items():
+            np.save(directory / '{}.npy'.format(name), arrays[name].astype(dtype))
+        with open(directory / cls.META, 'w') as f:
+            json.dump(meta, f, indent=4)
+        return cls(directory)
@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+
+import config as cfg
+from utils.anchors import _DUMMY_DETECTION_SCORE, batched_nms
+from utils.processing import collate_images, load_image, normalize
+from utils.wrapper import DetectionWrapper
+
+
+def tile_windows(width, height, tile_size, overlap):
+    """ Top-left corners of overlapping tiles covering the whole image.
+    The last tile in a row (column) is aligned to the image border """
+    stride = tile_size - overlap
+    assert stride > 0, 'Tile overlap should be smaller than the tile size'
+
+    def _starts(length):
+        starts = list(range(0, max(length - tile_size, 0) + 1, stride))
+        if starts[-1] + tile_size < length:
+            starts.append(length - tile_size)
+        return starts
+
+    return [(x0, y0) for y0 in _starts(height) for x0 in _starts(width)]
+
+
+def merge_detections(detections, image_id, iou_threshold, max_detections):
+    """ Cross-tile class-wise NMS on [image_id, x, y, w, h, score, class] rows,
+    padded with dummy detections up to max_detections """
+    detections = detections[detections[:, 5] > _DUMMY_DETECTION_SCORE]
+
+    dets = np.column_stack([detections[:, 1:3],
+                            detections[:, 1:3] + detections[:, 3:5],
+                            detections[:, 5]])
+    keep = batched_nms(dets, detections[:, 6], iou_threshold)
+    detections = detections[keep[:max_detections]]
+
+    dummy = np.zeros((max_detections - len(detections), 7), dtype=np.float32)
+    dummy[:, 0] = image_id
+    dummy[:, 5] = _DUMMY_DETECTION_SCORE
+    return np.vstack([detections, dummy]).astype(np.float32)
+
+
+class TiledDetectionWrapper(DetectionWrapper):
+    """ Detection on large images at native resolution.
+    Images are cut into overlapping tiles of the model input size, tiles of all
+    images in a call are batched together, their detections are mapped back
+    to global coordinates and merged with NMS across tile seams """
+
+    def __init__(self, model, device, tile_size=None, overlap=cfg.TILE_OVERLAP,
+                 max_tiles_per_batch=cfg.MAX_TILES_PER_BATCH,
+                 iou_threshold=cfg.TILE_NMS_THRESHOLD,
+                 max_detections=cfg.TILE_MAX_DETECTIONS, profiler=None):
+        super(TiledDetectionWrapper, self).__init__(model, device, profiler=profiler)
+        self.tile_size = tile_size or self.image_size
+        assert self.tile_size % cfg.BUCKET_STRIDE == 0, \
+            'Tile size should be a multiple of {}'.format(cfg.BUCKET_STRIDE)
+        self.overlap = overlap
+        self.max_tiles_per_batch = max_tiles_per_batch
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+
+    def forward(self, images, image_ids=None):
+        """ images: a list of image paths, encoded image bytes or PIL images """
+        if image_ids is None:
+            image_ids = [0 for _ in range(len(images))]
+
+        tiles = []
+        for img_idx, image in enumerate(images):
+            with self._stage('preprocess'):
+                np_img = np.asarray(load_image(image))
+            height, width = np_img.shape[:2]
+            for x0, y0 in tile_windows(width, height, self.tile_size, self.overlap):
+                tiles.append((img_idx, x0, y0, np_img[y0:y0 + self.tile_size,
+                                                       x0:x0 + self.tile_size]))
+
+        per_image = [[] for _ in images]
+        for start in range(0, len(tiles), self.max_tiles_per_batch):
+            batch = tiles[start:start + self.max_tiles_per_batch]
+            with self._stage('preprocess'):
+                x = collate_images([tile[-1] for tile in batch], self.tile_size,
+                                   arena=self.arena)
+                x = normalize(x) if self.arena is None else self.arena.normalize(x)
+            outputs = self.detect(x, [image_ids[tile[0]] for tile in batch],
+                                  [1. for _ in batch])
+            for (img_idx, x0, y0, _), detections in zip(batch, outputs):
+                detections[:, 1] += x0
+                detections[:, 2] += y0
+                per_image[img_idx].append(detections)
+
+        with self._stage('merge'):
+            return [merge_detections(np.vstack(detections), image_id,
+                                     self.iou_threshold, self.max_detections)
+                    for detections, image_id in zip(per_image, image_ids)]
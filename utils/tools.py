@@ -79,6 +79,18 @@ class ExponentialMovingAverage:
                 assert name in self.shadow
                 param.data = self.original[name]
 
+    def state_dict(self, model):
+        """Model state dict with the moving averages in place of the parameters,
+        the model itself is left untouched.
+        Args:
+            model (torch.nn.Module): Model providing buffers and frozen parameters.
+        """
+        state_dict = model.state_dict()
+        for name in state_dict:
+            if name in self.shadow:
+                state_dict[name] = self.shadow[name]
+        return state_dict
+
 
 class CosineLRScheduler:
     """ Custom Learning Rate Scheduler from paper
@@ -114,6 +126,35 @@ class CosineLRScheduler:
         return chosen_lr
 
 
+class ResolutionScheduler:
+    """ Progressive resizing of the training inputs
+    The input size ramps linearly from min_scale * image_size up to image_size
+    over the first ramp_epochs and stays there, snapped down to multiples of
+    stride so that only a few sizes (and anchor sets) are ever used
+    Args:
+        image_size (int): final input size of the model
+        min_scale (float): fraction of image_size used at the first epoch
+        ramp_epochs (int): epochs until the full image_size is reached
+        stride (int): input sizes are multiples of it
+    """
+
+    def __init__(self, image_size, min_scale, ramp_epochs, stride):
+        self.image_size = image_size
+        self.min_scale = min_scale
+        self.ramp_epochs = ramp_epochs
+        self.stride = stride
+
+    def get_image_size(self, epoch):
+        progress = min(epoch / self.ramp_epochs, 1.) if self.ramp_epochs else 1.
+        scale = self.min_scale + (1. - self.min_scale) * progress
+        size = int(self.image_size * scale) // self.stride * self.stride
+        return min(max(size, self.stride), self.image_size)
+
+    def sizes(self, num_epochs):
+        """ Input size of every epoch """
+        return [self.get_image_size(epoch) for epoch in range(num_epochs)]
+
+
 def variance_scaling_(tensor, gain=1.):
     """
     VarianceScaling in https://keras.io/zh/initializers/
@@ -1,3 +1,5 @@
+import math
+
 import torch
 from PIL import Image
 import numpy as np
@@ -28,27 +30,85 @@ class NumpyToTensor:
         return torch_img, annotations
 
 
-class Resizer:
-    """ Scales image to the target size by the bigger side """
+def get_bucket(width: int, height: int, target_size: int, stride: int):
+    """ Tightest (height, width) canvas for an image scaled by the bigger side
+    to target_size, the smaller side is rounded up to a multiple of stride """
+    scale = target_size / max(width, height)
+    bucket_height = min(target_size, math.ceil(height * scale / stride) * stride)
+    bucket_width = min(target_size, math.ceil(width * scale / stride) * stride)
+    return bucket_height, bucket_width
+
+
+def open_draftable(fp):
+    """ Opens an image without decoding it and marks it as owned by the
+    pipeline, so that Resizer may draft it (changing it in place) """
+    img = Image.open(fp)
+    img.draftable = True
+    return img
 
-    def __init__(self, target_size: int, interpolation: str = 'bilinear'):
+
+class Resizer:
+    """ Scales image to the target size by the bigger side
+    target_size is either an integer (square canvas) or a (height, width) tuple.
+    If bucket_stride is given, the image is pasted into its tightest
+    aspect ratio bucket instead of the square target_size canvas.
+    With draft, a JPEG that is not decoded yet and was opened by open_draftable
+    is decoded at the smallest 1/2, 1/4 or 1/8 DCT scale still covering the
+    scaled size, geometry always follows the original image size.
+    Other images, e.g. ones passed in by callers, are never changed """
+
+    def __init__(self, target_size, interpolation: str = 'bilinear',
+                 bucket_stride: int = None, draft: bool = True):
         self.target_size = target_size
         self.interpolation = interpolation
+        self.bucket_stride = bucket_stride
+        self.draft = draft
+
+    def get_shape(self, width: int, height: int):
+        """ (canvas height, canvas width, scaled height, scaled width, scale)
+        of an image, only its size is needed """
+        if self.bucket_stride is not None:
+            target_height, target_width = get_bucket(
+                width, height, self.target_size, self.bucket_stride)
+        elif isinstance(self.target_size, int):
+            target_height, target_width = self.target_size, self.target_size
+        else:
+            target_height, target_width = self.target_size
 
-    def __call__(self, img, annotations: dict = None):
-        width, height = img.size
-        if height > width:
-            scale = self.target_size / height
-            scaled_height = self.target_size
+        if height * target_width > width * target_height:
+            scale = target_height / height
+            scaled_height = target_height
             scaled_width = int(width * scale)
         else:
-            scale = self.target_size / width
+            scale = target_width / width
             scaled_height = int(height * scale)
-            scaled_width = self.target_size
+            scaled_width = target_width
+        return target_height, target_width, scaled_height, scaled_width, scale
+
+    def _resize(self, img, width, height):
+        if self.draft and getattr(img, 'draftable', False):
+            # no-op for other formats and for already decoded images
+            img.draft('RGB', (width, height))
+        return img.convert('RGB').resize((width, height), Image.BILINEAR)
+
+    def resize_into(self, img, out: np.ndarray):
+        """ Writes the scaled image into the top left corner of out, a uint8
+        HWC slot at least as big as its canvas, and zeroes the rest of the slot.
+        Returns the scale back to the original image """
+        width, height = img.size
+        _, _, scaled_height, scaled_width, scale = self.get_shape(width, height)
+        out[:scaled_height, :scaled_width] = self._resize(img, scaled_width, scaled_height)
+        out[scaled_height:] = 0
+        out[:scaled_height, scaled_width:] = 0
+        return 1. / scale
+
+    def __call__(self, img, annotations: dict = None):
+        width, height = img.size
+        target_height, target_width, scaled_height, scaled_width, scale = \
+            self.get_shape(width, height)
 
-        new_img = Image.new("RGB", (self.target_size, self.target_size))
-        img = img.resize((scaled_width, scaled_height), Image.BILINEAR)
-        new_img.paste(img)
+        new_img = Image.new("RGB", (target_width, target_height))
+        new_img.paste(self._resize(img, scaled_width, scaled_height))
 
         if 'bbox' in annotations:
             bbox = annotations['bbox']
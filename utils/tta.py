@@ -0,0 +1,94 @@
+import torch
+import torch.nn.functional as F
+
+import config as cfg
+from utils.anchors import generate_detections_from_boxes
+from utils.processing import normalize, postprocess
+from utils.wrapper import DetectionWrapper
+
+
+class TTADetectionWrapper(DetectionWrapper):
+    """ Test-time augmentation in a single forward pass.
+    Flipped and downscaled views are stacked into the batch, their boxes are
+    mapped back to the original view on the device, and the candidates of all
+    views are fused by one top-k selection and one class-wise NMS per image """
+
+    def __init__(self, model, device, flip=cfg.TTA_FLIP, scales=cfg.TTA_SCALES,
+                 profiler=None):
+        super(TTADetectionWrapper, self).__init__(model, device, profiler=profiler)
+        assert all(0 < scale < 1 for scale in scales), \
+            'TTA scales should be in (0, 1), the original view is always used'
+        self.views = [(1., False)]
+        if flip:
+            self.views.append((1., True))
+        self.views += [(scale, False) for scale in scales]
+
+    def detect(self, x, img_ids, image_scales):
+        """ Detections for an already pre-processed input batch """
+        x = x.to(self.device)
+        batch_size, _, height, width = x.shape
+        n_views = len(self.views)
+
+        cls_outs, box_outs = self.model(self._build_views(x))
+        with self._stage('postprocess'):
+            cls_outs, box_outs, indices, classes = postprocess(
+                cls_outs, box_outs, self.num_classes)
+            boxes = self.anchors.decode(box_outs.float(), indices, (height, width))
+            boxes = self._undo_views(boxes, batch_size, width)
+
+            # [n_views * batch_size, K, ...] -> [batch_size, n_views * K, ...]
+            def _by_image(t):
+                t = t.reshape(n_views, batch_size, *t.shape[1:]).transpose(0, 1)
+                return t.reshape(batch_size, -1, *t.shape[3:])
+
+            cls_outs, boxes, classes = \
+                _by_image(cls_outs.float()), _by_image(boxes), _by_image(classes)
+
+            top_k = min(cfg.MAX_DETECTION_POINTS, cls_outs.shape[1])
+            _, top_indices = torch.topk(cls_outs.squeeze(-1), dim=1, k=top_k)
+            cls_outs = torch.gather(cls_outs, 1, top_indices.unsqueeze(2))
+            boxes = torch.gather(boxes, 1, top_indices.unsqueeze(2).expand(-1, -1, 4))
+            classes = torch.gather(classes, 1, top_indices)
+
+        with self._stage('generate_detections'):
+            batch_detections = []
+            cls_outs = cls_outs.cpu().numpy()
+            boxes = boxes.cpu().numpy()
+            classes = classes.cpu().numpy()
+            for i in range(batch_size):
+                detections = generate_detections_from_boxes(
+                    cls_outs[i], boxes[i], classes[i],
+                    img_ids[i], image_scales[i],
+                    self.num_classes, self.category_ids)
+                batch_detections.append(detections)
+
+        return batch_detections
+
+    def _build_views(self, x):
+        _, _, height, width = x.shape
+        black = normalize(torch.zeros(1, 3, 1, 1, dtype=torch.uint8, device=x.device))
+
+        views = []
+        for scale, flip in self.views:
+            view = x
+            if scale != 1.:
+                scaled = F.interpolate(x, scale_factor=scale, mode='bilinear',
+                                       align_corners=False)
+                view = black.expand_as(x).clone()
+                view[..., :scaled.shape[2], :scaled.shape[3]] = scaled
+            if flip:
+                view = view.flip(-1)
+            views.append(view)
+        return torch.cat(views)
+
+    def _undo_views(self, boxes, batch_size, width):
+        """ Maps [n_views * batch_size, K, 4] (ymin, xmin, ymax, xmax) boxes back """
+        boxes = boxes.reshape(len(self.views), batch_size, *boxes.shape[1:]).clone()
+        for idx, (scale, flip) in enumerate(self.views):
+            if flip:
+                xmin = width - boxes[idx, ..., 3]
+                xmax = width - boxes[idx, ..., 1]
+                boxes[idx, ..., 1], boxes[idx, ..., 3] = xmin, xmax
+            if scale != 1.:
+                boxes[idx] /= scale
+        return boxes.reshape(-1, *boxes.shape[2:])
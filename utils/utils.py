@@ -3,7 +3,6 @@ import random
 
 import numpy as np
 import torch
-from torch.hub import download_url_to_file
 
 
 def check_model_name(model_name):
@@ -138,4 +137,5 @@ def download_model_weights(model_name, filename):
         'efficientnet-b6': 'https://github.com/lukemelas/EfficientNet-PyTorch/releases/download/1.0/efficientnet-b6-c76e70fd.pth',
         'efficientnet-b7': 'https://github.com/lukemelas/EfficientNet-PyTorch/releases/download/1.0/efficientnet-b7-dcc49843.pth',
     }
+    from torch.hub import download_url_to_file
     download_url_to_file(model_to_url[model_name], filename)
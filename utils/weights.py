@@ -0,0 +1,99 @@
+"""
+Flat weight storage for multi-replica CPU serving.
+All tensors of a state dict are stored in one raw binary blob (`.bin`)
+next to a JSON index (`.json`) with their dtype, shape and offset.
+The blob is memory-mapped copy-on-write, so replicas in all processes share
+a single page-cache copy of the weights as long as they don't write to them.
+
+    python -m utils.weights weights/efficientdet-d0.pth weights/efficientdet-d0.bin
+"""
+import argparse
+import json
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+FLAT_SUFFIX = '.bin'
+INDEX_SUFFIX = '.json'
+ALIGNMENT = 64
+
+
+def is_flat_weights(path):
+    path = Path(path)
+    return path.suffix == FLAT_SUFFIX and path.with_suffix(INDEX_SUFFIX).exists()
+
+
+def export_flat_weights(state_dict, path):
+    """ Writes a state dict to a flat blob and its index """
+    path = Path(path)
+    index = OrderedDict()
+    offset = 0
+    with open(path, 'wb') as f:
+        for name, tensor in state_dict.items():
+            array = tensor.detach().cpu().contiguous().numpy()
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+
+            f.write(array.tobytes())
+            index[name] = {'dtype': array.dtype.str,
+                           'shape': list(array.shape),
+                           'offset': offset}
+            offset += array.nbytes
+
+    with open(path.with_suffix(INDEX_SUFFIX), 'w') as f:
+        json.dump(index, f, indent=4)
+
+
+def load_flat_weights(path):
+    """ Maps a flat blob to a state dict of CPU tensors without copying """
+    path = Path(path)
+    with open(path.with_suffix(INDEX_SUFFIX)) as f:
+        index = json.load(f, object_pairs_hook=OrderedDict)
+
+    blob = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = OrderedDict()
+    for name, meta in index.items():
+        dtype = np.dtype(meta['dtype'])
+        n_bytes = int(np.prod(meta['shape'])) * dtype.itemsize
+        array = blob[meta['offset']:meta['offset'] + n_bytes].view(dtype)
+        state_dict[name] = torch.from_numpy(array.reshape(meta['shape']))
+    return state_dict
+
+
+def assign_state_dict(model, state_dict, strict=True):
+    """ Points parameters and buffers of the model to the state dict tensors
+    instead of copying them as load_state_dict does """
+    expected = set(model.state_dict().keys())
+    unexpected = set(state_dict.keys()) - expected
+    missing = expected - set(state_dict.keys())
+    if strict and (unexpected or missing):
+        raise KeyError('Missing keys: {}, unexpected keys: {}'.format(
+            sorted(missing), sorted(unexpected)))
+
+    modules = dict(model.named_modules())
+    for name, tensor in state_dict.items():
+        if name in unexpected:
+            continue
+        module_name, _, attr = name.rpartition('.')
+        module = modules[module_name]
+        if attr in module._parameters:
+            requires_grad = module._parameters[attr].requires_grad
+            module._parameters[attr] = nn.Parameter(tensor, requires_grad=requires_grad)
+        else:
+            module._buffers[attr] = tensor
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a .pth checkpoint to flat weights')
+    parser.add_argument('checkpoint', type=str)
+    parser.add_argument('output', type=str)
+    args = parser.parse_args()
+
+    export_flat_weights(torch.load(args.checkpoint, map_location='cpu'), args.output)
+    print('Saved {} and its index'.format(args.output))
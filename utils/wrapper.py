@@ -1,42 +1,65 @@
+from contextlib import nullcontext
+
 import torch
 import torch.nn as nn
 
 import config as cfg
-from utils.anchors import Anchors, generate_detections
-from utils.processing import postprocess, preprocess
+from utils.anchors import Anchors, generate_detections_from_boxes
+from utils.processing import BatchArena, postprocess, preprocess
 
 
 class DetectionWrapper(nn.Module):
-    """ Wrapper on top of the model. Pre-process and postprocess raw data """
-    def __init__(self, model, device):
+    """ Wrapper on top of the model. Pre-process and postprocess raw data
+    The input size comes from the wrapped model, each wrapper owns its anchor cache """
+    def __init__(self, model, device, profiler=None):
         super(DetectionWrapper, self).__init__()
         self.model = model
         self.device = device
+        self.image_size = model.image_size
+        self.num_classes = model.num_classes
+        self.category_ids = model.category_ids
         self.anchors = Anchors(
             cfg.MIN_LEVEL, cfg.MAX_LEVEL,
             cfg.NUM_SCALES, cfg.ASPECT_RATIOS,
-            cfg.ANCHOR_SCALE, cfg.MODEL.IMAGE_SIZE)
-        self._anchor_cache = None
-
-    def forward(self, image_paths, image_ids=None):
-        x, img_ids, image_scales = preprocess(image_paths, image_ids)
-        cls_outs, box_outs = self.model(x.to(self.device))
-        cls_outs, box_outs, indices, classes = postprocess(cls_outs, box_outs)
-
-        batch_detections = []
-        cls_outs = cls_outs.cpu().numpy()
-        box_outs = box_outs.cpu().numpy()
-        if self._anchor_cache is None:
-            anchor_boxes = self.anchors.boxes.cpu().numpy()
-            self._anchor_cache = anchor_boxes
-        else:
-            anchor_boxes = self._anchor_cache
-        indices = indices.cpu().numpy()
-        classes = classes.cpu().numpy()
-        for i in range(x.shape[0]):
-            detections = generate_detections(
-                cls_outs[i], box_outs[i], anchor_boxes, indices[i], classes[i],
-                image_ids[i], image_scales[i], cfg.NUM_CLASSES)
-            batch_detections.append(detections)
+            cfg.ANCHOR_SCALE, self.image_size,
+            cache_size=cfg.ANCHOR_CACHE_SIZE).to(device)
+        # input batches are reused buffers, pinned for a CUDA device
+        self.arena = BatchArena(pin_memory=torch.device(device).type == 'cuda') \
+            if cfg.BATCH_ARENA else None
+        self.profiler = profiler
+        if self.profiler is not None:
+            self.profiler.attach(self.model)
+
+    def forward(self, images, image_ids=None):
+        """ images: a list of image paths, encoded image bytes or PIL images """
+        with self._stage('preprocess'):
+            x, img_ids, image_scales = preprocess(images, image_ids, self.image_size,
+                                                  self.arena)
+        return self.detect(x, img_ids, image_scales)
+
+    def detect(self, x, img_ids, image_scales):
+        """ Detections for an already pre-processed input batch """
+        cls_outs, box_outs = self.model(x.to(self.device, non_blocking=True))
+        with self._stage('postprocess'):
+            cls_outs, box_outs, indices, classes = postprocess(
+                cls_outs, box_outs, self.num_classes)
+            boxes = self.anchors.decode(box_outs.float(), indices, tuple(x.shape[-2:]))
+
+        with self._stage('generate_detections'):
+            batch_detections = []
+            cls_outs = cls_outs.float().cpu().numpy()
+            boxes = boxes.cpu().numpy()
+            classes = classes.cpu().numpy()
+            for i in range(x.shape[0]):
+                detections = generate_detections_from_boxes(
+                    cls_outs[i], boxes[i], classes[i],
+                    img_ids[i], image_scales[i],
+                    self.num_classes, self.category_ids)
+                batch_detections.append(detections)
 
         return batch_detections
+
+    def _stage(self, name):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name)
@@ -2,56 +2,101 @@ import argparse
 import json
 import os
 import time
+from collections import defaultdict
+from pathlib import Path
 
 import torch
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from tqdm import tqdm
 
 import config as cfg
 from log.logger import logger
 from utils import DetectionWrapper
-
-
-def validate(model, device, writer=None, save_filename=None, best_score=0.0):
-    """ COCO VAL2017 """
-    model.eval()
-    wrapper = DetectionWrapper(model, device)
+from utils.input_cache import InputCache
+from utils.processing import normalize
+from utils.transforms import get_bucket
+
+
+def weights_path(save_filename):
+    """ Where the best weights are saved: a bare file name goes to WEIGHTS_PATH,
+    a path (e.g. cfg.MODEL.SAVE_PATH, which includes WEIGHTS_PATH) is used as is """
+    save_path = Path(save_filename)
+    if save_path.parent == Path('.'):
+        return cfg.WEIGHTS_PATH / save_path
+    return save_path
+
+
+def make_batches(coco_gt, image_ids, batch_size, image_size):
+    """ Splits image ids into batches. With aspect ratio bucketing
+    images sharing a bucket are batched together """
+    if not cfg.ASPECT_BUCKETING:
+        return [image_ids[i:i + batch_size]
+                for i in range(0, len(image_ids), batch_size)]
+
+    groups = defaultdict(list)
+    for image_id in image_ids:
+        image_info = coco_gt.imgs[image_id]
+        bucket = get_bucket(image_info['width'], image_info['height'],
+                            image_size, cfg.BUCKET_STRIDE)
+        groups[bucket].append(image_id)
+
+    batches = []
+    for bucket in sorted(groups):
+        ids = groups[bucket]
+        batches += [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    return batches
+
+
+def get_input_cache(coco_gt, wrapper):
+    """ Cached preprocessed inputs, for wrappers running the standard
+    preprocessing (not for cascades or tiled inference) """
+    if not cfg.VAL_CACHE or not isinstance(wrapper, DetectionWrapper) or \
+            type(wrapper).forward is not DetectionWrapper.forward:
+        return None
+    bucket_stride = cfg.BUCKET_STRIDE if cfg.ASPECT_BUCKETING else None
+    return InputCache(cfg.VAL_CACHE_PATH, cfg.VAL_SET, cfg.VAL_ANNOTATIONS,
+                      coco_gt.imgs, wrapper.image_size, bucket_stride)
+
+
+def evaluate(wrapper, image_ids=None):
+    """ Runs the wrapper on VAL2017 (or on a subset of its image ids),
+    returns COCO bbox stats and throughput in images/sec """
+    from pycocotools.coco import COCO
+    from pycocotools.cocoeval import COCOeval
+    from tqdm import tqdm
 
     coco_gt = COCO(cfg.VAL_ANNOTATIONS)
-    image_ids = coco_gt.getImgIds()
-
-    batch_paths = []
-    batch_ids = []
+    if image_ids is None:
+        image_ids = coco_gt.getImgIds()
+    cache = get_input_cache(coco_gt, wrapper)
 
     processed_img_ids = []
     results = []
 
+    start = time.time()
     with torch.no_grad():
-        for idx, image_id in tqdm(enumerate(image_ids)):
-            image_info = coco_gt.loadImgs(image_id)[0]
-            image_path = cfg.VAL_SET / image_info['file_name']
-
-            batch_paths.append(image_path)
-            batch_ids.append(image_id)
-
-            if (idx + 1) % cfg.BATCH_SIZE == 0:
+        for batch_ids in tqdm(make_batches(coco_gt, image_ids, cfg.BATCH_SIZE,
+                                           wrapper.image_size)):
+            if cache is not None:
+                x, scales = cache.batch(batch_ids)
+                output = wrapper.detect(normalize(x), batch_ids, scales)
+            else:
+                batch_paths = [cfg.VAL_SET / coco_gt.imgs[image_id]['file_name']
+                               for image_id in batch_ids]
                 output = wrapper(batch_paths, batch_ids)
-                for batch_out in output:
-                    for det in batch_out:
-                        image_id = int(det[0])
-                        score = float(det[5])
-                        coco_det = {
-                            'image_id': image_id,
-                            'bbox': det[1:5].tolist(),
-                            'score': score,
-                            'category_id': int(det[6]),
-                        }
-                        processed_img_ids.append(image_id)
-                        results.append(coco_det)
-
-                batch_paths = []
-                batch_ids = []
+            for batch_out in output:
+                for det in batch_out:
+                    image_id = int(det[0])
+                    score = float(det[5])
+                    coco_det = {
+                        'image_id': image_id,
+                        'bbox': det[1:5].tolist(),
+                        'score': score,
+                        'category_id': int(det[6]),
+                    }
+                    processed_img_ids.append(image_id)
+                    results.append(coco_det)
+
+    images_per_sec = len(image_ids) / (time.time() - start)
+    logger('Validation throughput: {:.2f} images/sec'.format(images_per_sec))
 
     json.dump(results, open(cfg.COCO_RESULTS, 'w'), indent=4)
 
@@ -63,13 +108,36 @@ def validate(model, device, writer=None, save_filename=None, best_score=0.0):
     coco_eval.accumulate()
     coco_eval.summarize()
 
-    if save_filename is not None and best_score < coco_eval.stats[0]:
-        logger('Saving model weights with score: {}'.format(coco_eval.stats[0]))
-        torch.save(model.state_dict(), cfg.WEIGHTS_PATH / save_filename)
-        best_score = coco_eval.stats[0]
+    return coco_eval.stats, images_per_sec
+
+
+def validate(model, device, writer=None, save_filename=None, best_score=0.0,
+             profiler=None, wrapper=None):
+    """ COCO VAL2017
+    wrapper: optional DetectionWrapper subclass instance (e.g. with TTA or a cascade) """
+    model.eval()
+    if wrapper is None:
+        wrapper = DetectionWrapper(model, device, profiler=profiler)
+
+    stats, images_per_sec = evaluate(wrapper)
+
+    if save_filename is not None and best_score < stats[0]:
+        logger('Saving model weights with score: {}'.format(stats[0]))
+        torch.save(model.state_dict(), weights_path(save_filename))
+        best_score = stats[0]
+
+    if writer is not None:
+        writer.add_scalar("Eval/mAP", stats[0], writer.eval_step)
+        writer.add_scalar("Eval/images_per_sec", images_per_sec, writer.eval_step)
+
+    if profiler is not None:
+        profiler.detach()
+        profiler.dump(cfg.PROFILE_REPORT)
+        logger('Saved profiling report to {}'.format(cfg.PROFILE_REPORT))
+        if writer is not None:
+            profiler.write(writer, writer.eval_step)
 
     if writer is not None:
-        writer.add_scalar("Eval/mAP", coco_eval.stats[0], writer.eval_step)
         writer.eval_step += 1
 
     return model, writer, best_score